@@ -7,32 +7,228 @@
 
 import os
 import re
+import queue
+import atexit
+import base64
+import bisect
+import heapq
+import hashlib
+import hmac
+import csv
+import gc
+import importlib
+import inspect
+import io
+import itertools
+import json
 import logging
+import logging.handlers
+import mmap
 import secrets
 import string
+import struct
 import time
-import jwt
-import bcrypt
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import threading
+import weakref
+import zlib
 from datetime import datetime, timedelta, timezone
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+import concurrent.futures
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import wraps
-from typing import Optional, Dict, Any, Tuple, List
-from dataclasses import dataclass
-from enum import Enum
-from threading import Lock
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('auth_service.log'),
-        logging.StreamHandler()
-    ]
+from operator import attrgetter
+from typing import (
+    TYPE_CHECKING, Optional, Dict, Any, Tuple, List, Set, Iterable, Iterator, Callable, IO, Union
 )
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass, field, fields, replace
+from enum import Enum
+from threading import Lock, Thread
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+class _LazyModule:
+    """Placeholder for a heavy dependency that imports it on first attribute access.
+
+    The real module then replaces the placeholder in this module's globals, so
+    later lookups cost nothing extra.
+    """
+    def __init__(self, name: str, alias: Optional[str] = None):
+        self._name = name
+        self._alias = alias or name
+
+    def __getattr__(self, attr: str) -> Any:
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._name!r}>"
+
+if TYPE_CHECKING:
+    import asyncio
+    import bcrypt
+    import smtplib
+    import sqlite3
+    from email.mime.multipart import MIMEMultipart
+    from cryptography import exceptions as crypto_exceptions
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, utils as asym_utils
+else:
+    # Only token verification is needed by many callers; the bcrypt, SMTP,
+    # SQLite and asyncio stacks load when a code path first touches them
+    asyncio = _LazyModule('asyncio')
+    bcrypt = _LazyModule('bcrypt')
+    smtplib = _LazyModule('smtplib')
+    sqlite3 = _LazyModule('sqlite3')
+    # Only the ES256/EdDSA token mode needs the cryptography package
+    crypto_exceptions = _LazyModule('cryptography.exceptions', 'crypto_exceptions')
+    hashes = _LazyModule('cryptography.hazmat.primitives.hashes', 'hashes')
+    serialization = _LazyModule('cryptography.hazmat.primitives.serialization', 'serialization')
+    ec = _LazyModule('cryptography.hazmat.primitives.asymmetric.ec', 'ec')
+    ed25519 = _LazyModule('cryptography.hazmat.primitives.asymmetric.ed25519', 'ed25519')
+    asym_utils = _LazyModule('cryptography.hazmat.primitives.asymmetric.utils', 'asym_utils')
+
 logger = logging.getLogger(__name__)
+# Importing the module configures nothing; applications call configure_logging()
+logger.addHandler(logging.NullHandler())
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def configure_logging(level: int = logging.INFO, log_file: Optional[str] = 'auth_service.log',
+                      stream: bool = True) -> None:
+    """Send INFO logs to ``log_file`` and stderr, as the service did by default.
+
+    A no-op when the root logger already has handlers (see logging.basicConfig).
+    Call it before enable_async_logging() so the queue pipeline picks them up.
+    """
+    if logging.getLogger().handlers:
+        # Opening the FileHandler here would create the file and leak its handle
+        return
+    handlers: List[logging.Handler] = []
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    if stream:
+        handlers.append(logging.StreamHandler())
+    logging.basicConfig(level=level, format=LOG_FORMAT, handlers=handlers or [logging.NullHandler()])
+
+# Passed as ``extra=`` on high-volume success events so they can be sampled
+_SAMPLED = {'auth_sampled': True}
+
+class SuccessSampler(logging.Filter):
+    """Keeps ``rate`` of the records marked with _SAMPLED; everything else passes"""
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self.sampled_out = 0
+        self._credit = 0.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1.0 or not getattr(record, 'auth_sampled', False):
+            return True
+        # Unlocked on purpose: a lost update only nudges the sampling ratio
+        self._credit += self.rate
+        if self._credit >= 1.0:
+            self._credit -= 1.0
+            return True
+        self.sampled_out += 1
+        return False
+
+class _BoundedQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge msg % args on the caller's thread, while the args still hold the
+        # values being logged; formatting is left to the listener thread
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+class _DrainingQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Block rather than fail when the bounded queue is full at shutdown
+        self.queue.put(self._sentinel)
+
+class AsyncLogPipeline:
+    """Moves the root handlers behind a background QueueListener.
+
+    Request threads only merge each message with its args and append the record
+    to a bounded queue; formatting and all file/stream I/O happen on the
+    listener thread. Records that arrive while the
+    queue is full are dropped and counted instead of blocking the caller.
+    """
+    def __init__(self, max_queue: int = 10000, success_sample_rate: float = 1.0,
+                 handlers: Optional[List[logging.Handler]] = None):
+        self.max_queue = max_queue
+        self.handlers = list(handlers if handlers is not None else logging.getLogger().handlers)
+        self.handler = _BoundedQueueHandler(queue.Queue(max_queue))
+        self.sampler = SuccessSampler(success_sample_rate)
+        self.handler.addFilter(self.sampler)
+        self.listener = _DrainingQueueListener(self.handler.queue, *self.handlers, respect_handler_level=True)
+        self._running = False
+
+    def start(self) -> None:
+        root = logging.getLogger()
+        for handler in self.handlers:
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        self.listener.start()
+        self._running = True
+
+    def stop(self) -> None:
+        """Flush queued records and put the original handlers back"""
+        root = logging.getLogger()
+        root.removeHandler(self.handler)
+        if self._running:
+            self._running = False
+            self.listener.stop()
+        for handler in self.handlers:
+            root.addHandler(handler)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'depth': self.handler.queue.qsize(),
+            'max_queue': self.max_queue,
+            'enqueued': self.handler.enqueued,
+            'dropped': self.handler.dropped,
+            'sampled_out': self.sampler.sampled_out
+        }
+
+_log_pipeline: Optional[AsyncLogPipeline] = None
+_log_pipeline_lock = threading.Lock()
+
+def enable_async_logging(max_queue: int = 10000, success_sample_rate: float = 1.0) -> AsyncLogPipeline:
+    """Switch the process to queue-based logging; later calls return the running pipeline"""
+    global _log_pipeline
+    with _log_pipeline_lock:
+        if _log_pipeline is None:
+            _log_pipeline = AsyncLogPipeline(max_queue, success_sample_rate)
+            _log_pipeline.start()
+            atexit.register(_log_pipeline.stop)
+        return _log_pipeline
+
+def disable_async_logging() -> None:
+    global _log_pipeline
+    with _log_pipeline_lock:
+        if _log_pipeline is not None:
+            atexit.unregister(_log_pipeline.stop)
+            _log_pipeline.stop()
+            _log_pipeline = None
 
 class AuthError(Exception):
     """Base authentication error class"""
@@ -45,6 +241,11 @@ class ValidationError(AuthError):
     """Input validation error"""
     pass
 
+class ConflictError(ValidationError):
+    """Request clashes with existing state, e.g. an email already registered"""
+    def __init__(self, message: str, code: int = 409):
+        super().__init__(message, code)
+
 class AuthenticationError(AuthError):
     """Authentication failure error"""
     pass
@@ -57,6 +258,14 @@ class TokenError(AuthError):
     """Token related error"""
     pass
 
+class ServiceOverloadedError(AuthError):
+    """Service is temporarily over capacity"""
+    pass
+
+class RateLimitError(AuthError):
+    """Request rejected by rate limiting"""
+    pass
+
 class PasswordStrength(Enum):
     WEAK = 1
     MEDIUM = 2
@@ -64,31 +273,135 @@ class PasswordStrength(Enum):
 
 @dataclass
 class User:
+    # Slotted with epoch-second timestamps to keep per-user overhead small
+    __slots__ = (
+        'id', 'email', 'password_hash', 'is_active', 'is_verified',
+        'created_at', 'last_login', 'failed_login_attempts', 'last_failed_login'
+    )
     id: str
     email: str
     password_hash: str
     is_active: bool
     is_verified: bool
-    created_at: datetime
-    last_login: Optional[datetime]
+    created_at: int
+    last_login: Optional[int]
     failed_login_attempts: int
-    last_failed_login: Optional[datetime]
+    last_failed_login: Optional[int]
 
 @dataclass
 class TokenPayload:
+    # Claims kept as epoch seconds; ``exp``/``iat`` datetimes are built on access
+    __slots__ = ('user_id', 'email', 'expires_at', 'issued_at')
     user_id: str
     email: str
-    exp: datetime
-    iat: datetime
+    expires_at: int
+    issued_at: int
+
+    @property
+    def exp(self) -> datetime:
+        return datetime.fromtimestamp(self.expires_at, timezone.utc)
+
+    @property
+    def iat(self) -> datetime:
+        return datetime.fromtimestamp(self.issued_at, timezone.utc)
+
+@dataclass
+class SweepStats:
+    evicted_reset_tokens: int = 0
+    evicted_refresh_tokens: int = 0
+    batches: int = 0
+    lock_held_seconds: float = 0.0
+    max_lock_hold_seconds: float = 0.0
+    # Stale expiry-heap entries dropped by compaction
+    compacted_entries: int = 0
+
+@dataclass
+class ExportBatch:
+    """One chunk of a repository snapshot, see UserStore.iter_snapshot"""
+    users: List[User] = field(default_factory=list)
+    # (user id, token digest, expires_at) of refresh tokens live at snapshot time
+    sessions: List[Tuple[str, bytes, int]] = field(default_factory=list)
+
+# Field values of a User as a tuple, in constructor order
+_user_fields = attrgetter(*(f.name for f in fields(User)))
+
+def token_digest(token: str) -> bytes:
+    """32-byte SHA-256 digest used as the storage key for opaque tokens"""
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+def _isoformat(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
 
 class AuthConfig:
     def __init__(self):
         self.jwt_secret = os.getenv('JWT_SECRET', secrets.token_urlsafe(64))
+        # Rotating HS256 key ring as "kid:secret,kid:secret"; tokens without a kid
+        # header keep verifying against jwt_secret
+        self.jwt_keys = os.getenv('JWT_KEYS', '')
+        self.jwt_active_kid = os.getenv('JWT_ACTIVE_KID', '')
+        # HS256 signs with the shared secret above. ES256/EdDSA sign with private
+        # keys from JWT_PRIVATE_KEYS ("kid:/path/key.pem,...") whose public halves
+        # are published as JWKS, so other services can verify tokens locally
+        self.jwt_algorithm = os.getenv('JWT_ALGORITHM', 'HS256')
+        self.jwt_private_keys = os.getenv('JWT_PRIVATE_KEYS', '')
         self.jwt_expiry_minutes = int(os.getenv('JWT_EXPIRY_MINUTES', 60))
         self.refresh_token_expiry_days = int(os.getenv('REFRESH_TOKEN_EXPIRY_DAYS', 7))
         self.max_failed_attempts = int(os.getenv('MAX_FAILED_ATTEMPTS', 5))
         self.lockout_minutes = int(os.getenv('LOCKOUT_MINUTES', 15))
         self.password_min_length = int(os.getenv('PASSWORD_MIN_LENGTH', 8))
+        self.token_cache_size = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+        self.token_sweep_interval_seconds = float(os.getenv('TOKEN_SWEEP_INTERVAL_SECONDS', 60))
+        self.token_sweep_batch_size = int(os.getenv('TOKEN_SWEEP_BATCH_SIZE', 1000))
+        # Users per snapshot export batch; bounds both export memory and how long
+        # each batch holds the repository locks
+        self.export_batch_size = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+        self.metrics_enabled = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+        
+        # Queue-based logging; success events are kept at LOG_SUCCESS_SAMPLE_RATE
+        self.log_async = os.getenv('LOG_ASYNC', 'false').lower() == 'true'
+        self.log_queue_size = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+        self.log_success_sample_rate = float(os.getenv('LOG_SUCCESS_SAMPLE_RATE', 1.0))
+        
+        # Login rate limiting, checked before any password hashing (0 disables).
+        # The per-email limit is off by default so existing callers keep their
+        # login behaviour; 10/minute is a reasonable setting against credential
+        # stuffing. The per-client limit only applies when login_user gets a client_id.
+        self.login_rate_email_per_minute = float(os.getenv('LOGIN_RATE_EMAIL_PER_MINUTE', 0))
+        self.login_rate_email_burst = int(os.getenv('LOGIN_RATE_EMAIL_BURST', 10))
+        self.login_rate_client_per_minute = float(os.getenv('LOGIN_RATE_CLIENT_PER_MINUTE', 60))
+        self.login_rate_client_burst = int(os.getenv('LOGIN_RATE_CLIENT_BURST', 60))
+        self.login_rate_max_keys = int(os.getenv('LOGIN_RATE_MAX_KEYS', 100000))
+        self.hash_executor = os.getenv('HASH_EXECUTOR', 'thread')
+        self.hash_workers = int(os.getenv('HASH_WORKERS', os.cpu_count() or 1))
+        self.hash_queue_size = int(os.getenv('HASH_QUEUE_SIZE', 64))
+        # Threads AsyncAuthService uses for repository calls on blocking stores
+        self.async_repo_workers = int(os.getenv('ASYNC_REPO_WORKERS', 16))
+        self.bcrypt_rounds = int(os.getenv('BCRYPT_ROUNDS', 12))
+        # When set, bcrypt_rounds is calibrated at startup to hit this hash latency
+        self.bcrypt_target_ms = float(os.getenv('BCRYPT_TARGET_MS', 0))
+        self.bcrypt_min_rounds = int(os.getenv('BCRYPT_MIN_ROUNDS', 10))
+        self.bcrypt_max_rounds = int(os.getenv('BCRYPT_MAX_ROUNDS', 16))
+        
+        # User storage backend: 'memory' or 'sqlite'
+        self.user_store = os.getenv('USER_STORE', 'memory')
+        self.sqlite_path = os.getenv('SQLITE_PATH', 'auth_users.db')
+        self.sqlite_write_batch_size = int(os.getenv('SQLITE_WRITE_BATCH_SIZE', 64))
+        self.sqlite_write_batch_delay_ms = int(os.getenv('SQLITE_WRITE_BATCH_DELAY_MS', 50))
+        
+        # Journal + snapshot persistence for the memory store ('' disables)
+        self.persistence_dir = os.getenv('PERSISTENCE_DIR', '')
+        self.journal_fsync = os.getenv('JOURNAL_FSYNC', 'true').lower() == 'true'
+        self.journal_commit_window_ms = float(os.getenv('JOURNAL_COMMIT_WINDOW_MS', 2))
+        self.snapshot_interval_seconds = float(os.getenv('SNAPSHOT_INTERVAL_SECONDS', 3600))
+        
+        # Refresh-token storage: 'local' (in the user store) or 'shared' (mmap file
+        # visible to every worker process on the host; pair with USER_STORE=sqlite)
+        self.session_store = os.getenv('SESSION_STORE', 'local')
+        self.session_shm_path = os.getenv(
+            'SESSION_SHM_PATH',
+            '/dev/shm/aep201-sessions' if os.path.isdir('/dev/shm') else 'aep201-sessions'
+        )
+        self.session_shm_slots = int(os.getenv('SESSION_SHM_SLOTS', 1 << 20))
         
         # Email configuration
         self.smtp_host = os.getenv('SMTP_HOST', 'smtp.gmail.com')
@@ -96,191 +409,3370 @@ class AuthConfig:
         self.smtp_username = os.getenv('SMTP_USERNAME', '')
         self.smtp_password = os.getenv('SMTP_PASSWORD', '')
         self.from_email = os.getenv('FROM_EMAIL', 'noreply@aep.com')
+        self.smtp_use_tls = os.getenv('SMTP_USE_TLS', 'true').lower() == 'true'
+        self.smtp_timeout_seconds = float(os.getenv('SMTP_TIMEOUT_SECONDS', 10))
+        
+        # Background email delivery
+        self.email_async_delivery = os.getenv('EMAIL_ASYNC_DELIVERY', 'true').lower() == 'true'
+        self.email_workers = int(os.getenv('EMAIL_WORKERS', 2))
+        self.email_queue_size = int(os.getenv('EMAIL_QUEUE_SIZE', 1000))
+        self.smtp_max_messages_per_connection = int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', 100))
+        self.smtp_idle_timeout_seconds = float(os.getenv('SMTP_IDLE_TIMEOUT_SECONDS', 30))
+        self.email_max_retries = int(os.getenv('EMAIL_MAX_RETRIES', 3))
+        self.email_retry_backoff_seconds = float(os.getenv('EMAIL_RETRY_BACKOFF_SECONDS', 0.5))
+        # Emails that failed for good are kept (newest last) for inspection
+        self.email_dead_letter_size = int(os.getenv('EMAIL_DEAD_LETTER_SIZE', 1000))
+        # How long interpreter exit waits for queued emails to go out
+        self.email_shutdown_timeout_seconds = float(os.getenv('EMAIL_SHUTDOWN_TIMEOUT_SECONDS', 10))
+
+def _bcrypt_hash(password: bytes, rounds: int = 12) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+def _bcrypt_check(password: bytes, password_hash: bytes) -> bool:
+    return bcrypt.checkpw(password, password_hash)
+
+def bcrypt_cost(password_hash: str) -> Optional[int]:
+    """Work factor encoded in a bcrypt hash such as ``$2b$12$...``"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+def calibrate_bcrypt_rounds(target_ms: float, min_rounds: int = 10, max_rounds: int = 16) -> Dict[str, Any]:
+    """Find the highest bcrypt cost whose hash time stays within target_ms on this CPU.
+
+    Each cost step doubles the work, so the search stops at the first cost that
+    overshoots the target. Never returns less than ``min_rounds``.
+    """
+    timings: Dict[int, float] = {}
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        # Best of two runs to filter out scheduler noise
+        elapsed_ms = min(_timed_bcrypt_hash_ms(rounds) for _ in range(2))
+        timings[rounds] = elapsed_ms
+        if elapsed_ms > target_ms:
+            break
+        chosen = rounds
+    return {
+        'rounds': chosen,
+        'target_ms': target_ms,
+        'measured_ms': timings[chosen],
+        'timings_ms': timings
+    }
+
+def _timed_bcrypt_hash_ms(rounds: int) -> float:
+    started = time.perf_counter()
+    _bcrypt_hash(b'calibration-password', rounds)
+    return (time.perf_counter() - started) * 1000
+
+class HashingExecutor:
+    """Bounded worker pool that runs bcrypt off the caller's thread.
+
+    At most ``max_workers`` hashes run at once and at most ``max_queue`` more may
+    wait for a worker. Anything beyond that is rejected immediately with
+    ServiceOverloadedError rather than queued without limit.
+    """
+    def __init__(self, max_workers: int, max_queue: int, kind: str = 'thread', rounds: int = 12):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if kind == 'thread':
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bcrypt')
+        elif kind == 'process':
+            self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            raise ValueError(f"Unknown hash executor kind: {kind}")
+        self.kind = kind
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._lock = Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ServiceOverloadedError("Service overloaded, please retry later", 503)
+            self._pending += 1
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future: Optional[Future]) -> None:
+        with self._lock:
+            self._pending -= 1
+            if _future is not None:
+                self.completed += 1
+
+    def submit_hash(self, password: str) -> Future:
+        return self.submit(_bcrypt_hash, password.encode('utf-8'), self.rounds)
+
+    def submit_verify(self, password: str, password_hash: str) -> Future:
+        return self.submit(_bcrypt_check, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+    def hash_password(self, password: str) -> str:
+        return self.submit_hash(password).result().decode('utf-8')
+
+    def verify_password(self, password: str, password_hash: str) -> bool:
+        return self.submit_verify(password, password_hash).result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'kind': self.kind,
+                'rounds': self.rounds,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'pending': self._pending,
+                'completed': self.completed,
+                'rejected': self.rejected
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+_LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+class _Histogram:
+    __slots__ = ('counts', 'total', 'count')
 
-class UserRepository:
     def __init__(self):
+        self.counts = [0] * (len(_LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(_LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation"""
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if bucket_count and seen >= rank:
+                return _LATENCY_BUCKETS[i] if i < len(_LATENCY_BUCKETS) else float('inf')
+        return 0.0
+
+class _StageTimer:
+    __slots__ = ('_metrics', '_name', '_labels', '_started')
+
+    def __init__(self, metrics: 'AuthMetrics', name: str, labels: Tuple[Tuple[str, str], ...]):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self) -> '_StageTimer':
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._metrics._observe(self._name, self._labels, time.perf_counter() - self._started)
+
+_NULL_TIMER = nullcontext()
+
+class AuthMetrics:
+    """Latency histograms and counters for the auth service.
+
+    Histograms: ``stage_seconds`` (hash, verify_password, lock_wait, jwt_encode,
+    jwt_decode, email_send, repository) and ``method_seconds`` per public
+    method. Counters: ``outcomes_total`` per method and outcome, and
+    ``events_total`` for notable events such as lockouts. When disabled every
+    hook returns immediately, so instrumentation costs a flag check.
+    """
+    def __init__(self, enabled: bool = False, namespace: str = 'aep_auth'):
+        self.enabled = enabled
+        self.namespace = namespace
+        self._lock = Lock()
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], _Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], int] = {}
+
+    def timer(self, name: str, **labels: str):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, name, tuple(sorted(labels.items())))
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        if self.enabled:
+            self._observe(name, tuple(sorted(labels.items())), seconds)
+
+    def _observe(self, name: str, labels: Tuple[Tuple[str, str], ...], seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = _Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name: str, amount: int = 1, **labels: str) -> None:
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    @staticmethod
+    def _label_key(labels: Tuple[Tuple[str, str], ...]) -> str:
+        return ','.join(f'{k}={v}' for k, v in labels)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            histograms: Dict[str, Dict[str, Any]] = {}
+            for (name, labels), histogram in self._histograms.items():
+                histograms.setdefault(name, {})[self._label_key(labels)] = {
+                    'count': histogram.count,
+                    'sum_seconds': histogram.total,
+                    'mean_seconds': histogram.total / histogram.count if histogram.count else 0.0,
+                    'p50_seconds': histogram.quantile(0.50),
+                    'p99_seconds': histogram.quantile(0.99)
+                }
+            counters: Dict[str, Dict[str, int]] = {}
+            for (name, labels), value in self._counters.items():
+                counters.setdefault(name, {})[self._label_key(labels)] = value
+        return {'enabled': self.enabled, 'histograms': histograms, 'counters': counters}
+
+    def to_prometheus(self, components: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        def fmt_labels(labels, extra: str = '') -> str:
+            parts = [f'{k}="{v}"' for k, v in labels]
+            if extra:
+                parts.append(extra)
+            return '{' + ','.join(parts) + '}' if parts else ''
+
+        lines: List[str] = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        
+        typed = set()
+        for (name, labels), histogram in histograms:
+            metric = f'{self.namespace}_{name}'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} histogram')
+                typed.add(metric)
+            cumulative = 0
+            for bound, bucket_count in zip(_LATENCY_BUCKETS + (float('inf'),), histogram.counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                bucket_labels = fmt_labels(labels, 'le="' + le + '"')
+                lines.append(f'{metric}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{metric}_sum{fmt_labels(labels)} {histogram.total}')
+            lines.append(f'{metric}_count{fmt_labels(labels)} {histogram.count}')
+        for (name, labels), value in counters:
+            metric = f'{self.namespace}_{name}'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} counter')
+                typed.add(metric)
+            lines.append(f'{metric}{fmt_labels(labels)} {value}')
+        
+        if components:
+            metric = f'{self.namespace}_component'
+            lines.append(f'# TYPE {metric} gauge')
+            for component, stats in sorted(components.items()):
+                for stat, value in sorted(stats.items()):
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        lines.append(f'{metric}{{component="{component}",stat="{stat}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+class _TimedLock:
+    __slots__ = ('_lock', '_metrics')
+
+    def __init__(self, lock: Lock, metrics: AuthMetrics):
+        self._lock = lock
+        self._metrics = metrics
+
+    def __enter__(self) -> None:
+        started = time.perf_counter()
+        self._lock.acquire()
+        self._metrics.observe('stage_seconds', time.perf_counter() - started, stage='lock_wait')
+
+    def __exit__(self, *exc) -> None:
+        self._lock.release()
+
+class UserStore(ABC):
+    """Storage backend for users, reset tokens and refresh tokens"""
+    metrics: Optional[AuthMetrics] = None
+
+    def _locked(self, lock: Lock):
+        metrics = self.metrics
+        if metrics is None or not metrics.enabled:
+            return lock
+        return _TimedLock(lock, metrics)
+
+    @abstractmethod
+    def create_user(self, email: str, password_hash: str) -> User: ...
+
+    @abstractmethod
+    def find_by_email(self, email: str) -> Optional[User]: ...
+
+    @abstractmethod
+    def find_by_id(self, user_id: str) -> Optional[User]: ...
+
+    @abstractmethod
+    def update_user(self, user: User) -> None: ...
+
+    @abstractmethod
+    def store_reset_token(self, email: str, token: str, expiry: datetime) -> None: ...
+
+    @abstractmethod
+    def get_reset_token_email(self, token: str) -> Optional[str]: ...
+
+    @abstractmethod
+    def remove_reset_token(self, token: str) -> None: ...
+
+    @abstractmethod
+    def store_refresh_token(self, user_id: str, token: str, expiry: datetime) -> None: ...
+
+    @abstractmethod
+    def get_refresh_token_user(self, token: str) -> Optional[str]: ...
+
+    @abstractmethod
+    def remove_refresh_token(self, token: str) -> None: ...
+
+    @abstractmethod
+    def revoke_user_sessions(self, user_id: str) -> int:
+        """Remove every refresh token of ``user_id``; returns how many were removed"""
+
+    @abstractmethod
+    def cleanup_expired_tokens(self, max_batch: Optional[int] = None) -> SweepStats: ...
+
+    @abstractmethod
+    def iter_snapshot(self, batch_size: int = 1000) -> Iterator[ExportBatch]:
+        """Stream every user and live refresh token, consistent as of the first batch.
+
+        Memory stays bounded by ``batch_size`` and live traffic is never locked
+        out for longer than one batch.
+        """
+
+    @staticmethod
+    def _new_user(email: str, password_hash: str, created_at: Optional[int] = None) -> User:
+        return User(
+            id=secrets.token_urlsafe(16),
+            email=email.lower(),
+            password_hash=password_hash,
+            is_active=True,
+            is_verified=False,
+            created_at=created_at if created_at is not None else int(time.time()),
+            last_login=None,
+            failed_login_attempts=0,
+            last_failed_login=None
+        )
+
+    def create_users_batch(self, rows: List[Tuple[str, str]]) -> List[Optional[User]]:
+        """Create users from (email, password_hash) pairs; None marks a duplicate email"""
+        users: List[Optional[User]] = []
+        for email, password_hash in rows:
+            try:
+                users.append(self.create_user(email, password_hash))
+            except ValidationError:
+                users.append(None)
+        return users
+
+    def rotate_refresh_token(self, token: str, new_token: str, new_expiry: datetime) -> User:
+        """Consume ``token`` and store ``new_token`` for the same active user.
+
+        Raises TokenError for an unknown or expired token and AuthenticationError
+        for a missing or inactive user. Backends override this to make it one
+        atomic step, so a refresh token can be redeemed at most once.
+        """
+        user_id = self.get_refresh_token_user(token)
+        if not user_id:
+            raise TokenError("Invalid refresh token", 401)
+        user = self.find_by_id(user_id)
+        if not user or not user.is_active:
+            raise AuthenticationError("User not found or inactive", 401)
+        self.remove_refresh_token(token)
+        self.store_refresh_token(user.id, new_token, new_expiry)
+        return user
+
+    def record_login_attempt(self, user_id: str, success: bool, max_failed_attempts: int,
+                             lockout_seconds: int, password_hash: Optional[str] = None) -> User:
+        """Apply a login outcome to the stored user (optionally rehashing) and return it"""
+        user = self.find_by_id(user_id)
+        if user is None:
+            raise ValidationError("User not found")
+        self._apply_login_attempt(user, success, max_failed_attempts, lockout_seconds, password_hash)
+        self.update_user(user)
+        return user
+
+    @staticmethod
+    def _apply_login_attempt(user: User, success: bool, max_failed_attempts: int,
+                             lockout_seconds: int, password_hash: Optional[str]) -> None:
+        now = int(time.time())
+        if user.failed_login_attempts >= max_failed_attempts and (
+            not user.last_failed_login or now - user.last_failed_login >= lockout_seconds
+        ):
+            # The lockout has run out; start counting afresh
+            user.failed_login_attempts = 0
+            user.last_failed_login = None
+        if success:
+            user.failed_login_attempts = 0
+            user.last_failed_login = None
+            user.last_login = now
+            if password_hash is not None:
+                user.password_hash = password_hash
+        else:
+            user.failed_login_attempts += 1
+            user.last_failed_login = now
+
+    def flush(self) -> None:
+        """Persist any buffered writes"""
+
+    def close(self) -> None:
+        """Release backend resources"""
+
+class _SnapshotCursor:
+    """Copy-on-write state of one running UserRepository.iter_snapshot()"""
+    __slots__ = ('taken_at', 'limit', 'users_done', 'sessions_done', 'users', 'sessions')
+
+    def __init__(self, taken_at: float, limit: int):
+        self.taken_at = taken_at
+        # Users at positions [0, limit) of the creation order are exported;
+        # those below users_done / sessions_done have been already
+        self.limit = limit
+        self.users_done = 0
+        self.sessions_done = 0
+        # Pre-images of what writers changed after the snapshot was taken, kept
+        # only for users the export has not reached yet and freed once it does
+        self.users: Dict[str, Tuple] = {}
+        self.sessions: Dict[str, List[Tuple[bytes, int]]] = {}
+
+class UserRepository(UserStore):
+    def __init__(self, sweep_batch_size: int = 1000):
         self._users: Dict[str, User] = {}
         self._email_index: Dict[str, str] = {}
-        self._lock = Lock()
-        self._reset_tokens: Dict[str, Tuple[str, datetime]] = {}
-        self._refresh_tokens: Dict[str, Tuple[str, datetime]] = {}
+        # Tokens are keyed by token_digest() and expire at epoch seconds
+        self._reset_tokens: Dict[bytes, Tuple[str, int]] = {}
+        self._refresh_tokens: Dict[bytes, Tuple[str, int]] = {}
+        
+        # Min-heaps of (expiry, token digest) so a sweep only touches expired
+        # entries. Removed tokens leave stale heap entries behind, dropped when
+        # popped at their expiry; once they outnumber the live tokens, the sweep
+        # rebuilds the heap outside the lock (see _compact_expiry). While that
+        # runs, pushes are also logged to the *_pushes list and replayed on swap.
+        self._reset_expiry: List[Tuple[int, bytes]] = []
+        self._refresh_expiry: List[Tuple[int, bytes]] = []
+        self._reset_pushes: Optional[List[Tuple[int, bytes]]] = None
+        self._refresh_pushes: Optional[List[Tuple[int, bytes]]] = None
+        self._compact_lock = Lock()
+        # user id -> digests of that user's refresh tokens, so revoking a user's
+        # sessions costs O(their sessions); guarded by _refresh_lock
+        self._user_sessions: Dict[str, Set[bytes]] = {}
+        # User ids in creation order. Users are never deleted, so a snapshot
+        # export walks a stable prefix of this list instead of copying the keys
+        self._user_order: List[str] = []
+        # user id -> its index in _user_order
+        self._user_position: Dict[str, int] = {}
+        # Running snapshot exports; guarded by _users_lock and _refresh_lock together
+        self._snapshots: List[_SnapshotCursor] = []
+        self.sweep_batch_size = sweep_batch_size
+        self.last_sweep: Optional[SweepStats] = None
+        
+        # One lock per data set, taken by writers only. Reads are single dict
+        # lookups, which are atomic under the GIL, so readers never block each
+        # other or wait behind writers to an unrelated data set.
+        self._users_lock = Lock()
+        self._reset_lock = Lock()
+        self._refresh_lock = Lock()
+        
+        # Set by DurableUserRepository. Mutations are appended while their lock
+        # is held, so journal order matches memory order, and waited on after.
+        self._journal: Optional['UserJournal'] = None
+
+    def _log(self, op: int, payload: bytes) -> int:
+        return self._journal.append(op, payload) if self._journal is not None else 0
+
+    def _wait_logged(self, seq: int) -> None:
+        if seq:
+            self._journal.wait(seq)
 
     def create_user(self, email: str, password_hash: str) -> User:
-        with self._lock:
+        with self._locked(self._users_lock):
             if email.lower() in self._email_index:
-                raise ValidationError("Email already registered")
+                raise ConflictError("Email already registered")
             
-            user_id = secrets.token_urlsafe(16)
-            user = User(
-                id=user_id,
-                email=email.lower(),
-                password_hash=password_hash,
-                is_active=True,
-                is_verified=False,
-                created_at=datetime.now(timezone.utc),
-                last_login=None,
-                failed_login_attempts=0,
-                last_failed_login=None
-            )
+            user = self._new_user(email, password_hash)
             
-            self._users[user_id] = user
-            self._email_index[email.lower()] = user_id
-            return user
+            # Publish the user before the index entry so lock-free readers
+            # never see an email that maps to a missing user
+            self._users[user.id] = user
+            self._email_index[user.email] = user.id
+            self._user_position[user.id] = len(self._user_order)
+            self._user_order.append(user.id)
+            seq = self._log(_JOURNAL_USER, _encode_user(user))
+        self._wait_logged(seq)
+        return user
+
+    def create_users_batch(self, rows: List[Tuple[str, str]]) -> List[Optional[User]]:
+        created_at = int(time.time())
+        users: List[Optional[User]] = []
+        seq = 0
+        with self._locked(self._users_lock):
+            for email, password_hash in rows:
+                if email.lower() in self._email_index:
+                    users.append(None)
+                    continue
+                user = self._new_user(email, password_hash, created_at)
+                self._users[user.id] = user
+                self._email_index[user.email] = user.id
+                self._user_position[user.id] = len(self._user_order)
+                self._user_order.append(user.id)
+                seq = self._log(_JOURNAL_USER, _encode_user(user))
+                users.append(user)
+        self._wait_logged(seq)
+        return users
 
     def find_by_email(self, email: str) -> Optional[User]:
-        with self._lock:
-            user_id = self._email_index.get(email.lower())
-            if user_id:
-                return self._users.get(user_id)
-            return None
+        user_id = self._email_index.get(email.lower())
+        if user_id:
+            return self._users.get(user_id)
+        return None
 
     def find_by_id(self, user_id: str) -> Optional[User]:
-        with self._lock:
-            return self._users.get(user_id)
+        return self._users.get(user_id)
 
     def update_user(self, user: User) -> None:
-        with self._lock:
+        with self._locked(self._users_lock):
             if user.id not in self._users:
                 raise ValidationError("User not found")
+            if self._snapshots:
+                self._preserve_user(user.id)
             self._users[user.id] = user
+            seq = self._log(_JOURNAL_USER, _encode_user(user))
+        self._wait_logged(seq)
+
+    def record_login_attempt(self, user_id: str, success: bool, max_failed_attempts: int,
+                             lockout_seconds: int, password_hash: Optional[str] = None) -> User:
+        with self._locked(self._users_lock):
+            user = self._users.get(user_id)
+            if user is None:
+                raise ValidationError("User not found")
+            if self._snapshots:
+                self._preserve_user(user_id)
+            self._apply_login_attempt(user, success, max_failed_attempts, lockout_seconds, password_hash)
+            seq = self._log(_JOURNAL_USER, _encode_user(user))
+        self._wait_logged(seq)
+        return user
 
     def store_reset_token(self, email: str, token: str, expiry: datetime) -> None:
-        with self._lock:
-            self._reset_tokens[token] = (email.lower(), expiry)
+        key = token_digest(token)
+        expires_at = int(expiry.timestamp())
+        with self._locked(self._reset_lock):
+            self._reset_tokens[key] = (email.lower(), expires_at)
+            self._push_expiry(self._reset_expiry, self._reset_pushes, expires_at, key)
+            seq = self._log(_JOURNAL_RESET_STORE, _encode_token(key, email.lower(), expires_at))
+        self._wait_logged(seq)
 
     def get_reset_token_email(self, token: str) -> Optional[str]:
-        with self._lock:
-            if token in self._reset_tokens:
-                email, expiry = self._reset_tokens[token]
-                if expiry > datetime.now(timezone.utc):
-                    return email
-                del self._reset_tokens[token]
+        key = token_digest(token)
+        entry = self._reset_tokens.get(key)
+        if entry is None:
             return None
+        email, expires_at = entry
+        if expires_at > time.time():
+            return email
+        with self._locked(self._reset_lock):
+            if self._reset_tokens.get(key) is entry:
+                del self._reset_tokens[key]
+        return None
 
     def remove_reset_token(self, token: str) -> None:
-        with self._lock:
-            if token in self._reset_tokens:
-                del self._reset_tokens[token]
+        key = token_digest(token)
+        with self._locked(self._reset_lock):
+            self._reset_tokens.pop(key, None)
+            seq = self._log(_JOURNAL_RESET_REMOVE, key)
+        self._wait_logged(seq)
 
     def store_refresh_token(self, user_id: str, token: str, expiry: datetime) -> None:
-        with self._lock:
-            self._refresh_tokens[token] = (user_id, expiry)
+        key = token_digest(token)
+        expires_at = int(expiry.timestamp())
+        with self._locked(self._refresh_lock):
+            if self._snapshots:
+                self._preserve_sessions(user_id)
+            self._refresh_tokens[key] = (user_id, expires_at)
+            self._user_sessions.setdefault(user_id, set()).add(key)
+            self._push_expiry(self._refresh_expiry, self._refresh_pushes, expires_at, key)
+            seq = self._log(_JOURNAL_REFRESH_STORE, _encode_token(key, user_id, expires_at))
+        self._wait_logged(seq)
+
+    @staticmethod
+    def _push_expiry(heap: List[Tuple[int, bytes]], pushes: Optional[List[Tuple[int, bytes]]],
+                     expires_at: int, key: bytes) -> None:
+        # Caller holds the heap's lock
+        heapq.heappush(heap, (expires_at, key))
+        if pushes is not None:
+            pushes.append((expires_at, key))
+
+    @staticmethod
+    def _unindex_session(index: Dict[str, Set[bytes]], user_id: str, key: bytes) -> None:
+        sessions = index.get(user_id)
+        if sessions is not None:
+            sessions.discard(key)
+            if not sessions:
+                del index[user_id]
 
     def get_refresh_token_user(self, token: str) -> Optional[str]:
-        with self._lock:
-            if token in self._refresh_tokens:
-                user_id, expiry = self._refresh_tokens[token]
-                if expiry > datetime.now(timezone.utc):
-                    return user_id
-                del self._refresh_tokens[token]
+        key = token_digest(token)
+        entry = self._refresh_tokens.get(key)
+        if entry is None:
             return None
+        user_id, expires_at = entry
+        if expires_at > time.time():
+            return user_id
+        with self._locked(self._refresh_lock):
+            if self._refresh_tokens.get(key) is entry:
+                if self._snapshots:
+                    self._preserve_sessions(user_id)
+                del self._refresh_tokens[key]
+                self._unindex_session(self._user_sessions, user_id, key)
+        return None
 
     def remove_refresh_token(self, token: str) -> None:
-        with self._lock:
-            if token in self._refresh_tokens:
-                del self._refresh_tokens[token]
+        key = token_digest(token)
+        with self._locked(self._refresh_lock):
+            entry = self._refresh_tokens.get(key)
+            if entry is not None:
+                if self._snapshots:
+                    self._preserve_sessions(entry[0])
+                del self._refresh_tokens[key]
+                self._unindex_session(self._user_sessions, entry[0], key)
+            seq = self._log(_JOURNAL_REFRESH_REMOVE, key)
+        self._wait_logged(seq)
 
-    def cleanup_expired_tokens(self) -> None:
-        with self._lock:
-            current_time = datetime.now(timezone.utc)
+    def rotate_refresh_token(self, token: str, new_token: str, new_expiry: datetime) -> User:
+        key = token_digest(token)
+        new_key = token_digest(new_token)
+        expires_at = int(new_expiry.timestamp())
+        with self._locked(self._refresh_lock):
+            entry = self._refresh_tokens.get(key)
+            if entry is None or entry[1] <= time.time():
+                raise TokenError("Invalid refresh token", 401)
+            # Lock-free user read, so no second lock is taken while holding this one
+            user = self._users.get(entry[0])
+            if not user or not user.is_active:
+                raise AuthenticationError("User not found or inactive", 401)
             
-            # Clean reset tokens
-            expired_tokens = [
-                token for token, (_, expiry) in self._reset_tokens.items()
-                if expiry <= current_time
-            ]
-            for token in expired_tokens:
-                del self._reset_tokens[token]
+            if self._snapshots:
+                self._preserve_sessions(user.id)
+            del self._refresh_tokens[key]
+            self._unindex_session(self._user_sessions, user.id, key)
+            self._refresh_tokens[new_key] = (user.id, expires_at)
+            self._user_sessions.setdefault(user.id, set()).add(new_key)
+            self._push_expiry(self._refresh_expiry, self._refresh_pushes, expires_at, new_key)
+            self._log(_JOURNAL_REFRESH_REMOVE, key)
+            seq = self._log(_JOURNAL_REFRESH_STORE, _encode_token(new_key, user.id, expires_at))
+        self._wait_logged(seq)
+        return user
+
+    def revoke_user_sessions(self, user_id: str) -> int:
+        seq = 0
+        with self._locked(self._refresh_lock):
+            if self._snapshots:
+                self._preserve_sessions(user_id)
+            keys = self._user_sessions.pop(user_id, ())
+            for key in keys:
+                self._refresh_tokens.pop(key, None)
+                seq = self._log(_JOURNAL_REFRESH_REMOVE, key)
+        self._wait_logged(seq)
+        return len(keys)
+
+    def cleanup_expired_tokens(self, max_batch: Optional[int] = None) -> SweepStats:
+        """Evict expired tokens in bounded batches, releasing the lock between them"""
+        batch_size = max_batch or self.sweep_batch_size
+        now = time.time()
+        stats = SweepStats()
+        stats.evicted_reset_tokens = self._sweep(
+            self._reset_tokens, self._reset_expiry, self._locked(self._reset_lock), now, batch_size, stats
+        )
+        stats.evicted_refresh_tokens = self._sweep(
+            self._refresh_tokens, self._refresh_expiry, self._locked(self._refresh_lock), now, batch_size, stats,
+            self._user_sessions, self._preserve_sessions
+        )
+        stats.compacted_entries = (
+            self._compact_expiry(self._reset_tokens, '_reset_expiry', '_reset_pushes', self._reset_lock)
+            + self._compact_expiry(self._refresh_tokens, '_refresh_expiry', '_refresh_pushes', self._refresh_lock)
+        )
+        self.last_sweep = stats
+        return stats
+
+    def _compact_expiry(self, tokens: Dict[bytes, Tuple[str, int]], heap_name: str, pushes_name: str,
+                        lock: Lock) -> int:
+        """Rebuild an expiry heap once stale entries outnumber live tokens; returns entries dropped"""
+        if len(getattr(self, heap_name)) <= 2 * len(tokens) + self.sweep_batch_size:
+            return 0
+        if not self._compact_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._locked(lock):
+                setattr(self, pushes_name, [])
+            # Copying the dict is atomic under the GIL. Pushes from here on are
+            # logged too; one landing in both is a harmless duplicate.
+            heap = [(expires_at, key) for key, (_, expires_at) in list(tokens.items())]
+            heapq.heapify(heap)
+            with self._locked(lock):
+                for entry in getattr(self, pushes_name):
+                    heapq.heappush(heap, entry)
+                dropped = len(getattr(self, heap_name)) - len(heap)
+                setattr(self, heap_name, heap)
+                setattr(self, pushes_name, None)
+            return max(dropped, 0)
+        finally:
+            self._compact_lock.release()
+
+    def _preserve_user(self, user_id: str) -> None:
+        # Caller holds _users_lock and is about to change this user
+        if not self._snapshots:
+            return
+        position = self._user_position.get(user_id)
+        if position is None:
+            return
+        values = None
+        for cursor in self._snapshots:
+            if cursor.users_done <= position < cursor.limit and user_id not in cursor.users:
+                if values is None:
+                    values = _user_fields(self._users[user_id])
+                cursor.users[user_id] = values
+
+    def _preserve_sessions(self, user_id: str) -> None:
+        # Caller holds _refresh_lock and is about to change this user's sessions
+        if not self._snapshots:
+            return
+        position = self._user_position.get(user_id)
+        if position is None:
+            return
+        sessions = None
+        for cursor in self._snapshots:
+            if cursor.sessions_done <= position < cursor.limit and user_id not in cursor.sessions:
+                if sessions is None:
+                    sessions = self._live_sessions(user_id)
+                cursor.sessions[user_id] = sessions
+
+    def _live_sessions(self, user_id: str) -> List[Tuple[bytes, int]]:
+        tokens = self._refresh_tokens
+        return [(key, tokens[key][1]) for key in self._user_sessions.get(user_id, ())]
+
+    def iter_snapshot(self, batch_size: int = 1000) -> Iterator[ExportBatch]:
+        """Copy-on-write snapshot export.
+
+        Taking the snapshot only records the current user count. Each batch is
+        read under the users lock, then the refresh lock, for ``batch_size``
+        entries at a time. A writer that changes a user or its sessions before
+        the export reaches them first copies the old state into the running
+        snapshot. Writes to users the export has passed, or that did not exist
+        when it started, copy nothing, and each pre-image is freed with its
+        batch, so extra memory is bounded by the users still ahead of the
+        export rather than by the write volume or the size of the repository.
+        """
+        with self._locked(self._users_lock), self._locked(self._refresh_lock):
+            cursor = _SnapshotCursor(time.time(), len(self._user_order))
+            self._snapshots.append(cursor)
+        try:
+            for start in range(0, cursor.limit, batch_size):
+                end = min(start + batch_size, cursor.limit)
+                with self._locked(self._users_lock):
+                    rows = []
+                    for user_id in self._user_order[start:end]:
+                        values = cursor.users.pop(user_id, None)
+                        rows.append(values if values is not None else _user_fields(self._users[user_id]))
+                    cursor.users_done = end
+                batch = ExportBatch([User(*values) for values in rows])
+                with self._locked(self._refresh_lock):
+                    cursor.sessions_done = end
+                    for user in batch.users:
+                        sessions = cursor.sessions.pop(user.id, None)
+                        if sessions is None:
+                            sessions = self._live_sessions(user.id)
+                        batch.sessions.extend(
+                            (user.id, key, expires_at) for key, expires_at in sessions
+                            if expires_at > cursor.taken_at
+                        )
+                yield batch
+        finally:
+            with self._locked(self._users_lock), self._locked(self._refresh_lock):
+                self._snapshots.remove(cursor)
+
+    @staticmethod
+    def _sweep(tokens: Dict[bytes, Tuple[str, int]], expiry_heap: List[Tuple[int, bytes]],
+               lock, now: float, batch_size: int, stats: SweepStats,
+               index: Optional[Dict[str, Set[bytes]]] = None,
+               preserve: Optional[Callable[[str], None]] = None) -> int:
+        evicted = 0
+        while True:
+            started = time.perf_counter()
+            with lock:
+                popped = 0
+                while expiry_heap and expiry_heap[0][0] <= now and popped < batch_size:
+                    _, key = heapq.heappop(expiry_heap)
+                    popped += 1
+                    entry = tokens.get(key)
+                    if entry is not None and entry[1] <= now:
+                        if preserve is not None:
+                            preserve(entry[0])
+                        del tokens[key]
+                        if index is not None:
+                            UserRepository._unindex_session(index, entry[0], key)
+                        evicted += 1
+                
+                more = bool(expiry_heap) and expiry_heap[0][0] <= now
             
-            # Clean refresh tokens
-            expired_refresh_tokens = [
-                token for token, (_, expiry) in self._refresh_tokens.items()
-                if expiry <= current_time
-            ]
-            for token in expired_refresh_tokens:
-                del self._refresh_tokens[token]
+            held = time.perf_counter() - started
+            stats.batches += 1
+            stats.lock_held_seconds += held
+            stats.max_lock_hold_seconds = max(stats.max_lock_hold_seconds, held)
+            if not more:
+                return evicted
 
-class EmailService:
-    def __init__(self, config: AuthConfig):
-        self.config = config
+# Journal and snapshot records: a frame header followed by the payload. Every
+# record carries the full new state, so replaying one twice is harmless.
+_JOURNAL_USER = 1
+_JOURNAL_RESET_STORE = 2
+_JOURNAL_RESET_REMOVE = 3
+_JOURNAL_REFRESH_STORE = 4
+_JOURNAL_REFRESH_REMOVE = 5
+_FRAME = struct.Struct('<IIB')                  # payload length, crc32, op
+_USER_RECORD = struct.Struct('<HHHBqqiq')       # id/email/hash lengths, flags, timestamps, failures
+_TOKEN_RECORD = struct.Struct('<32sqH')         # digest, expiry, owner length
 
-    def send_email(self, to_email: str, subject: str, body: str) -> bool:
+def _frame(op: int, payload: bytes) -> bytes:
+    return _FRAME.pack(len(payload), zlib.crc32(payload, op), op) + payload
+
+def _encode_user(user: User) -> bytes:
+    user_id = user.id.encode('utf-8')
+    email = user.email.encode('utf-8')
+    password_hash = user.password_hash.encode('utf-8')
+    return _USER_RECORD.pack(
+        len(user_id), len(email), len(password_hash),
+        int(user.is_active) | int(user.is_verified) << 1,
+        user.created_at,
+        -1 if user.last_login is None else user.last_login,
+        user.failed_login_attempts,
+        -1 if user.last_failed_login is None else user.last_failed_login
+    ) + user_id + email + password_hash
+
+def _decode_user(payload: bytes) -> User:
+    id_len, email_len, hash_len, flags, created_at, last_login, failed, last_failed = \
+        _USER_RECORD.unpack_from(payload)
+    offset = _USER_RECORD.size
+    email_at = offset + id_len
+    hash_at = email_at + email_len
+    return User(
+        id=payload[offset:email_at].decode('utf-8'),
+        email=payload[email_at:hash_at].decode('utf-8'),
+        password_hash=payload[hash_at:hash_at + hash_len].decode('utf-8'),
+        is_active=bool(flags & 1),
+        is_verified=bool(flags & 2),
+        created_at=created_at,
+        last_login=None if last_login < 0 else last_login,
+        failed_login_attempts=failed,
+        last_failed_login=None if last_failed < 0 else last_failed
+    )
+
+def _encode_token(key: bytes, owner: str, expires_at: int) -> bytes:
+    owner_bytes = owner.encode('utf-8')
+    return _TOKEN_RECORD.pack(key, expires_at, len(owner_bytes)) + owner_bytes
+
+def _decode_token(payload: bytes) -> Tuple[bytes, str, int]:
+    key, expires_at, owner_len = _TOKEN_RECORD.unpack_from(payload)
+    return key, payload[_TOKEN_RECORD.size:_TOKEN_RECORD.size + owner_len].decode('utf-8'), expires_at
+
+class UserJournal:
+    """Append-only mutation log with group commit.
+
+    append() only buffers a framed record and returns its sequence number. A
+    writer thread flushes everything buffered with one write and one fsync,
+    and wait(seq) blocks until that record is on disk, so concurrent writers
+    share an fsync instead of paying for one each.
+    """
+    def __init__(self, path: str, durable: bool = True, commit_window_seconds: float = 0.002):
+        self.path = path
+        self.durable = durable
+        self.commit_window_seconds = commit_window_seconds
+        self._file = open(path, 'ab')
+        self._buffer: List[bytes] = []
+        self._cond = threading.Condition(Lock())
+        self._io_lock = Lock()
+        self._appended = 0
+        self._synced = 0
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self.records = 0
+        self.commits = 0
+        self.bytes_written = 0
+        self._writer = Thread(target=self._run, daemon=True)
+        self._writer.start()
+
+    def append(self, op: int, payload: bytes) -> int:
+        record = _frame(op, payload)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Journal is closed")
+            self._buffer.append(record)
+            self._appended += 1
+            if len(self._buffer) == 1:
+                self._cond.notify_all()
+            return self._appended
+
+    def wait(self, seq: int) -> None:
+        if not self.durable:
+            return
+        with self._cond:
+            while self._synced < seq:
+                if self._error is not None:
+                    raise RuntimeError("Journal write failed") from self._error
+                self._cond.wait()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if not self._buffer:
+                    return
+            if self.commit_window_seconds:
+                # Let concurrent writers join this commit
+                time.sleep(self.commit_window_seconds)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error("Journal write to %s failed: %s", self.path, e)
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+
+    def flush(self) -> None:
+        """Write and fsync everything appended so far"""
+        with self._io_lock:
+            with self._cond:
+                batch, self._buffer = self._buffer, []
+                seq = self._appended
+            if batch:
+                data = b''.join(batch)
+                self._file.write(data)
+                self._file.flush()
+                if self.durable:
+                    os.fsync(self._file.fileno())
+                self.records += len(batch)
+                self.commits += 1
+                self.bytes_written += len(data)
+            with self._cond:
+                self._synced = max(self._synced, seq)
+                self._cond.notify_all()
+
+    def rotate(self, path: str) -> None:
+        """Continue in a new file; the caller must block appends meanwhile"""
+        self.flush()
+        with self._io_lock:
+            self._file.close()
+            self._file = open(path, 'ab')
+            self.path = path
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'records': self.records,
+            'commits': self.commits,
+            'records_per_commit': self.records / self.commits if self.commits else 0.0,
+            'bytes_written': self.bytes_written
+        }
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        self.flush()
+        self._file.close()
+
+class DurableUserRepository(UserRepository):
+    """In-memory UserRepository that survives restarts.
+
+    Every mutation is appended to a journal (group-committed, see UserJournal).
+    snapshot() rotates the journal and writes a compacted image of all users
+    and live tokens; on startup the latest snapshot is memory-mapped and loaded,
+    then the journals written after it are replayed. A torn record at the end
+    of the last journal (crash mid-write) is truncated away.
+    """
+    SNAPSHOT_NAME = 'snapshot.bin'
+    _SNAPSHOT_MAGIC = b'AEPSNAP1'
+    _SNAPSHOT_HEADER = struct.Struct('<8sIQ')   # magic, version, first journal generation
+
+    def __init__(self, directory: str, durable: bool = True, commit_window_seconds: float = 0.002,
+                 snapshot_interval_seconds: float = 0, sweep_batch_size: int = 1000):
+        super().__init__(sweep_batch_size)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._generation = 0
+        self._snapshot_lock = Lock()
+        self.last_snapshot: Optional[Dict[str, Any]] = None
+        self.recovery = self._recover()
+        self._journal = UserJournal(self._journal_path(self._generation), durable, commit_window_seconds)
+        logger.info(
+            "Recovered %s users and %s journal records from %s in %.2fs",
+            len(self._users), self.recovery['journal_records'], directory, self.recovery['seconds']
+        )
+        
+        self._stop = threading.Event()
+        self._snapshot_thread: Optional[Thread] = None
+        if snapshot_interval_seconds > 0:
+            self._snapshot_thread = Thread(
+                target=self._snapshot_loop, args=(snapshot_interval_seconds,), daemon=True
+            )
+            self._snapshot_thread.start()
+
+    def _journal_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f'journal.{generation:08d}.log')
+
+    def _journal_generations(self) -> List[int]:
+        generations = []
+        for name in os.listdir(self.directory):
+            if name.startswith('journal.') and name.endswith('.log'):
+                try:
+                    generations.append(int(name[len('journal.'):-len('.log')]))
+                except ValueError:
+                    continue
+        return sorted(generations)
+
+    def _replay(self, buf, offset: int) -> Tuple[int, int]:
+        """Apply framed records from ``offset``; returns (records applied, end of last good record)"""
+        users, emails = self._users, self._email_index
+        size = len(buf)
+        applied = 0
+        while offset + _FRAME.size <= size:
+            length, crc, op = _FRAME.unpack_from(buf, offset)
+            start = offset + _FRAME.size
+            end = start + length
+            if end > size:
+                break
+            payload = buf[start:end]
+            if zlib.crc32(payload, op) != crc:
+                break
+            if op == _JOURNAL_USER:
+                user = _decode_user(payload)
+                users[user.id] = user
+                emails[user.email] = user.id
+            elif op in (_JOURNAL_RESET_STORE, _JOURNAL_REFRESH_STORE):
+                key, owner, expires_at = _decode_token(payload)
+                tokens = self._reset_tokens if op == _JOURNAL_RESET_STORE else self._refresh_tokens
+                tokens[key] = (owner, expires_at)
+            elif op == _JOURNAL_RESET_REMOVE:
+                self._reset_tokens.pop(payload, None)
+            elif op == _JOURNAL_REFRESH_REMOVE:
+                self._refresh_tokens.pop(payload, None)
+            else:
+                # Zero-filled or foreign bytes, not a record we wrote
+                break
+            offset = end
+            applied += 1
+        return applied, offset
+
+    def _recover(self) -> Dict[str, Any]:
+        # Loading allocates millions of long-lived objects; cyclic GC passes over
+        # them would only slow recovery down
+        gc_enabled = gc.isenabled()
+        gc.disable()
         try:
-            msg = MIMEMultipart()
-            msg['From'] = self.config.from_email
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            msg.attach(MIMEText(body, 'html'))
+            return self._load()
+        finally:
+            if gc_enabled:
+                gc.enable()
 
-            with smtplib.SMTP(self.config.smtp_host, self.config.smtp_port) as server:
-                server.starttls()
-                if self.config.smtp_username and self.config.smtp_password:
-                    server.login(self.config.smtp_username, self.config.smtp_password)
-                server.send_message(msg)
+    def _load(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        snapshot_records = 0
+        snapshot_path = os.path.join(self.directory, self.SNAPSHOT_NAME)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version, self._generation = self._SNAPSHOT_HEADER.unpack_from(mm, 0)
+                if magic != self._SNAPSHOT_MAGIC or version != 1:
+                    raise ValueError(f"{snapshot_path} is not a user repository snapshot")
+                snapshot_records, end = self._replay(mm, self._SNAPSHOT_HEADER.size)
+                if end != len(mm):
+                    raise ValueError(f"{snapshot_path} is corrupt at byte {end}")
+        
+        journal_records = 0
+        for generation in self._journal_generations():
+            path = self._journal_path(generation)
+            if generation < self._generation:
+                # Already folded into the snapshot; left over from a crash mid-snapshot
+                os.remove(path)
+                continue
+            size = os.path.getsize(path)
+            end = 0
+            if size:
+                with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    applied, end = self._replay(mm, 0)
+                journal_records += applied
+            if end < size:
+                logger.warning("Truncating torn journal tail of %s at byte %s", path, end)
+                os.truncate(path, end)
+            self._generation = generation
+        
+        now = time.time()
+        for tokens, heap_name in ((self._reset_tokens, '_reset_expiry'), (self._refresh_tokens, '_refresh_expiry')):
+            for key in [key for key, (_, expires_at) in tokens.items() if expires_at <= now]:
+                del tokens[key]
+            heap = [(expires_at, key) for key, (_, expires_at) in tokens.items()]
+            heapq.heapify(heap)
+            setattr(self, heap_name, heap)
+        for key, (user_id, _) in self._refresh_tokens.items():
+            self._user_sessions.setdefault(user_id, set()).add(key)
+        # Dicts keep first-insertion order, which replay preserves
+        self._user_order = list(self._users)
+        self._user_position = {user_id: i for i, user_id in enumerate(self._user_order)}
+        
+        return {
+            'snapshot_records': snapshot_records,
+            'journal_records': journal_records,
+            'seconds': time.perf_counter() - started
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Write a compacted snapshot and drop the journals it replaces"""
+        with self._snapshot_lock:
+            started = time.perf_counter()
+            # Lock order users -> reset -> refresh; the cut blocks writers only
+            # for the journal rotation and three list copies
+            with self._locked(self._users_lock), self._locked(self._reset_lock), self._locked(self._refresh_lock):
+                generation = self._generation + 1
+                self._journal.rotate(self._journal_path(generation))
+                self._generation = generation
+                users = list(self._users.values())
+                reset_tokens = list(self._reset_tokens.items())
+                refresh_tokens = list(self._refresh_tokens.items())
+            pause = time.perf_counter() - started
             
-            logger.info(f"Email sent to {to_email}")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to send email to {to_email}: {str(e)}")
-            return False
+            path = os.path.join(self.directory, self.SNAPSHOT_NAME)
+            now = time.time()
+            with open(path + '.tmp', 'wb') as f:
+                f.write(self._SNAPSHOT_HEADER.pack(self._SNAPSHOT_MAGIC, 1, generation))
+                chunk: List[bytes] = []
+                records = (
+                    [(_JOURNAL_USER, _encode_user(user)) for user in users],
+                    ((_JOURNAL_RESET_STORE, _encode_token(key, owner, expires_at))
+                     for key, (owner, expires_at) in reset_tokens if expires_at > now),
+                    ((_JOURNAL_REFRESH_STORE, _encode_token(key, owner, expires_at))
+                     for key, (owner, expires_at) in refresh_tokens if expires_at > now),
+                )
+                for group in records:
+                    for op, payload in group:
+                        chunk.append(_frame(op, payload))
+                        if len(chunk) >= 4096:
+                            f.write(b''.join(chunk))
+                            chunk.clear()
+                f.write(b''.join(chunk))
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            os.replace(path + '.tmp', path)
+            dir_fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+            for old in self._journal_generations():
+                if old < generation:
+                    os.remove(self._journal_path(old))
+            
+            self.last_snapshot = {
+                'generation': generation,
+                'users': len(users),
+                'bytes': size,
+                'pause_seconds': pause,
+                'seconds': time.perf_counter() - started
+            }
+            logger.info(
+                "Snapshot %s written: %s users, %s bytes in %.2fs",
+                generation, len(users), size, self.last_snapshot['seconds']
+            )
+            return self.last_snapshot
 
-    def send_welcome_email(self, to_email: str) -> bool:
-        subject = "Welcome to AEP - Account Created"
-        body = f"""
-        <html>
-            <body>
-                <h2>Welcome to AEP!</h2>
-                <p>Your account has been successfully created.</p>
-                <p>Email: {to_email}</p>
-                <p>Thank you for joining us!</p>
-            </body>
-        </html>
-        """
-        return self.send_email(to_email, subject, body)
+    def _snapshot_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.snapshot()
+            except OSError as e:
+                logger.error("Snapshot of %s failed: %s", self.directory, e)
+
+    def flush(self) -> None:
+        self._journal.flush()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        self._journal.close()
+
+class SQLiteUserRepository(UserStore):
+    """UserStore persisted in SQLite, shareable across threads and processes.
+
+    The database runs in WAL mode so readers never block the writer, and every
+    thread gets its own connection, closed when the thread ends.
+    store_refresh_token and update_user are buffered and written in one
+    transaction per batch; reads consult the buffer first, so callers in this
+    process always see their own writes. Login counters and token rotation
+    run in BEGIN IMMEDIATE transactions, so they stay atomic across processes.
+    """
+    _SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            email TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            is_active INTEGER NOT NULL,
+            is_verified INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            last_login INTEGER,
+            failed_login_attempts INTEGER NOT NULL,
+            last_failed_login INTEGER
+        )""",
+        """CREATE TABLE IF NOT EXISTS reset_tokens (
+            token BLOB PRIMARY KEY,
+            email TEXT NOT NULL,
+            expires_at INTEGER NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS refresh_tokens (
+            token BLOB PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            expires_at INTEGER NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_reset_tokens_expiry ON reset_tokens (expires_at)",
+        "CREATE INDEX IF NOT EXISTS idx_refresh_tokens_expiry ON refresh_tokens (expires_at)",
+        "CREATE INDEX IF NOT EXISTS idx_refresh_tokens_user ON refresh_tokens (user_id)",
+    )
+    _USER_COLUMNS = (
+        "id, email, password_hash, is_active, is_verified, created_at, "
+        "last_login, failed_login_attempts, last_failed_login"
+    )
+
+    def __init__(self, path: str, batch_size: int = 64, batch_delay_seconds: float = 0.05,
+                 sweep_batch_size: int = 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_delay_seconds = batch_delay_seconds
+        self.sweep_batch_size = sweep_batch_size
+        self.last_sweep: Optional[SweepStats] = None
+        
+        self._local = threading.local()
+        # Open connections by id(); each is dropped when its thread is collected
+        self._connections: Dict[int, 'sqlite3.Connection'] = {}
+        self._connections_lock = Lock()
+        
+        # Buffered writes. Entries move to the in-flight maps while a batch is
+        # being committed so readers can still find them until it lands.
+        self._pending_lock = Lock()
+        self._flush_lock = Lock()
+        self._pending_users: Dict[str, User] = {}
+        self._pending_refresh: Dict[bytes, Tuple[str, int]] = {}
+        self._inflight_users: Dict[str, User] = {}
+        self._inflight_refresh: Dict[bytes, Tuple[str, int]] = {}
+        self._pending_since: Optional[float] = None
+        self._flusher: Optional[Thread] = None
+        self._closed = False
+        
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in self._SCHEMA:
+            conn.execute(statement)
+
+    def _conn(self) -> 'sqlite3.Connection':
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections[id(conn)] = conn
+            # Thread-per-request servers would otherwise leak a descriptor per thread
+            weakref.finalize(
+                threading.current_thread(), self._release_connection,
+                self._connections, self._connections_lock, id(conn)
+            )
+        return conn
+
+    @staticmethod
+    def _release_connection(connections: Dict[int, 'sqlite3.Connection'], lock: Lock, key: int) -> None:
+        with lock:
+            conn = connections.pop(key, None)
+        if conn is not None:
+            conn.close()
+
+    @staticmethod
+    def _row_to_user(row: Tuple) -> User:
+        return User(
+            id=row[0],
+            email=row[1],
+            password_hash=row[2],
+            is_active=bool(row[3]),
+            is_verified=bool(row[4]),
+            created_at=row[5],
+            last_login=row[6],
+            failed_login_attempts=row[7],
+            last_failed_login=row[8]
+        )
+
+    def _buffered_user(self, user_id: str) -> Optional[User]:
+        with self._pending_lock:
+            return self._pending_users.get(user_id) or self._inflight_users.get(user_id)
+
+    _INSERT_USER = f"INSERT INTO users ({_USER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+    @staticmethod
+    def _user_params(user: User) -> Tuple:
+        return (user.id, user.email, user.password_hash, int(user.is_active), int(user.is_verified),
+                user.created_at, None, 0, None)
+
+    def create_user(self, email: str, password_hash: str) -> User:
+        user = self._new_user(email, password_hash)
+        try:
+            self._conn().execute(self._INSERT_USER, self._user_params(user))
+        except sqlite3.IntegrityError:
+            raise ConflictError("Email already registered")
+        return user
+
+    def create_users_batch(self, rows: List[Tuple[str, str]]) -> List[Optional[User]]:
+        created_at = int(time.time())
+        users: List[Optional[User]] = []
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for email, password_hash in rows:
+                user = self._new_user(email, password_hash, created_at)
+                try:
+                    conn.execute(self._INSERT_USER, self._user_params(user))
+                    users.append(user)
+                except sqlite3.IntegrityError:
+                    users.append(None)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return users
+
+    def find_by_email(self, email: str) -> Optional[User]:
+        row = self._conn().execute(
+            f"SELECT {self._USER_COLUMNS} FROM users WHERE email = ?", (email.lower(),)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._buffered_user(row[0]) or self._row_to_user(row)
+
+    def find_by_id(self, user_id: str) -> Optional[User]:
+        user = self._buffered_user(user_id)
+        if user is not None:
+            return user
+        row = self._conn().execute(
+            f"SELECT {self._USER_COLUMNS} FROM users WHERE id = ?", (user_id,)
+        ).fetchone()
+        return self._row_to_user(row) if row else None
+
+    def update_user(self, user: User) -> None:
+        if self._buffered_user(user.id) is None and self._conn().execute(
+            "SELECT 1 FROM users WHERE id = ?", (user.id,)
+        ).fetchone() is None:
+            raise ValidationError("User not found")
+        with self._pending_lock:
+            self._pending_users[user.id] = user
+        self._after_buffered_write()
+
+    def store_reset_token(self, email: str, token: str, expiry: datetime) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO reset_tokens (token, email, expires_at) VALUES (?, ?, ?)",
+            (token_digest(token), email.lower(), int(expiry.timestamp()))
+        )
+
+    def get_reset_token_email(self, token: str) -> Optional[str]:
+        key = token_digest(token)
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT email, expires_at FROM reset_tokens WHERE token = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] > time.time():
+            return row[0]
+        conn.execute("DELETE FROM reset_tokens WHERE token = ?", (key,))
+        return None
+
+    def remove_reset_token(self, token: str) -> None:
+        self._conn().execute("DELETE FROM reset_tokens WHERE token = ?", (token_digest(token),))
+
+    def store_refresh_token(self, user_id: str, token: str, expiry: datetime) -> None:
+        with self._pending_lock:
+            self._pending_refresh[token_digest(token)] = (user_id, int(expiry.timestamp()))
+        self._after_buffered_write()
+
+    def get_refresh_token_user(self, token: str) -> Optional[str]:
+        key = token_digest(token)
+        with self._pending_lock:
+            entry = self._pending_refresh.get(key) or self._inflight_refresh.get(key)
+        if entry is not None:
+            user_id, expires_at = entry
+            return user_id if expires_at > time.time() else None
+        
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT user_id, expires_at FROM refresh_tokens WHERE token = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] > time.time():
+            return row[0]
+        conn.execute("DELETE FROM refresh_tokens WHERE token = ?", (key,))
+        return None
+
+    def remove_refresh_token(self, token: str) -> None:
+        key = token_digest(token)
+        with self._pending_lock:
+            self._pending_refresh.pop(key, None)
+        # Wait out any in-flight batch so the delete cannot be overtaken by it
+        with self._flush_lock:
+            self._conn().execute("DELETE FROM refresh_tokens WHERE token = ?", (key,))
+
+    def rotate_refresh_token(self, token: str, new_token: str, new_expiry: datetime) -> User:
+        key = token_digest(token)
+        # Holding the flush lock keeps the buffer out of flight; BEGIN IMMEDIATE
+        # serializes against rotations in other processes
+        with self._flush_lock:
+            with self._pending_lock:
+                entry = self._pending_refresh.get(key)
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if entry is None:
+                    entry = conn.execute(
+                        "SELECT user_id, expires_at FROM refresh_tokens WHERE token = ?", (key,)
+                    ).fetchone()
+                if entry is None or entry[1] <= time.time():
+                    raise TokenError("Invalid refresh token", 401)
+                user = self.find_by_id(entry[0])
+                if not user or not user.is_active:
+                    raise AuthenticationError("User not found or inactive", 401)
+                conn.execute("DELETE FROM refresh_tokens WHERE token = ?", (key,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO refresh_tokens (token, user_id, expires_at) VALUES (?, ?, ?)",
+                    (token_digest(new_token), user.id, int(new_expiry.timestamp()))
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            with self._pending_lock:
+                self._pending_refresh.pop(key, None)
+        return user
+
+    def record_login_attempt(self, user_id: str, success: bool, max_failed_attempts: int,
+                             lockout_seconds: int, password_hash: Optional[str] = None) -> User:
+        # A buffered update of this user must land first, or its stale
+        # counters would later overwrite the ones written here
+        with self._pending_lock:
+            buffered = user_id in self._pending_users or user_id in self._inflight_users
+        if buffered:
+            self.flush()
+        # BEGIN IMMEDIATE takes the database write lock before the read, so
+        # concurrent attempts from any process apply one after another
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"SELECT {self._USER_COLUMNS} FROM users WHERE id = ?", (user_id,)
+            ).fetchone()
+            if row is None:
+                raise ValidationError("User not found")
+            user = self._row_to_user(row)
+            self._apply_login_attempt(user, success, max_failed_attempts, lockout_seconds, password_hash)
+            conn.execute(
+                "UPDATE users SET password_hash = ?, last_login = ?, failed_login_attempts = ?, "
+                "last_failed_login = ? WHERE id = ?",
+                (user.password_hash, user.last_login, user.failed_login_attempts, user.last_failed_login, user.id)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return user
+
+    def revoke_user_sessions(self, user_id: str) -> int:
+        with self._flush_lock:
+            with self._pending_lock:
+                buffered = [key for key, (owner, _) in self._pending_refresh.items() if owner == user_id]
+                for key in buffered:
+                    del self._pending_refresh[key]
+            # Served by idx_refresh_tokens_user
+            deleted = self._conn().execute("DELETE FROM refresh_tokens WHERE user_id = ?", (user_id,)).rowcount
+        return len(buffered) + deleted
+
+    def _after_buffered_write(self) -> None:
+        with self._pending_lock:
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            pending = len(self._pending_users) + len(self._pending_refresh)
+            overdue = time.monotonic() - self._pending_since >= self.batch_delay_seconds
+        if pending >= self.batch_size or overdue:
+            self.flush()
+        elif self._flusher is None:
+            self._start_flusher()
+
+    def _start_flusher(self) -> None:
+        with self._pending_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = Thread(target=self._flush_loop, name='sqlite-flush', daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            time.sleep(self.batch_delay_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Failed to flush buffered writes: %s", e)
+
+    def flush(self) -> None:
+        """Write all buffered updates in a single transaction"""
+        with self._flush_lock:
+            with self._pending_lock:
+                if not self._pending_users and not self._pending_refresh:
+                    return
+                self._inflight_users, self._pending_users = self._pending_users, {}
+                self._inflight_refresh, self._pending_refresh = self._pending_refresh, {}
+                self._pending_since = None
+            
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "UPDATE users SET password_hash = ?, is_active = ?, is_verified = ?, "
+                    "last_login = ?, failed_login_attempts = ?, last_failed_login = ? WHERE id = ?",
+                    [
+                        (u.password_hash, int(u.is_active), int(u.is_verified), u.last_login,
+                         u.failed_login_attempts, u.last_failed_login, u.id)
+                        for u in self._inflight_users.values()
+                    ]
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO refresh_tokens (token, user_id, expires_at) VALUES (?, ?, ?)",
+                    [
+                        (key, user_id, expires_at)
+                        for key, (user_id, expires_at) in self._inflight_refresh.items()
+                    ]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                with self._pending_lock:
+                    # Put the batch back, keeping anything newer written meanwhile
+                    self._pending_users = {**self._inflight_users, **self._pending_users}
+                    self._pending_refresh = {**self._inflight_refresh, **self._pending_refresh}
+                raise
+            finally:
+                with self._pending_lock:
+                    self._inflight_users = {}
+                    self._inflight_refresh = {}
+
+    def cleanup_expired_tokens(self, max_batch: Optional[int] = None) -> SweepStats:
+        batch_size = max_batch or self.sweep_batch_size
+        now = time.time()
+        stats = SweepStats()
+        stats.evicted_reset_tokens = self._sweep('reset_tokens', now, batch_size, stats)
+        stats.evicted_refresh_tokens = self._sweep('refresh_tokens', now, batch_size, stats)
+        self.last_sweep = stats
+        return stats
+
+    def _sweep(self, table: str, now: float, batch_size: int, stats: SweepStats) -> int:
+        conn = self._conn()
+        evicted = 0
+        while True:
+            started = time.perf_counter()
+            deleted = conn.execute(
+                f"DELETE FROM {table} WHERE token IN "
+                f"(SELECT token FROM {table} WHERE expires_at <= ? LIMIT ?)",
+                (now, batch_size)
+            ).rowcount
+            held = time.perf_counter() - started
+            evicted += deleted
+            stats.batches += 1
+            stats.lock_held_seconds += held
+            stats.max_lock_hold_seconds = max(stats.max_lock_hold_seconds, held)
+            if deleted < batch_size:
+                return evicted
+
+    def iter_snapshot(self, batch_size: int = 1000) -> Iterator[ExportBatch]:
+        """Snapshot export from a WAL read transaction on a dedicated connection.
+
+        Readers never block writers under WAL, so live traffic keeps going while
+        the export holds its transaction open.
+        """
+        self.flush()
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        try:
+            conn.execute("BEGIN")
+            # The first read pins the snapshot
+            taken_at = time.time()
+            cursor = conn.execute(f"SELECT {self._USER_COLUMNS} FROM users ORDER BY rowid")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                batch = ExportBatch([self._row_to_user(row) for row in rows])
+                ids = [user.id for user in batch.users]
+                # Stay well under SQLITE_MAX_VARIABLE_NUMBER
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    batch.sessions.extend(conn.execute(
+                        "SELECT user_id, token, expires_at FROM refresh_tokens "
+                        f"WHERE user_id IN ({', '.join('?' * len(chunk))}) AND expires_at > ? "
+                        "ORDER BY user_id",
+                        (*chunk, taken_at)
+                    ))
+                yield batch
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.close()
+
+    def close(self) -> None:
+        self.flush()
+        self._closed = True
+        with self._connections_lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+class _MappedTable:
+    """This process's descriptor, mapping and stripe thread locks for one table file"""
+    __slots__ = ('fd', 'mm', 'locks', 'capacity', 'stripe_slots', 'refs')
+
+    def __init__(self, fd: int, capacity: int, stripe_slots: int):
+        self.fd = fd
+        self.mm = mmap.mmap(fd, 0)
+        self.locks = [Lock() for _ in range(capacity // stripe_slots)]
+        self.capacity = capacity
+        self.stripe_slots = stripe_slots
+        self.refs = 0
+
+class SharedSessionTable:
+    """Cross-process refresh-token table in a memory-mapped file.
+
+    Fixed 96-byte slots hold a state byte, the expiry, a 32-byte token digest
+    and the user id. A key hashes to a stripe of ``stripe_slots`` slots and
+    probes linearly inside it. Writers take the stripe's thread lock plus an
+    fcntl byte-range lock and bump the stripe's sequence counter to odd while
+    they touch a slot, so readers never lock: they retry when the counter was
+    odd or moved. A writer that dies mid-update leaves the counter odd with the
+    slot recorded as dirty; the next writer tombstones that slot.
+    
+    A companion table in ``<path>.owners`` indexes the same entries by user:
+    its stripe is picked from the user id, so a user's sessions sit together
+    and remove_owner only visits them. A user whose stripe is full continues
+    in the next one; the full stripe keeps an overflow flag (the high bit of
+    its dirty word) so lookups know to follow on.
+    
+    fcntl locks belong to the process and are all dropped when any of its
+    descriptors for the file is closed, so each path is opened once per
+    process: tables on the same path share one descriptor, mapping and set of
+    stripe thread locks, and the last close releases them.
+    """
+    _open_files: Dict[str, _MappedTable] = {}
+    _open_files_lock = Lock()
+
+    MAGIC = b'AEPSESS1'
+    VERSION = 1
+    SLOT_SIZE = 96
+    _HEADER = struct.Struct('<8sIII')     # magic, version, capacity, stripe_slots
+    _HEADER_SIZE = 64
+    _STRIPE = struct.Struct('<II')        # sequence, dirty slot + 1 (0 when clean) | _OVERFLOW
+    _OVERFLOW = 1 << 31
+    _SLOT = struct.Struct('<BB6xq32s')    # state, user id length, expiry, digest
+    MAX_USER_ID = SLOT_SIZE - _SLOT.size
+    _EMPTY, _USED, _TOMBSTONE = 0, 1, 2
+    _READ_ATTEMPTS = 64
+
+    def __init__(self, path: str, capacity: int = 1 << 20, stripe_slots: int = 64,
+                 owner_index: bool = True):
+        if fcntl is None:
+            raise RuntimeError("SharedSessionTable needs POSIX fcntl locking")
+        self.path = path
+        self.created = False
+        self._key = os.path.realpath(path)
+        with self._open_files_lock:
+            mapped = self._open_files.get(self._key)
+            if mapped is None:
+                mapped = self._open(path, capacity, stripe_slots)
+                self._open_files[self._key] = mapped
+            mapped.refs += 1
+        self._file: Optional[_MappedTable] = mapped
+        self._fd = mapped.fd
+        self._mm = mapped.mm
+        
+        self.capacity = mapped.capacity
+        self.stripe_slots = mapped.stripe_slots
+        self.stripes = self.capacity // self.stripe_slots
+        self._slots_base = self._slots_offset(self.stripes)
+        self._sweep_cursor = 0
+        self.read_retries = 0
+        self.repairs = 0
+        
+        self.owners: Optional[SharedSessionTable] = None
+        if owner_index:
+            self.owners = SharedSessionTable(path + '.owners', capacity, stripe_slots, owner_index=False)
+            if self.owners.created:
+                # Index entries written before the owner index existed
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 0)
+                try:
+                    for entries in self.iter_entries(now=0):
+                        for user_id, digest, expires_at in entries:
+                            self.owners._index_add(user_id, digest, expires_at)
+                finally:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+
+    def _open(self, path: str, capacity: int, stripe_slots: int) -> _MappedTable:
+        # Caller holds _open_files_lock
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Byte 0 serializes initialization; stripe i is locked at byte 1 + i
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            self.created = os.fstat(fd).st_size == 0
+            if self.created:
+                capacity = max(stripe_slots, capacity // stripe_slots * stripe_slots)
+                os.ftruncate(fd, self._slots_offset(capacity // stripe_slots) + capacity * self.SLOT_SIZE)
+                os.pwrite(fd, self._HEADER.pack(self.MAGIC, self.VERSION, capacity, stripe_slots), 0)
+            else:
+                magic, version, capacity, stripe_slots = self._HEADER.unpack(os.pread(fd, self._HEADER.size, 0))
+                if magic != self.MAGIC or version != self.VERSION:
+                    raise ValueError(f"{path} is not a session table")
+            mapped = _MappedTable(fd, capacity, stripe_slots)
+        except BaseException:
+            os.close(fd)
+            raise
+        fcntl.lockf(fd, fcntl.LOCK_UN, 1, 0)
+        return mapped
+
+    @classmethod
+    def _after_fork(cls) -> None:
+        # Threads that held these locks in the parent don't exist in the child
+        cls._open_files_lock = Lock()
+        for mapped in cls._open_files.values():
+            mapped.locks = [Lock() for _ in mapped.locks]
+
+    @classmethod
+    def _slots_offset(cls, stripes: int) -> int:
+        return cls._HEADER_SIZE + (stripes * cls._STRIPE.size + 63) // 64 * 64
+
+    def _locate(self, digest: bytes) -> Tuple[int, int]:
+        h = int.from_bytes(digest[:8], 'little')
+        return h % self.stripes, (h // self.stripes) % self.stripe_slots
+
+    def _stripe_offset(self, stripe: int) -> int:
+        return self._HEADER_SIZE + stripe * self._STRIPE.size
+
+    def _slot_offset(self, stripe: int, slot: int) -> int:
+        return self._slots_base + (stripe * self.stripe_slots + slot) * self.SLOT_SIZE
+
+    @contextmanager
+    def _stripe_locked(self, stripe: int):
+        with self._file.locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 1 + stripe)
+            try:
+                seq, dirty = self._STRIPE.unpack_from(self._mm, self._stripe_offset(stripe))
+                if seq & 1:
+                    self._repair(stripe, seq, dirty & ~self._OVERFLOW, dirty & self._OVERFLOW)
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 1 + stripe)
+
+    def _repair(self, stripe: int, seq: int, dirty: int, flags: int) -> None:
+        # The previous writer died mid-update; the dirty slot may be torn
+        if dirty:
+            self._mm[self._slot_offset(stripe, dirty - 1)] = self._TOMBSTONE
+        self._STRIPE.pack_into(self._mm, self._stripe_offset(stripe), seq + 1, flags)
+        self.repairs += 1
+        logger.warning("Repaired session table stripe %s after an interrupted write", stripe)
+
+    def _begin_write(self, stripe: int, slot: int) -> int:
+        offset = self._stripe_offset(stripe)
+        seq, dirty = self._STRIPE.unpack_from(self._mm, offset)
+        self._STRIPE.pack_into(self._mm, offset, seq + 1, (dirty & self._OVERFLOW) | (slot + 1))
+        return seq
+
+    def _end_write(self, stripe: int, seq: int) -> None:
+        offset = self._stripe_offset(stripe)
+        flags = self._STRIPE.unpack_from(self._mm, offset)[1] & self._OVERFLOW
+        self._STRIPE.pack_into(self._mm, offset, seq + 2, flags)
+
+    def _set_state(self, stripe: int, slot: int, state: int) -> None:
+        seq = self._begin_write(stripe, slot)
+        self._mm[self._slot_offset(stripe, slot)] = state
+        self._end_write(stripe, seq)
+
+    def _scan(self, stripe: int, start: int, digest: bytes, now: float) -> Tuple[Optional[int], Optional[int]]:
+        """Return (slot holding ``digest``, first reusable slot) along its probe sequence"""
+        mm = self._mm
+        reusable = None
+        for i in range(self.stripe_slots):
+            slot = (start + i) % self.stripe_slots
+            offset = self._slot_offset(stripe, slot)
+            state = mm[offset]
+            if state == self._EMPTY:
+                return None, slot if reusable is None else reusable
+            if state == self._USED:
+                if mm[offset + 16:offset + 48] == digest:
+                    return slot, reusable
+                if reusable is None and struct.unpack_from('<q', mm, offset + 8)[0] <= now:
+                    reusable = slot
+            elif reusable is None:
+                reusable = slot
+        return None, reusable
+
+    def _read(self, stripe: int, slot: int) -> Tuple[str, int]:
+        offset = self._slot_offset(stripe, slot)
+        _, length, expires_at, _ = self._SLOT.unpack_from(self._mm, offset)
+        start = offset + self._SLOT.size
+        return self._mm[start:start + length].decode('utf-8'), expires_at
+
+    def store(self, digest: bytes, user_id: str, expires_at: int) -> None:
+        encoded = user_id.encode('utf-8')
+        if len(encoded) > self.MAX_USER_ID:
+            raise ValueError(f"User id longer than {self.MAX_USER_ID} bytes")
+        stripe, start = self._locate(digest)
+        with self._stripe_locked(stripe):
+            if self.owners is None:
+                self._store_at(stripe, start, digest, encoded, expires_at)
+                return
+            # Index first: a writer dying in between leaves a stale index entry,
+            # which remove_owner skips, rather than a session it cannot find.
+            # Lock order is always table stripe, then owner stripe.
+            self.owners._index_add(user_id, digest, expires_at)
+            try:
+                previous = self._store_at(stripe, start, digest, encoded, expires_at)
+            except ServiceOverloadedError:
+                self.owners._index_remove(user_id, digest)
+                raise
+            if previous is not None and previous != user_id:
+                self.owners._index_remove(previous, digest)
+
+    def _store_at(self, stripe: int, start: int, digest: bytes, encoded: bytes, expires_at: int) -> Optional[str]:
+        """Write the entry into ``stripe`` (lock held); returns the owner it replaced, if any"""
+        match, reusable = self._scan(stripe, start, digest, time.time())
+        slot = match if match is not None else reusable
+        if slot is None:
+            raise ServiceOverloadedError("Session table is full", 503)
+        previous = self._read(stripe, match)[0] if match is not None else None
+        seq = self._begin_write(stripe, slot)
+        offset = self._slot_offset(stripe, slot)
+        self._SLOT.pack_into(self._mm, offset, self._USED, len(encoded), expires_at, digest)
+        self._mm[offset + self._SLOT.size:offset + self._SLOT.size + len(encoded)] = encoded
+        self._end_write(stripe, seq)
+        return previous
+
+    def _remove_at(self, stripe: int, start: int, digest: bytes) -> Optional[Tuple[str, int]]:
+        """Tombstone ``digest`` in ``stripe`` (lock held); returns the removed (user_id, expires_at)"""
+        match, _ = self._scan(stripe, start, digest, 0)
+        if match is None:
+            return None
+        entry = self._read(stripe, match)
+        self._set_state(stripe, match, self._TOMBSTONE)
+        self._tidy(stripe)
+        return entry
+
+    def lookup(self, digest: bytes) -> Optional[Tuple[str, int]]:
+        """(user_id, expires_at) for ``digest``, expired or not"""
+        stripe, start = self._locate(digest)
+        offset = self._stripe_offset(stripe)
+        for _ in range(self._READ_ATTEMPTS):
+            seq = struct.unpack_from('<I', self._mm, offset)[0]
+            if not seq & 1:
+                try:
+                    match, _ = self._scan(stripe, start, digest, 0)
+                    entry = self._read(stripe, match) if match is not None else None
+                except (UnicodeDecodeError, ValueError):
+                    entry = False
+                if entry is not False and struct.unpack_from('<I', self._mm, offset)[0] == seq:
+                    return entry
+            self.read_retries += 1
+        # Persistent odd sequence means a crashed writer; locking repairs the stripe
+        with self._stripe_locked(stripe):
+            match, _ = self._scan(stripe, start, digest, 0)
+            return self._read(stripe, match) if match is not None else None
+
+    def get(self, digest: bytes) -> Optional[str]:
+        entry = self.lookup(digest)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def remove(self, digest: bytes) -> bool:
+        return self.take(digest) is not None
+
+    def take(self, digest: bytes) -> Optional[Tuple[str, int]]:
+        """Atomically remove ``digest`` and return its (user_id, expires_at); at most one caller wins"""
+        stripe, start = self._locate(digest)
+        with self._stripe_locked(stripe):
+            entry = self._remove_at(stripe, start, digest)
+            if entry is not None and self.owners is not None:
+                self.owners._index_remove(entry[0], digest)
+            return entry
+
+    def remove_owner(self, user_id: str) -> int:
+        """Remove every entry owned by ``user_id``, in time proportional to their entries"""
+        if self.owners is None:
+            raise RuntimeError("remove_owner needs the owner index")
+        removed = 0
+        for digest in self.owners._index_owned(user_id):
+            stripe, start = self._locate(digest)
+            with self._stripe_locked(stripe):
+                match, _ = self._scan(stripe, start, digest, 0)
+                # Re-check the owner: the index entry may be stale
+                if match is not None and self._read(stripe, match)[0] == user_id:
+                    self._set_state(stripe, match, self._TOMBSTONE)
+                    self._tidy(stripe)
+                    removed += 1
+                # Index entry last, so a crash never leaves an unindexed session
+                self.owners._index_remove(user_id, digest)
+        return removed
+
+    # Owner-index methods, called on the companion table. A user's entries start
+    # in its home stripe and run on through every stripe flagged as overflowed.
+
+    def _index_chain(self, user_id: str, digest: bytes = bytes(8)) -> Iterator[Tuple[int, int]]:
+        """Yield (stripe, probe start) along ``user_id``'s chain, each with its lock held"""
+        h = int.from_bytes(hashlib.blake2b(user_id.encode('utf-8'), digest_size=8).digest(), 'little')
+        stripe = h % self.stripes
+        start = int.from_bytes(digest[:8], 'little') % self.stripe_slots
+        for _ in range(self.stripes):
+            with self._stripe_locked(stripe):
+                yield stripe, start
+                overflowed = self._STRIPE.unpack_from(self._mm, self._stripe_offset(stripe))[1] & self._OVERFLOW
+            if not overflowed:
+                return
+            stripe = (stripe + 1) % self.stripes
+
+    def _index_add(self, user_id: str, digest: bytes, expires_at: int) -> None:
+        encoded = user_id.encode('utf-8')
+        for stripe, start in self._index_chain(user_id, digest):
+            try:
+                self._store_at(stripe, start, digest, encoded, expires_at)
+                return
+            except ServiceOverloadedError:
+                # Sticky: entries may live past this stripe from now on
+                offset = self._stripe_offset(stripe)
+                seq, dirty = self._STRIPE.unpack_from(self._mm, offset)
+                self._STRIPE.pack_into(self._mm, offset, seq, dirty | self._OVERFLOW)
+        raise ServiceOverloadedError("Session table is full", 503)
+
+    def _index_remove(self, user_id: str, digest: bytes) -> None:
+        for stripe, start in self._index_chain(user_id, digest):
+            if self._remove_at(stripe, start, digest) is not None:
+                return
+
+    def _index_owned(self, user_id: str) -> List[bytes]:
+        """Digests indexed under ``user_id``"""
+        encoded = user_id.encode('utf-8')
+        mm = self._mm
+        digests = []
+        for stripe, _ in self._index_chain(user_id):
+            for slot in range(self.stripe_slots):
+                offset = self._slot_offset(stripe, slot)
+                if (mm[offset] == self._USED and mm[offset + 1] == len(encoded)
+                        and mm[offset + self._SLOT.size:offset + self._SLOT.size + len(encoded)] == encoded):
+                    digests.append(bytes(mm[offset + 16:offset + 48]))
+        return digests
+
+    def _tidy(self, stripe: int) -> None:
+        # A tombstone directly before an empty slot ends every probe anyway
+        mm = self._mm
+        n = self.stripe_slots
+        for slot in range(n):
+            if mm[self._slot_offset(stripe, slot)] != self._EMPTY:
+                continue
+            prev = (slot - 1) % n
+            while prev != slot and mm[self._slot_offset(stripe, prev)] == self._TOMBSTONE:
+                self._set_state(stripe, prev, self._EMPTY)
+                prev = (prev - 1) % n
+
+    def sweep(self, max_slots: Optional[int] = None, stats: Optional[SweepStats] = None) -> int:
+        """Tombstone expired entries in the next ``max_slots`` slots, one stripe lock at a time"""
+        stripes = self.stripes if max_slots is None else min(self.stripes, max(1, max_slots // self.stripe_slots))
+        now = time.time()
+        evicted = 0
+        for _ in range(stripes):
+            stripe = self._sweep_cursor
+            self._sweep_cursor = (stripe + 1) % self.stripes
+            started = time.perf_counter()
+            with self._stripe_locked(stripe):
+                for slot in range(self.stripe_slots):
+                    offset = self._slot_offset(stripe, slot)
+                    if self._mm[offset] == self._USED and struct.unpack_from('<q', self._mm, offset + 8)[0] <= now:
+                        self._set_state(stripe, slot, self._TOMBSTONE)
+                        evicted += 1
+                self._tidy(stripe)
+            if stats is not None:
+                held = time.perf_counter() - started
+                stats.batches += 1
+                stats.lock_held_seconds += held
+                stats.max_lock_hold_seconds = max(stats.max_lock_hold_seconds, held)
+        if self.owners is not None:
+            # Expired index entries are already reusable; this keeps probe runs short
+            self.owners.sweep(max_slots)
+        return evicted
+
+    def iter_entries(self, now: Optional[float] = None) -> Iterator[List[Tuple[str, bytes, int]]]:
+        """Yield the (user_id, digest, expires_at) entries live at ``now``, one stripe per list.
+
+        Each stripe is read under its lock, so a list is consistent within its
+        stripe but not with stripes read before or after it.
+        """
+        now = time.time() if now is None else now
+        for stripe in range(self.stripes):
+            entries = []
+            with self._stripe_locked(stripe):
+                for slot in range(self.stripe_slots):
+                    offset = self._slot_offset(stripe, slot)
+                    if self._mm[offset] != self._USED:
+                        continue
+                    user_id, expires_at = self._read(stripe, slot)
+                    if expires_at > now:
+                        entries.append((user_id, bytes(self._mm[offset + 16:offset + 48]), expires_at))
+            if entries:
+                yield entries
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'capacity': self.capacity,
+            'stripes': self.stripes,
+            'read_retries': self.read_retries,
+            'repairs': self.repairs
+        }
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        if self.owners is not None:
+            self.owners.close()
+        mapped, self._file = self._file, None
+        with self._open_files_lock:
+            mapped.refs -= 1
+            if mapped.refs:
+                return
+            del self._open_files[self._key]
+        mapped.mm.close()
+        os.close(mapped.fd)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=SharedSessionTable._after_fork)
+
+class SharedSessionUserStore:
+    """UserStore proxy that keeps refresh tokens in a SharedSessionTable.
+
+    Users and reset tokens stay in the wrapped store; refresh tokens issued by
+    any worker process on the host are visible to all of them.
+    """
+    # Each sweep covers this fraction of the table; inserts also reuse expired slots
+    SWEEP_FRACTION = 8
+
+    def __init__(self, store: UserStore, sessions: SharedSessionTable):
+        self._store = store
+        self.sessions = sessions
+        self.last_sweep: Optional[SweepStats] = None
+
+    def __getattr__(self, name: str):
+        return getattr(self._store, name)
+
+    @property
+    def metrics(self) -> Optional[AuthMetrics]:
+        return self._store.metrics
+
+    @metrics.setter
+    def metrics(self, metrics: Optional[AuthMetrics]) -> None:
+        self._store.metrics = metrics
+
+    def store_refresh_token(self, user_id: str, token: str, expiry: datetime) -> None:
+        self.sessions.store(token_digest(token), user_id, int(expiry.timestamp()))
+
+    def get_refresh_token_user(self, token: str) -> Optional[str]:
+        return self.sessions.get(token_digest(token))
+
+    def remove_refresh_token(self, token: str) -> None:
+        self.sessions.remove(token_digest(token))
+
+    def rotate_refresh_token(self, token: str, new_token: str, new_expiry: datetime) -> User:
+        key = token_digest(token)
+        entry = self.sessions.lookup(key)
+        if entry is None or entry[1] <= time.time():
+            raise TokenError("Invalid refresh token", 401)
+        user = self._store.find_by_id(entry[0])
+        if not user or not user.is_active:
+            raise AuthenticationError("User not found or inactive", 401)
+        # take() is atomic across processes, so only one concurrent rotation wins
+        if self.sessions.take(key) is None:
+            raise TokenError("Invalid refresh token", 401)
+        self.sessions.store(token_digest(new_token), user.id, int(new_expiry.timestamp()))
+        return user
+
+    def revoke_user_sessions(self, user_id: str) -> int:
+        return self.sessions.remove_owner(user_id)
+
+    def cleanup_expired_tokens(self, max_batch: Optional[int] = None) -> SweepStats:
+        stats = self._store.cleanup_expired_tokens(max_batch)
+        stats.evicted_refresh_tokens += self.sessions.sweep(
+            self.sessions.capacity // self.SWEEP_FRACTION, stats
+        )
+        self.last_sweep = stats
+        return stats
+
+    def iter_snapshot(self, batch_size: int = 1000) -> Iterator[ExportBatch]:
+        # Users come from the wrapped store's snapshot. Sessions are scanned from
+        # the table afterwards, consistent per stripe only: other processes keep
+        # writing to it and there is no version to pin
+        taken_at = time.time()
+        for batch in self._store.iter_snapshot(batch_size):
+            batch.sessions = []
+            yield batch
+        batch = ExportBatch()
+        for entries in self.sessions.iter_entries(taken_at):
+            batch.sessions.extend(entries)
+            if len(batch.sessions) >= batch_size:
+                yield batch
+                batch = ExportBatch()
+        if batch.sessions:
+            yield batch
+
+    def close(self) -> None:
+        self._store.close()
+        self.sessions.close()
+
+def create_user_store(config: AuthConfig) -> UserStore:
+    if config.user_store == 'memory' and config.persistence_dir:
+        store = DurableUserRepository(
+            config.persistence_dir,
+            durable=config.journal_fsync,
+            commit_window_seconds=config.journal_commit_window_ms / 1000,
+            snapshot_interval_seconds=config.snapshot_interval_seconds,
+            sweep_batch_size=config.token_sweep_batch_size
+        )
+    elif config.user_store == 'memory':
+        store = UserRepository(sweep_batch_size=config.token_sweep_batch_size)
+    elif config.user_store == 'sqlite':
+        store = SQLiteUserRepository(
+            config.sqlite_path,
+            batch_size=config.sqlite_write_batch_size,
+            batch_delay_seconds=config.sqlite_write_batch_delay_ms / 1000,
+            sweep_batch_size=config.token_sweep_batch_size
+        )
+    else:
+        raise ValueError(f"Unknown user store: {config.user_store}")
+    
+    if config.session_store == 'shared':
+        return SharedSessionUserStore(
+            store, SharedSessionTable(config.session_shm_path, config.session_shm_slots)
+        )
+    if config.session_store != 'local':
+        raise ValueError(f"Unknown session store: {config.session_store}")
+    return store
+
+class InstrumentedUserStore:
+    """Proxy that times every public call into a UserStore as the 'repository' stage"""
+    def __init__(self, store: UserStore, metrics: AuthMetrics):
+        self._store = store
+        self._metrics = metrics
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._store, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        metrics = self._metrics
+
+        @wraps(attr)
+        def timed(*args, **kwargs):
+            with metrics.timer('stage_seconds', stage='repository', op=name):
+                return attr(*args, **kwargs)
+        # Cache on the instance so later lookups skip __getattr__
+        self.__dict__[name] = timed
+        return timed
+
+def _b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+def parse_jwt_keys(spec: str) -> Dict[str, str]:
+    """Parse a ``kid:secret,kid:secret`` key ring specification"""
+    keys: Dict[str, str] = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        kid, sep, secret = item.partition(':')
+        if not sep or not kid.strip() or not secret:
+            raise ValueError(f"Malformed JWT key entry for kid {kid.strip()!r}")
+        keys[kid.strip()] = secret
+    return keys
+
+class TokenKeyRing:
+    """HS256 signing keys indexed by ``kid``, with precomputed HMAC state.
+
+    The key with kid ``None`` verifies tokens that carry no ``kid`` header, which
+    is every token issued before a key ring was configured. Rotation swaps in a
+    new lookup table, so readers never take a lock. ``generation`` changes
+    whenever a key is removed or replaced, so caches of verified tokens can
+    tell their entries were checked against a key that is gone.
+    """
+    def __init__(self, keys: Dict[Optional[str], str], active_kid: Optional[str] = None):
+        if active_kid not in keys:
+            raise ValueError(f"Active kid {active_kid!r} is not in the key ring")
+        self._lock = Lock()
+        self._secrets = dict(keys)
+        self.active_kid = active_kid
+        self.generation = 0
+        self._rebuild()
+
+    @classmethod
+    def from_config(cls, config: 'AuthConfig') -> 'TokenKeyRing':
+        keys: Dict[Optional[str], str] = {None: config.jwt_secret}
+        keys.update(parse_jwt_keys(config.jwt_keys))
+        return cls(keys, config.jwt_active_kid or None)
+
+    @staticmethod
+    def _header_segment(kid: Optional[str]) -> str:
+        # Same bytes PyJWT emits: compact separators, sorted keys
+        header = {'alg': 'HS256', 'typ': 'JWT'}
+        if kid is not None:
+            header['kid'] = kid
+        return _b64url_encode(json.dumps(header, separators=(',', ':'), sort_keys=True).encode('utf-8'))
+
+    def _rebuild(self) -> None:
+        macs = {
+            kid: hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256)
+            for kid, secret in self._secrets.items()
+        }
+        self._macs = macs
+        self._by_header = {self._header_segment(kid): macs[kid] for kid in macs}
+        self._signing = (self._header_segment(self.active_kid) + '.', macs[self.active_kid])
+
+    def add_key(self, kid: str, secret: str, activate: bool = False) -> None:
+        with self._lock:
+            if kid in self._secrets:
+                self.generation += 1
+            self._secrets[kid] = secret
+            if activate:
+                self.active_kid = kid
+            self._rebuild()
+
+    def activate(self, kid: Optional[str]) -> None:
+        with self._lock:
+            if kid not in self._secrets:
+                raise ValueError(f"Unknown kid {kid!r}")
+            self.active_kid = kid
+            self._rebuild()
+
+    def remove_key(self, kid: Optional[str]) -> None:
+        """Retire a key; tokens signed with it stop verifying"""
+        with self._lock:
+            if kid == self.active_kid:
+                raise ValueError("Cannot remove the active signing key")
+            if self._secrets.pop(kid, None) is not None:
+                self.generation += 1
+            self._rebuild()
+
+    def kids(self) -> List[Optional[str]]:
+        return list(self._macs)
+
+    def signing_state(self) -> Tuple[str, Any]:
+        return self._signing
+
+    def verifying_mac(self, header_segment: str) -> Optional[Any]:
+        mac = self._by_header.get(header_segment)
+        if mac is not None:
+            return mac
+        # Headers from other encoders may order or space their JSON differently
+        try:
+            header = json.loads(_b64url_decode(header_segment))
+        except (ValueError, TypeError):
+            return None
+        if not isinstance(header, dict) or header.get('alg') != 'HS256':
+            return None
+        return self._macs.get(header.get('kid'))
+
+class HS256TokenCodec:
+    """Access-token encoder/verifier, wire-compatible with PyJWT HS256 tokens.
+
+    Signing copies a keyed HMAC object instead of re-deriving the key pads for
+    every token, and claims stay plain integers end to end.
+    """
+    def __init__(self, key_ring: TokenKeyRing):
+        self.key_ring = key_ring
+
+    def encode(self, user_id: str, email: str, expires_at: int, issued_at: int) -> str:
+        header, mac = self.key_ring.signing_state()
+        signing_input = header + _encode_claims(user_id, email, expires_at, issued_at)
+        mac = mac.copy()
+        mac.update(signing_input.encode('ascii'))
+        return signing_input + '.' + _b64url_encode(mac.digest())
+
+    def decode(self, token: str, now: Optional[float] = None) -> TokenPayload:
+        try:
+            header, payload_segment, signature = token.split('.')
+        except (AttributeError, ValueError):
+            raise TokenError("Invalid token", 401)
+        mac = self.key_ring.verifying_mac(header)
+        if mac is None:
+            raise TokenError("Invalid token", 401)
+        
+        mac = mac.copy()
+        mac.update(f"{header}.{payload_segment}".encode('ascii', 'replace'))
+        try:
+            valid = hmac.compare_digest(mac.digest(), _b64url_decode(signature))
+        except (ValueError, TypeError):
+            raise TokenError("Invalid token", 401)
+        if not valid:
+            raise TokenError("Invalid token", 401)
+        return _decode_claims(payload_segment, now)
+
+def _encode_claims(user_id: str, email: str, expires_at: int, issued_at: int) -> str:
+    payload = {'sub': user_id, 'email': email, 'exp': expires_at, 'iat': issued_at}
+    return _b64url_encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+
+def _decode_claims(payload_segment: str, now: Optional[float] = None) -> TokenPayload:
+    """Claims of a token whose signature has already been checked"""
+    try:
+        claims = json.loads(_b64url_decode(payload_segment))
+    except (ValueError, TypeError):
+        raise TokenError("Invalid token", 401)
+    if not isinstance(claims, dict):
+        raise TokenError("Invalid token", 401)
+    
+    try:
+        payload = TokenPayload(
+            user_id=claims['sub'],
+            email=claims['email'],
+            expires_at=int(claims['exp']),
+            issued_at=int(claims['iat'])
+        )
+    except (KeyError, TypeError, ValueError):
+        raise TokenError("Invalid token", 401)
+    if not isinstance(payload.user_id, str) or not isinstance(payload.email, str):
+        raise TokenError("Invalid token", 401)
+    if payload.expires_at <= (time.time() if now is None else now):
+        raise TokenError("Token has expired", 401)
+    return payload
+
+ASYMMETRIC_JWT_ALGORITHMS = ('ES256', 'EdDSA')
+
+def _key_algorithm(key: Any) -> str:
+    """JWS ``alg`` for an Ed25519 or P-256 key, private or public"""
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return 'EdDSA'
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)) and key.curve.name == 'secp256r1':
+        return 'ES256'
+    raise ValueError("Only Ed25519 (EdDSA) and P-256 (ES256) keys are supported")
+
+def generate_signing_key(algorithm: str) -> Any:
+    if algorithm == 'EdDSA':
+        return ed25519.Ed25519PrivateKey.generate()
+    if algorithm == 'ES256':
+        return ec.generate_private_key(ec.SECP256R1())
+    raise ValueError(f"Unknown asymmetric JWT algorithm: {algorithm}")
+
+def load_signing_key(path: str) -> Any:
+    """Read an unencrypted PEM private key (Ed25519 or P-256)"""
+    with open(path, 'rb') as f:
+        key = serialization.load_pem_private_key(f.read(), password=None)
+    _key_algorithm(key)
+    return key
+
+def jwk_thumbprint(jwk: Dict[str, Any]) -> str:
+    """RFC 7638 thumbprint, used as the default ``kid``"""
+    members = ('crv', 'kty', 'x', 'y') if jwk['kty'] == 'EC' else ('crv', 'kty', 'x')
+    canonical = json.dumps({name: jwk[name] for name in members}, separators=(',', ':'), sort_keys=True)
+    return _b64url_encode(hashlib.sha256(canonical.encode('utf-8')).digest())
+
+def public_jwk(public_key: Any, kid: Optional[str] = None) -> Dict[str, Any]:
+    algorithm = _key_algorithm(public_key)
+    if algorithm == 'EdDSA':
+        raw = public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        jwk = {'kty': 'OKP', 'crv': 'Ed25519', 'x': _b64url_encode(raw)}
+    else:
+        numbers = public_key.public_numbers()
+        jwk = {
+            'kty': 'EC', 'crv': 'P-256',
+            'x': _b64url_encode(numbers.x.to_bytes(32, 'big')),
+            'y': _b64url_encode(numbers.y.to_bytes(32, 'big'))
+        }
+    jwk.update(kid=kid or jwk_thumbprint(jwk), alg=algorithm, use='sig')
+    return jwk
+
+def public_key_from_jwk(jwk: Dict[str, Any]) -> Any:
+    kty, crv = jwk.get('kty'), jwk.get('crv')
+    if kty == 'OKP' and crv == 'Ed25519':
+        return ed25519.Ed25519PublicKey.from_public_bytes(_b64url_decode(jwk['x']))
+    if kty == 'EC' and crv == 'P-256':
+        x = int.from_bytes(_b64url_decode(jwk['x']), 'big')
+        y = int.from_bytes(_b64url_decode(jwk['y']), 'big')
+        return ec.EllipticCurvePublicNumbers(x, y, ec.SECP256R1()).public_key()
+    raise ValueError(f"Unsupported JWK key type {kty}/{crv}")
+
+def _jws_signer(algorithm: str, private_key: Any) -> Callable[[bytes], bytes]:
+    if algorithm == 'EdDSA':
+        return private_key.sign
+    ecdsa = ec.ECDSA(hashes.SHA256())
+
+    def sign_es256(data: bytes) -> bytes:
+        # JWS wants fixed-width r || s, not the DER structure cryptography returns
+        r, s = asym_utils.decode_dss_signature(private_key.sign(data, ecdsa))
+        return r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+    return sign_es256
+
+def _jws_verifier(algorithm: str, public_key: Any) -> Callable[[bytes, bytes], bool]:
+    invalid = crypto_exceptions.InvalidSignature
+    if algorithm == 'EdDSA':
+        def verify_eddsa(signature: bytes, data: bytes) -> bool:
+            try:
+                public_key.verify(signature, data)
+            except invalid:
+                return False
+            return True
+        return verify_eddsa
+    ecdsa = ec.ECDSA(hashes.SHA256())
+
+    def verify_es256(signature: bytes, data: bytes) -> bool:
+        if len(signature) != 64:
+            return False
+        der = asym_utils.encode_dss_signature(
+            int.from_bytes(signature[:32], 'big'), int.from_bytes(signature[32:], 'big')
+        )
+        try:
+            public_key.verify(der, data, ecdsa)
+        except invalid:
+            return False
+        return True
+    return verify_es256
+
+class AsymmetricKeyRing:
+    """ES256/EdDSA keys indexed by ``kid``: private keys sign, public keys verify.
+
+    Public keys without a private half verify tokens from retired or remote
+    signers. All public keys are published by jwks(). As with TokenKeyRing,
+    changes swap in new lookup tables so readers never take a lock.
+    """
+    def __init__(self, private_keys: Optional[Dict[str, Any]] = None,
+                 public_keys: Optional[Dict[str, Any]] = None,
+                 active_kid: Optional[str] = None):
+        self._lock = Lock()
+        self._private = dict(private_keys or {})
+        self._public = {kid: key.public_key() for kid, key in self._private.items()}
+        self._public.update(public_keys or {})
+        if active_kid is not None and active_kid not in self._private:
+            raise ValueError(f"Active kid {active_kid!r} has no private key in the key ring")
+        self.active_kid = active_kid
+        # Changes whenever a key is removed or replaced; see TokenKeyRing
+        self.generation = 0
+        self._rebuild()
+
+    @classmethod
+    def from_config(cls, config: 'AuthConfig') -> 'AsymmetricKeyRing':
+        keys = {kid: load_signing_key(path) for kid, path in parse_jwt_keys(config.jwt_private_keys).items()}
+        if not keys:
+            key = generate_signing_key(config.jwt_algorithm)
+            keys[public_jwk(key.public_key())['kid']] = key
+            logger.warning(
+                "JWT_PRIVATE_KEYS is not set; signing with an ephemeral %s key. "
+                "Tokens will not verify after a restart", config.jwt_algorithm
+            )
+        ring = cls(keys, active_kid=config.jwt_active_kid or next(iter(keys)))
+        active_algorithm = _key_algorithm(keys[ring.active_kid])
+        if active_algorithm != config.jwt_algorithm:
+            raise ValueError(
+                f"Active key {ring.active_kid!r} is {active_algorithm}, but JWT_ALGORITHM is {config.jwt_algorithm}"
+            )
+        return ring
+
+    @classmethod
+    def from_jwks(cls, jwks: Dict[str, Any]) -> 'AsymmetricKeyRing':
+        """Verify-only ring; keys of unsupported types or for other uses are skipped"""
+        public_keys = {}
+        for jwk in jwks['keys']:
+            if jwk.get('use', 'sig') != 'sig' or not jwk.get('kid'):
+                continue
+            try:
+                key = public_key_from_jwk(jwk)
+            except (KeyError, ValueError):
+                continue
+            if jwk.get('alg', _key_algorithm(key)) == _key_algorithm(key):
+                public_keys[jwk['kid']] = key
+        return cls(public_keys=public_keys)
+
+    @staticmethod
+    def _header_segment(algorithm: str, kid: str) -> str:
+        header = {'alg': algorithm, 'kid': kid, 'typ': 'JWT'}
+        return _b64url_encode(json.dumps(header, separators=(',', ':'), sort_keys=True).encode('utf-8'))
+
+    def _rebuild(self) -> None:
+        verifiers: Dict[str, Tuple[str, Callable[[bytes, bytes], bool]]] = {}
+        for kid, key in self._public.items():
+            algorithm = _key_algorithm(key)
+            verifiers[kid] = (algorithm, _jws_verifier(algorithm, key))
+        self._verifiers = verifiers
+        self._by_header = {self._header_segment(alg, kid): verify for kid, (alg, verify) in verifiers.items()}
+        self._jwks = {'keys': [public_jwk(key, kid) for kid, key in self._public.items()]}
+        self._signing = None
+        if self.active_kid is not None:
+            key = self._private[self.active_kid]
+            algorithm = _key_algorithm(key)
+            self._signing = (self._header_segment(algorithm, self.active_kid) + '.', _jws_signer(algorithm, key))
+
+    def add_key(self, kid: str, private_key: Any, activate: bool = False) -> None:
+        _key_algorithm(private_key)
+        with self._lock:
+            if kid in self._public:
+                self.generation += 1
+            self._private[kid] = private_key
+            self._public[kid] = private_key.public_key()
+            if activate:
+                self.active_kid = kid
+            self._rebuild()
+
+    def add_public_key(self, kid: str, public_key: Any) -> None:
+        _key_algorithm(public_key)
+        with self._lock:
+            if kid in self._public:
+                self.generation += 1
+            self._public[kid] = public_key
+            self._rebuild()
+
+    def activate(self, kid: str) -> None:
+        with self._lock:
+            if kid not in self._private:
+                raise ValueError(f"No private key for kid {kid!r}")
+            self.active_kid = kid
+            self._rebuild()
+
+    def remove_key(self, kid: str) -> None:
+        """Retire a key; tokens signed with it stop verifying and it leaves the JWKS"""
+        with self._lock:
+            if kid == self.active_kid:
+                raise ValueError("Cannot remove the active signing key")
+            self._private.pop(kid, None)
+            if self._public.pop(kid, None) is not None:
+                self.generation += 1
+            self._rebuild()
+
+    def kids(self) -> List[str]:
+        return list(self._verifiers)
+
+    def jwks(self) -> Dict[str, Any]:
+        return self._jwks
+
+    def signing_state(self) -> Tuple[str, Callable[[bytes], bytes]]:
+        if self._signing is None:
+            raise ValueError("Key ring has no active signing key")
+        return self._signing
+
+    def verifier(self, header_segment: str) -> Optional[Callable[[bytes, bytes], bool]]:
+        verify = self._by_header.get(header_segment)
+        if verify is not None:
+            return verify
+        try:
+            header = json.loads(_b64url_decode(header_segment))
+        except (ValueError, TypeError):
+            return None
+        if not isinstance(header, dict):
+            return None
+        # The key decides the algorithm; a header can't talk us into another one
+        entry = self._verifiers.get(header.get('kid'))
+        if entry is None or entry[0] != header.get('alg'):
+            return None
+        return entry[1]
+
+class JWSTokenCodec:
+    """ES256/EdDSA access-token encoder/verifier with the same claims as HS256TokenCodec"""
+    def __init__(self, key_ring: AsymmetricKeyRing):
+        self.key_ring = key_ring
+
+    def encode(self, user_id: str, email: str, expires_at: int, issued_at: int) -> str:
+        header, sign = self.key_ring.signing_state()
+        signing_input = header + _encode_claims(user_id, email, expires_at, issued_at)
+        return signing_input + '.' + _b64url_encode(sign(signing_input.encode('ascii')))
+
+    def decode(self, token: str, now: Optional[float] = None) -> TokenPayload:
+        try:
+            header, payload_segment, signature = token.split('.')
+        except (AttributeError, ValueError):
+            raise TokenError("Invalid token", 401)
+        verify = self.key_ring.verifier(header)
+        if verify is None:
+            raise TokenError("Invalid token", 401)
+        try:
+            valid = verify(_b64url_decode(signature), f"{header}.{payload_segment}".encode('ascii', 'replace'))
+        except (ValueError, TypeError):
+            raise TokenError("Invalid token", 401)
+        if not valid:
+            raise TokenError("Invalid token", 401)
+        return _decode_claims(payload_segment, now)
+
+def create_token_codec(config: 'AuthConfig') -> Union[HS256TokenCodec, JWSTokenCodec]:
+    if config.jwt_algorithm == 'HS256':
+        return HS256TokenCodec(TokenKeyRing.from_config(config))
+    if config.jwt_algorithm in ASYMMETRIC_JWT_ALGORITHMS:
+        return JWSTokenCodec(AsymmetricKeyRing.from_config(config))
+    raise ValueError(f"Unknown JWT algorithm: {config.jwt_algorithm}")
+
+class VerifiedTokenCache:
+    """Bounded LRU cache of verified access tokens, keyed by token digest.
+
+    Entries expire at the token's own ``exp`` claim, and each remembers the key
+    ring ``generation`` it was verified under: a lookup under a later generation
+    misses, so a cached token is never accepted after a key removal would have
+    made ``verify_access_token`` reject it.
+    """
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[bytes, Tuple[float, int, TokenPayload]]' = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str, generation: int = 0) -> Optional[TokenPayload]:
+        if self.max_size <= 0:
+            return None
+        key = token_digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, entry_generation, payload = entry
+                if expires_at > time.time() and entry_generation == generation:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, payload: TokenPayload, generation: int = 0) -> None:
+        if self.max_size <= 0:
+            return
+        key = token_digest(token)
+        with self._lock:
+            self._entries[key] = (payload.expires_at, generation, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+class TokenVerifier:
+    """Local access-token verification for services other than the issuer.
+
+    Keys come from a JWKS document: ``jwks_source`` is either a URL or a
+    callable returning the document (e.g. ``AuthService.get_jwks``). The key
+    set is reloaded every ``refresh_interval_seconds`` and when a token names
+    an unknown ``kid``, at most once per ``min_refresh_interval_seconds``. A
+    failed reload keeps the previous keys. Revocation watermarks live in the
+    issuing AuthService, so a locally verified token stays valid until ``exp``.
+    """
+    def __init__(self, jwks_source: Union[str, Callable[[], Dict[str, Any]]],
+                 refresh_interval_seconds: float = 300.0,
+                 min_refresh_interval_seconds: float = 30.0,
+                 cache_size: int = 10000,
+                 fetch_timeout_seconds: float = 5.0):
+        self.jwks_source = jwks_source
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.min_refresh_interval_seconds = min_refresh_interval_seconds
+        self.fetch_timeout_seconds = fetch_timeout_seconds
+        self.cache = VerifiedTokenCache(cache_size)
+        self._codec: Optional[JWSTokenCodec] = None
+        # Bumped when a reload drops or replaces a key; tags cache entries
+        self._generation = 0
+        self._refresh_lock = Lock()
+        self._loaded_at = 0.0
+        self._attempted_at = float('-inf')
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def _fetch(self) -> Dict[str, Any]:
+        if callable(self.jwks_source):
+            return self.jwks_source()
+        import urllib.request
+        with urllib.request.urlopen(self.jwks_source, timeout=self.fetch_timeout_seconds) as response:
+            return json.loads(response.read())
+
+    def refresh(self, force: bool = True, wait: bool = True) -> bool:
+        """Reload the key set; False if another caller holds the reload or it failed"""
+        if not self._refresh_lock.acquire(blocking=wait):
+            return False
+        try:
+            now = time.monotonic()
+            if not force and now - self._attempted_at < self.min_refresh_interval_seconds:
+                return False
+            self._attempted_at = now
+            try:
+                key_ring = AsymmetricKeyRing.from_jwks(self._fetch())
+            except Exception as e:
+                self.refresh_failures += 1
+                logger.warning("JWKS refresh from %s failed: %s", self.jwks_source, e)
+                return False
+            if self._codec is not None:
+                loaded = key_ring.jwks()['keys']
+                if any(jwk not in loaded for jwk in self._codec.key_ring.jwks()['keys']):
+                    self._generation += 1
+            self._codec = JWSTokenCodec(key_ring)
+            self._loaded_at = now
+            self.refreshes += 1
+            return True
+        finally:
+            self._refresh_lock.release()
+
+    def _current_codec(self) -> JWSTokenCodec:
+        codec = self._codec
+        if codec is None or time.monotonic() - self._loaded_at >= self.refresh_interval_seconds:
+            # Only the first caller waits for the initial load; once keys exist,
+            # one caller reloads while the rest keep using the current set
+            self.refresh(force=False, wait=codec is None)
+            codec = self._codec
+        if codec is None:
+            raise TokenError("Token signing keys are unavailable", 503)
+        return codec
+
+    def verify(self, token: str) -> TokenPayload:
+        generation = self._generation
+        payload = self.cache.get(token, generation)
+        if payload is not None:
+            return payload
+        codec = self._current_codec()
+        if isinstance(token, str) and codec.key_ring.verifier(token.partition('.')[0]) is None:
+            # Possibly signed with a key published after our last load
+            if self.refresh(force=False):
+                codec = self._codec
+        payload = codec.decode(token)
+        self.cache.put(token, payload, generation)
+        return payload
+
+    def stats(self) -> Dict[str, Any]:
+        codec = self._codec
+        return {
+            'keys': len(codec.key_ring.kids()) if codec is not None else 0,
+            'key_set_age_seconds': time.monotonic() - self._loaded_at if codec is not None else None,
+            'refreshes': self.refreshes,
+            'refresh_failures': self.refresh_failures,
+            'cache': self.cache.stats()
+        }
+
+class TokenRevocationList:
+    """Per-user "issued before" watermarks that revoke access tokens early.
+
+    An access token is revoked when its ``iat`` is older than its user's
+    watermark. Watermarks are dropped once every token they could reject has
+    expired anyway, so only users revoked within the last token lifetime take
+    up space and the verify path pays a single dict lookup. Claims have
+    one-second resolution: tokens issued in the same second as the revocation
+    stay valid.
+    """
+    def __init__(self, max_token_age_seconds: int):
+        self.max_token_age_seconds = max_token_age_seconds
+        self._watermarks: Dict[str, int] = {}
+        self._expiry: List[Tuple[int, str]] = []
+        self._lock = Lock()
+        self.revocations = 0
+
+    def revoke(self, user_id: str) -> int:
+        now = int(time.time())
+        with self._lock:
+            watermark = max(now, self._watermarks.get(user_id, 0))
+            self._watermarks[user_id] = watermark
+            heapq.heappush(self._expiry, (watermark + self.max_token_age_seconds, user_id))
+            self.revocations += 1
+            while self._expiry and self._expiry[0][0] <= now:
+                _, stale = heapq.heappop(self._expiry)
+                if self._watermarks.get(stale, now) + self.max_token_age_seconds <= now:
+                    del self._watermarks[stale]
+        return watermark
+
+    def is_revoked(self, user_id: str, issued_at: int) -> bool:
+        watermark = self._watermarks.get(user_id)
+        return watermark is not None and issued_at < watermark
+
+    def stats(self) -> Dict[str, Any]:
+        return {'size': len(self._watermarks), 'revocations': self.revocations}
+
+class RateLimiter:
+    """Token-bucket rate limiter keyed by string, with bounded memory.
+
+    Each key holds up to ``burst`` tokens, refilled at ``per_minute``. Buckets
+    live in an LRU map capped at ``max_keys``; evicting the least recently used
+    key only ever forgives an idle client.
+    """
+    def __init__(self, per_minute: float, burst: int, max_keys: int = 100000):
+        self.rate_per_second = per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: 'OrderedDict[str, List[float]]' = OrderedDict()
+        self._lock = Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def allow(self, key: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate_per_second)
+                bucket[1] = now
+            
+            if bucket[0] < 1:
+                self.rejected += 1
+                return False
+            bucket[0] -= 1
+            self.allowed += 1
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'keys': len(self._buckets),
+                'max_keys': self.max_keys,
+                'allowed': self.allowed,
+                'rejected': self.rejected
+            }
+
+class EmailService:
+    def __init__(self, config: AuthConfig, async_delivery: Optional[bool] = None):
+        self.config = config
+        if async_delivery is None:
+            async_delivery = config.email_async_delivery
+        self.delivery_queue = EmailDeliveryQueue(self) if async_delivery else None
+        self.metrics = AuthMetrics()
+
+    def build_message(self, to_email: str, subject: str, body: str) -> 'MIMEMultipart':
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+        msg = MIMEMultipart()
+        msg['From'] = self.config.from_email
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'html'))
+        return msg
+
+    def open_connection(self) -> 'smtplib.SMTP':
+        server = smtplib.SMTP(self.config.smtp_host, self.config.smtp_port,
+                              timeout=self.config.smtp_timeout_seconds)
+        try:
+            if self.config.smtp_use_tls:
+                server.starttls()
+            if self.config.smtp_username and self.config.smtp_password:
+                server.login(self.config.smtp_username, self.config.smtp_password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def send_timer(self):
+        return self.metrics.timer('stage_seconds', stage='email_send')
+
+    def send_email(self, to_email: str, subject: str, body: str) -> bool:
+        if self.delivery_queue is not None:
+            return self.delivery_queue.enqueue(to_email, subject, body)
+        return self.deliver_now(to_email, subject, body)
+
+    def deliver_now(self, to_email: str, subject: str, body: str) -> bool:
+        try:
+            msg = self.build_message(to_email, subject, body)
+            with self.send_timer():
+                with self.open_connection() as server:
+                    server.send_message(msg)
+            
+            logger.info("Email sent to %s", to_email, extra=_SAMPLED)
+            return True
+        except Exception as e:
+            logger.error("Failed to send email to %s: %s", to_email, e)
+            return False
+
+    def send_welcome_email(self, to_email: str) -> bool:
+        subject = "Welcome to AEP - Account Created"
+        body = f"""
+        <html>
+            <body>
+                <h2>Welcome to AEP!</h2>
+                <p>Your account has been successfully created.</p>
+                <p>Email: {to_email}</p>
+                <p>Thank you for joining us!</p>
+            </body>
+        </html>
+        """
+        return self.send_email(to_email, subject, body)
+
+    def send_password_reset_email(self, to_email: str, reset_token: str) -> bool:
+        subject = "AEP - Password Reset Request"
+        body = f"""
+        <html>
+            <body>
+                <h2>Password Reset Request</h2>
+                <p>You requested to reset your password. Use the token below:</p>
+                <p><strong>Reset Token:</strong> {reset_token}</p>
+                <p>This token will expire in 1 hour.</p>
+                <p>If you didn't request this, please ignore this email.</p>
+            </body>
+        </html>
+        """
+        return self.send_email(to_email, subject, body)
+
+    def send_password_changed_email(self, to_email: str) -> bool:
+        subject = "AEP - Password Changed Successfully"
+        body = f"""
+        <html>
+            <body>
+                <h2>Password Changed</h2>
+                <p>Your password has been successfully changed.</p>
+                <p>If you didn't make this change, please contact support immediately.</p>
+            </body>
+        </html>
+        """
+        return self.send_email(to_email, subject, body)
+
+@dataclass
+class _EmailJob:
+    to_email: str
+    subject: str
+    body: str
+    enqueued_at: float
+    error: Optional[str] = None
+
+class _SMTPSession:
+    """Kept-alive, authenticated SMTP connection owned by one delivery worker"""
+    def __init__(self, email_service: EmailService, on_connect):
+        self._email_service = email_service
+        self._on_connect = on_connect
+        self._server: Optional['smtplib.SMTP'] = None
+        self._messages_sent = 0
+        self._last_used = 0.0
+
+    def send(self, msg: 'MIMEMultipart') -> None:
+        config = self._email_service.config
+        if self._server is not None and (
+            self._messages_sent >= config.smtp_max_messages_per_connection
+            or time.monotonic() - self._last_used > config.smtp_idle_timeout_seconds
+        ):
+            self.close()
+        if self._server is None:
+            self._server = self._email_service.open_connection()
+            self._messages_sent = 0
+            self._on_connect()
+        try:
+            self._server.send_message(msg)
+        except Exception:
+            self.close()
+            raise
+        self._messages_sent += 1
+        self._last_used = time.monotonic()
+
+    def close(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+class EmailDeliveryQueue:
+    """In-process outbound email queue drained by background worker threads.
+
+    Each worker keeps its own SMTP session open and reuses it until it has sent
+    ``smtp_max_messages_per_connection`` messages or sat idle for
+    ``smtp_idle_timeout_seconds``. Transient failures are retried with
+    exponential backoff; permanent (5xx) rejections are not. Jobs that fail for
+    good land in a bounded dead-letter list. At interpreter exit, queues still
+    holding email get up to ``email_shutdown_timeout_seconds`` to drain.
+    """
+    def __init__(self, email_service: EmailService):
+        self.email_service = email_service
+        self.config = email_service.config
+        self._queue: 'queue.Queue[Optional[_EmailJob]]' = queue.Queue(self.config.email_queue_size)
+        self._dead_letters: 'deque[_EmailJob]' = deque(maxlen=max(1, self.config.email_dead_letter_size))
+        self._workers: List[Thread] = []
+        self._lock = Lock()
+        self._stats = {
+            'enqueued': 0,
+            'sent': 0,
+            'failed': 0,
+            'retried': 0,
+            'dropped': 0,
+            'connections_opened': 0
+        }
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def _ensure_workers(self) -> None:
+        if self._workers:
+            return
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(max(1, self.config.email_workers)):
+                worker = Thread(target=self._worker_loop, name=f'email-delivery-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            _email_queues.add(self)
+
+    def enqueue(self, to_email: str, subject: str, body: str) -> bool:
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait(_EmailJob(to_email, subject, body, time.monotonic()))
+        except queue.Full:
+            self._count('dropped')
+            logger.error("Email queue full, dropping email to %s", to_email)
+            return False
+        self._count('enqueued')
+        return True
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def _worker_loop(self) -> None:
+        session = _SMTPSession(self.email_service, lambda: self._count('connections_opened'))
+        while True:
+            try:
+                job = self._queue.get(timeout=self.config.smtp_idle_timeout_seconds)
+            except queue.Empty:
+                session.close()
+                continue
+            try:
+                if job is None:
+                    session.close()
+                    return
+                self._deliver(session, job)
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def _is_permanent(error: Exception) -> bool:
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return True
+        return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+    def _deliver(self, session: _SMTPSession, job: _EmailJob) -> None:
+        msg = self.email_service.build_message(job.to_email, job.subject, job.body)
+        attempt = 0
+        while True:
+            try:
+                with self.email_service.send_timer():
+                    session.send(msg)
+                break
+            except Exception as e:
+                if self._is_permanent(e) or attempt >= self.config.email_max_retries:
+                    job.error = str(e)
+                    with self._lock:
+                        self._stats['failed'] += 1
+                        self._dead_letters.append(job)
+                    logger.error("Failed to send email to %s: %s", job.to_email, e)
+                    return
+                self._count('retried')
+                time.sleep(self.config.email_retry_backoff_seconds * (2 ** attempt))
+                attempt += 1
+        
+        latency = time.monotonic() - job.enqueued_at
+        with self._lock:
+            self._stats['sent'] += 1
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+        logger.info("Email sent to %s", job.to_email, extra=_SAMPLED)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued email has been sent or given up on"""
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(
+                lambda: self._queue.unfinished_tasks == 0, timeout
+            )
+
+    def dead_letters(self) -> List[_EmailJob]:
+        """Emails given up on, oldest first, with the last delivery error"""
+        with self._lock:
+            return list(self._dead_letters)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        self.flush(timeout)
+        _email_queues.discard(self)
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for _ in workers:
+            self._queue.put(None)
+        for worker in workers:
+            worker.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queue_depth'] = self._queue.qsize()
+            stats['avg_latency_seconds'] = self._latency_total / stats['sent'] if stats['sent'] else 0.0
+            stats['max_latency_seconds'] = self._latency_max
+            stats['workers'] = len(self._workers)
+            stats['dead_letters'] = len(self._dead_letters)
+            return stats
+
+# Queues with running workers; drained at exit so queued emails are not lost
+_email_queues: 'weakref.WeakSet[EmailDeliveryQueue]' = weakref.WeakSet()
+
+def _drain_email_queues() -> None:
+    for delivery_queue in list(_email_queues):
+        if not delivery_queue.flush(delivery_queue.config.email_shutdown_timeout_seconds):
+            logger.error(
+                "Exiting with %d undelivered emails still queued", delivery_queue._queue.unfinished_tasks
+            )
+
+atexit.register(_drain_email_queues)
+
+def iter_user_rows(source: Union[str, IO[str]], fmt: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Stream user rows from a CSV (with a header) or JSONL file.
+
+    Rows carry ``email`` and either ``password`` or a pre-hashed bcrypt
+    ``password_hash``. Unparseable JSONL lines are yielded as ``{'_error': ...}``
+    so the importer can report them without aborting.
+    """
+    if isinstance(source, str):
+        fmt = fmt or ('jsonl' if source.endswith(('.jsonl', '.ndjson')) else 'csv')
+        with open(source, newline='', encoding='utf-8') as f:
+            yield from iter_user_rows(f, fmt)
+        return
+    
+    if fmt == 'jsonl':
+        for line in source:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield {'_error': f"Malformed JSON: {e}"}
+                continue
+            yield row if isinstance(row, dict) else {'_error': "Row is not a JSON object"}
+    else:
+        yield from csv.DictReader(source)
+
+@dataclass
+class ImportRowError:
+    row: int
+    email: str
+    message: str
+
+@dataclass
+class ImportReport:
+    total: int = 0
+    imported: int = 0
+    failed: int = 0
+    elapsed_seconds: float = 0.0
+    errors: List[ImportRowError] = field(default_factory=list)
+    errors_truncated: bool = False
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.total / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+def _outcome(error: AuthError) -> str:
+    if isinstance(error, ServiceOverloadedError):
+        return 'overloaded'
+    if isinstance(error, RateLimitError):
+        return 'rate_limited'
+    if isinstance(error, TokenError):
+        return 'token_error'
+    if isinstance(error, ValidationError):
+        return 'validation_error'
+    if isinstance(error, AuthenticationError):
+        return 'invalid_credentials' if error.code == 401 else 'forbidden'
+    return 'error'
+
+def _instrumented(func):
+    """Record duration and outcome of a public service method in self.metrics"""
+    method = func.__name__
+    
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if not metrics.enabled:
+                return await func(self, *args, **kwargs)
+            started = time.perf_counter()
+            try:
+                result = await func(self, *args, **kwargs)
+            except AuthError as e:
+                metrics.increment('outcomes_total', method=method, outcome=_outcome(e))
+                raise
+            finally:
+                metrics.observe('method_seconds', time.perf_counter() - started, method=method)
+            metrics.increment('outcomes_total', method=method, outcome='success')
+            return result
+        return async_wrapper
+    
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        metrics = self.metrics
+        if not metrics.enabled:
+            return func(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            result = func(self, *args, **kwargs)
+        except AuthError as e:
+            metrics.increment('outcomes_total', method=method, outcome=_outcome(e))
+            raise
+        finally:
+            metrics.observe('method_seconds', time.perf_counter() - started, method=method)
+        metrics.increment('outcomes_total', method=method, outcome='success')
+        return result
+    return wrapper
+
+class _SweepScheduler:
+    """One daemon thread that runs the periodic token sweep for every AuthService.
+
+    Services are held by weak reference, so a discarded service is simply
+    dropped from the schedule. The thread starts with the first registration,
+    and again in a forked child, which inherits the schedule but not the thread.
+    """
+    def __init__(self):
+        self._wakeup = threading.Condition(Lock())
+        self._heap: List[Tuple[float, int, 'weakref.ref[AuthService]', float]] = []
+        self._order = itertools.count()
+        self._thread: Optional[Thread] = None
+
+    def register(self, service: 'AuthService', interval: float) -> None:
+        with self._wakeup:
+            heapq.heappush(self._heap, (time.monotonic() + interval, next(self._order), weakref.ref(service), interval))
+            if self._thread is None:
+                self._start()
+            self._wakeup.notify()
+
+    def _start(self) -> None:
+        self._thread = Thread(target=self._run, name='auth-token-sweep', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self) -> None:
+        # The parent's thread may have held the lock mid-fork; start clean
+        self._wakeup = threading.Condition(Lock())
+        self._thread = None
+        if self._heap:
+            self._start()
 
-    def send_password_reset_email(self, to_email: str, reset_token: str) -> bool:
-        subject = "AEP - Password Reset Request"
-        body = f"""
-        <html>
-            <body>
-                <h2>Password Reset Request</h2>
-                <p>You requested to reset your password. Use the token below:</p>
-                <p><strong>Reset Token:</strong> {reset_token}</p>
-                <p>This token will expire in 1 hour.</p>
-                <p>If you didn't request this, please ignore this email.</p>
-            </body>
-        </html>
-        """
-        return self.send_email(to_email, subject, body)
+    def scheduled(self) -> int:
+        with self._wakeup:
+            return sum(1 for entry in self._heap if entry[2]() is not None)
 
-    def send_password_changed_email(self, to_email: str) -> bool:
-        subject = "AEP - Password Changed Successfully"
-        body = f"""
-        <html>
-            <body>
-                <h2>Password Changed</h2>
-                <p>Your password has been successfully changed.</p>
-                <p>If you didn't make this change, please contact support immediately.</p>
-            </body>
-        </html>
-        """
-        return self.send_email(to_email, subject, body)
+    def _run(self) -> None:
+        while True:
+            with self._wakeup:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._wakeup.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, order, ref, interval = heapq.heappop(self._heap)
+            service = ref()
+            if service is None:
+                continue
+            try:
+                service._sweep_expired_tokens()
+            except Exception:
+                logger.exception("Token sweep failed")
+            service = None  # Don't keep the service alive while waiting
+            with self._wakeup:
+                heapq.heappush(self._heap, (time.monotonic() + interval, order, ref, interval))
+
+_sweep_scheduler = _SweepScheduler()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_sweep_scheduler._after_fork)
 
 class AuthService:
-    def __init__(self):
-        self.config = AuthConfig()
-        self.user_repo = UserRepository()
-        self.email_service = EmailService(self.config)
+    def __init__(self, config: Optional[AuthConfig] = None,
+                 user_repo: Optional[UserStore] = None,
+                 email_service: Optional[EmailService] = None,
+                 hasher: Optional[HashingExecutor] = None,
+                 metrics: Optional[AuthMetrics] = None):
+        self.config = config or AuthConfig()
+        if self.config.log_async:
+            enable_async_logging(self.config.log_queue_size, self.config.log_success_sample_rate)
+        self.metrics = metrics or AuthMetrics(self.config.metrics_enabled)
+        self.user_repo = user_repo or create_user_store(self.config)
+        self.email_service = email_service or EmailService(self.config)
+        if self.metrics.enabled:
+            self.user_repo.metrics = self.metrics
+            self.email_service.metrics = self.metrics
+            self.user_repo = InstrumentedUserStore(self.user_repo, self.metrics)
+        self.hasher = hasher or HashingExecutor(
+            self.config.hash_workers,
+            self.config.hash_queue_size,
+            self.config.hash_executor,
+            self.config.bcrypt_rounds
+        )
+        self.token_codec = create_token_codec(self.config)
+        self.token_cache = VerifiedTokenCache(self.config.token_cache_size)
+        self.revocations = TokenRevocationList(self.config.jwt_expiry_minutes * 60)
+        self.email_rate_limiter: Optional[RateLimiter] = None
+        self.client_rate_limiter: Optional[RateLimiter] = None
+        if self.config.login_rate_email_per_minute > 0:
+            self.email_rate_limiter = RateLimiter(
+                self.config.login_rate_email_per_minute,
+                self.config.login_rate_email_burst,
+                self.config.login_rate_max_keys
+            )
+        if self.config.login_rate_client_per_minute > 0:
+            self.client_rate_limiter = RateLimiter(
+                self.config.login_rate_client_per_minute,
+                self.config.login_rate_client_burst,
+                self.config.login_rate_max_keys
+            )
+        
+        self.bcrypt_calibration: Optional[Dict[str, Any]] = None
+        self.rehash_count = 0
+        self._rehash_lock = Lock()
+        if self.config.bcrypt_target_ms > 0:
+            self.bcrypt_calibration = calibrate_bcrypt_rounds(
+                self.config.bcrypt_target_ms,
+                self.config.bcrypt_min_rounds,
+                self.config.bcrypt_max_rounds
+            )
+            self.config.bcrypt_rounds = self.hasher.rounds = self.bcrypt_calibration['rounds']
+            logger.info(
+                "bcrypt calibrated to cost %d (%.1fms, target %.0fms)",
+                self.hasher.rounds, self.bcrypt_calibration['measured_ms'], self.config.bcrypt_target_ms
+            )
         
-        # Cleanup expired tokens periodically
-        import threading
-        self.cleanup_thread = threading.Thread(target=self._cleanup_loop, daemon=True)
-        self.cleanup_thread.start()
+        # Expired tokens are swept by the shared scheduler thread
+        if self.config.token_sweep_interval_seconds > 0:
+            _sweep_scheduler.register(self, self.config.token_sweep_interval_seconds)
 
-    def _cleanup_loop(self):
-        while True:
-            time.sleep(3600)  # Cleanup every hour
-            self.user_repo.cleanup_expired_tokens()
+    def _sweep_expired_tokens(self) -> None:
+        stats = self.user_repo.cleanup_expired_tokens(self.config.token_sweep_batch_size)
+        if stats.evicted_reset_tokens or stats.evicted_refresh_tokens:
+            logger.debug(
+                "Token sweep evicted %d reset and %d refresh tokens, max lock hold %.2fms",
+                stats.evicted_reset_tokens, stats.evicted_refresh_tokens,
+                stats.max_lock_hold_seconds * 1000
+            )
 
     def validate_email(self, email: str) -> bool:
         pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -308,11 +3800,12 @@ class AuthService:
             return PasswordStrength.WEAK
 
     def hash_password(self, password: str) -> str:
-        salt = bcrypt.gensalt()
-        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+        with self.metrics.timer('stage_seconds', stage='hash'):
+            return self.hasher.hash_password(password)
 
     def verify_password(self, password: str, password_hash: str) -> bool:
-        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+        with self.metrics.timer('stage_seconds', stage='verify_password'):
+            return self.hasher.verify_password(password, password_hash)
 
     def generate_reset_token(self) -> str:
         return secrets.token_urlsafe(32)
@@ -321,152 +3814,196 @@ class AuthService:
         return secrets.token_urlsafe(64)
 
     def create_access_token(self, user_id: str, email: str) -> str:
-        expiry = datetime.now(timezone.utc) + timedelta(minutes=self.config.jwt_expiry_minutes)
-        payload = {
-            'sub': user_id,
-            'email': email,
-            'exp': expiry,
-            'iat': datetime.now(timezone.utc)
-        }
-        return jwt.encode(payload, self.config.jwt_secret, algorithm='HS256')
+        issued_at = int(time.time())
+        with self.metrics.timer('stage_seconds', stage='jwt_encode'):
+            return self.token_codec.encode(
+                user_id, email, issued_at + self.config.jwt_expiry_minutes * 60, issued_at
+            )
 
     def verify_access_token(self, token: str) -> TokenPayload:
-        try:
-            payload = jwt.decode(token, self.config.jwt_secret, algorithms=['HS256'])
-            return TokenPayload(
-                user_id=payload['sub'],
-                email=payload['email'],
-                exp=datetime.fromtimestamp(payload['exp'], timezone.utc),
-                iat=datetime.fromtimestamp(payload['iat'], timezone.utc)
-            )
-        except jwt.ExpiredSignatureError:
-            raise TokenError("Token has expired", 401)
-        except jwt.InvalidTokenError:
-            raise TokenError("Invalid token", 401)
+        with self.metrics.timer('stage_seconds', stage='jwt_decode'):
+            payload = self.token_codec.decode(token)
+        return self._check_not_revoked(payload)
 
-    def register_user(self, email: str, password: str) -> Dict[str, Any]:
-        if not self.validate_email(email):
-            raise ValidationError("Invalid email format")
-        
+    def _check_not_revoked(self, payload: TokenPayload) -> TokenPayload:
+        if self.revocations.is_revoked(payload.user_id, payload.issued_at):
+            raise TokenError("Token has been revoked", 401)
+        return payload
+
+    def _revoke_sessions(self, user_id: str) -> int:
+        """End every session of a user: refresh tokens and already-issued access tokens"""
+        self.revocations.revoke(user_id)
+        return self.user_repo.revoke_user_sessions(user_id)
+
+    def _validate_new_password(self, password: str, weak_message: str) -> None:
         password_strength = self.validate_password_strength(password)
         if password_strength == PasswordStrength.WEAK:
-            raise ValidationError("Password is too weak. Include uppercase, lowercase, numbers, and special characters")
-        
-        password_hash = self.hash_password(password)
-        user = self.user_repo.create_user(email, password_hash)
-        
-        # Send welcome email
-        self.email_service.send_welcome_email(email)
+            raise ValidationError(weak_message)
+
+    def _validate_registration(self, email: str, password: str) -> None:
+        if not self.validate_email(email):
+            raise ValidationError("Invalid email format")
         
-        logger.info(f"User registered: {email}")
-        return {
-            'user_id': user.id,
-            'email': user.email,
-            'is_active': user.is_active,
-            'is_verified': user.is_verified
-        }
+        self._validate_new_password(
+            password,
+            "Password is too weak. Include uppercase, lowercase, numbers, and special characters"
+        )
 
-    def login_user(self, email: str, password: str) -> Dict[str, Any]:
-        user = self.user_repo.find_by_email(email)
+    def _check_rate_limit(self, email: str, client_id: Optional[str]) -> None:
+        # Runs before any lookup or hashing so rejected attempts cost almost nothing
+        if client_id is not None and self.client_rate_limiter is not None:
+            if not self.client_rate_limiter.allow(client_id):
+                raise RateLimitError("Too many login attempts, please retry later", 429)
+        if self.email_rate_limiter is not None:
+            if not self.email_rate_limiter.allow(email.lower()):
+                raise RateLimitError("Too many login attempts, please retry later", 429)
+
+    def _check_login_allowed(self, user: Optional[User]) -> User:
         if not user:
             raise AuthenticationError("Invalid credentials", 401)
         
-        # Check if account is locked
+        # Check if account is locked; an expired lockout is reset by record_login_attempt
         if user.failed_login_attempts >= self.config.max_failed_attempts:
             if user.last_failed_login and (
-                datetime.now(timezone.utc) - user.last_failed_login
-            ) < timedelta(minutes=self.config.lockout_minutes):
+                time.time() - user.last_failed_login
+            ) < self.config.lockout_minutes * 60:
+                self.metrics.increment('events_total', event='login_while_locked')
                 raise AuthenticationError("Account temporarily locked due to too many failed attempts", 403)
-            else:
-                # Reset failed attempts after lockout period
-                user.failed_login_attempts = 0
-                user.last_failed_login = None
         
         if not user.is_active:
             raise AuthenticationError("Account is deactivated", 403)
-        
-        if not self.verify_password(password, user.password_hash):
-            user.failed_login_attempts += 1
-            user.last_failed_login = datetime.now(timezone.utc)
-            self.user_repo.update_user(user)
-            
-            if user.failed_login_attempts >= self.config.max_failed_attempts:
-                raise AuthenticationError("Account locked due to too many failed attempts", 403)
-            else:
-                raise AuthenticationError("Invalid credentials", 401)
-        
-        # Reset failed attempts on successful login
-        user.failed_login_attempts = 0
-        user.last_failed_login = None
-        user.last_login = datetime.now(timezone.utc)
-        self.user_repo.update_user(user)
-        
-        access_token = self.create_access_token(user.id, user.email)
+        return user
+
+    def _record_login(self, user: User, success: bool, password_hash: Optional[str] = None) -> User:
+        return self.user_repo.record_login_attempt(
+            user.id, success, self.config.max_failed_attempts, self.config.lockout_minutes * 60, password_hash
+        )
+
+    def _failed_login_error(self, user: User) -> AuthenticationError:
+        if user.failed_login_attempts >= self.config.max_failed_attempts:
+            self.metrics.increment('events_total', event='account_locked')
+            return AuthenticationError("Account locked due to too many failed attempts", 403)
+        return AuthenticationError("Invalid credentials", 401)
+
+    def _needs_rehash(self, password_hash: str) -> bool:
+        return bcrypt_cost(password_hash) != self.hasher.rounds
+
+    def _count_rehash(self) -> None:
+        with self._rehash_lock:
+            self.rehash_count += 1
+        self.metrics.increment('events_total', event='password_rehashed')
+
+    @staticmethod
+    def _apply_password_change(user: User, password_hash: str) -> User:
+        # Returns a copy: stored users must only change through the repository,
+        # which keeps pre-images for snapshot exports
+        return replace(user, password_hash=password_hash, failed_login_attempts=0, last_failed_login=None)
+
+    def _new_refresh_token(self) -> Tuple[str, datetime]:
         refresh_token = self.generate_refresh_token()
         refresh_expiry = datetime.now(timezone.utc) + timedelta(days=self.config.refresh_token_expiry_days)
-        
-        self.user_repo.store_refresh_token(user.id, refresh_token, refresh_expiry)
-        
-        logger.info(f"User logged in: {email}")
+        return refresh_token, refresh_expiry
+
+    def _new_reset_token(self) -> Tuple[str, datetime]:
+        return self.generate_reset_token(), datetime.now(timezone.utc) + timedelta(hours=1)
+
+    def _registration_response(self, user: User) -> Dict[str, Any]:
+        return {
+            'user_id': user.id,
+            'email': user.email,
+            'is_active': user.is_active,
+            'is_verified': user.is_verified
+        }
+
+    def _token_response(self, access_token: str, refresh_token: str) -> Dict[str, Any]:
         return {
             'access_token': access_token,
             'refresh_token': refresh_token,
             'token_type': 'bearer',
-            'expires_in': self.config.jwt_expiry_minutes * 60,
-            'user': {
-                'id': user.id,
-                'email': user.email,
-                'is_verified': user.is_verified
-            }
+            'expires_in': self.config.jwt_expiry_minutes * 60
         }
 
-    def refresh_token(self, refresh_token: str) -> Dict[str, Any]:
-        user_id = self.user_repo.get_refresh_token_user(refresh_token)
-        if not user_id:
-            raise TokenError("Invalid refresh token", 401)
+    def _login_response(self, user: User, access_token: str, refresh_token: str) -> Dict[str, Any]:
+        response = self._token_response(access_token, refresh_token)
+        response['user'] = {
+            'id': user.id,
+            'email': user.email,
+            'is_verified': user.is_verified
+        }
+        return response
+
+    @_instrumented
+    def register_user(self, email: str, password: str) -> Dict[str, Any]:
+        self._validate_registration(email, password)
         
-        user = self.user_repo.find_by_id(user_id)
-        if not user or not user.is_active:
-            raise AuthenticationError("User not found or inactive", 401)
+        password_hash = self.hash_password(password)
+        user = self.user_repo.create_user(email, password_hash)
         
-        # Remove used refresh token
-        self.user_repo.remove_refresh_token(refresh_token)
+        # Send welcome email
+        self.email_service.send_welcome_email(email)
+        
+        logger.info("User registered: %s", email)
+        return self._registration_response(user)
+
+    @_instrumented
+    def login_user(self, email: str, password: str, client_id: Optional[str] = None) -> Dict[str, Any]:
+        self._check_rate_limit(email, client_id)
+        user = self._check_login_allowed(self.user_repo.find_by_email(email))
+        
+        if not self.verify_password(password, user.password_hash):
+            raise self._failed_login_error(self._record_login(user, False))
+        
+        new_hash = None
+        if self._needs_rehash(user.password_hash):
+            try:
+                new_hash = self.hash_password(password)
+            except ServiceOverloadedError:
+                pass  # Keep the old hash; the next login will try again
+        user = self._record_login(user, True, new_hash)
+        if new_hash is not None:
+            self._count_rehash()
         
-        # Generate new tokens
         access_token = self.create_access_token(user.id, user.email)
-        new_refresh_token = self.generate_refresh_token()
-        refresh_expiry = datetime.now(timezone.utc) + timedelta(days=self.config.refresh_token_expiry_days)
+        refresh_token, refresh_expiry = self._new_refresh_token()
         
-        self.user_repo.store_refresh_token(user.id, new_refresh_token, refresh_expiry)
+        self.user_repo.store_refresh_token(user.id, refresh_token, refresh_expiry)
         
-        logger.info(f"Token refreshed for user: {user.email}")
-        return {
-            'access_token': access_token,
-            'refresh_token': new_refresh_token,
-            'token_type': 'bearer',
-            'expires_in': self.config.jwt_expiry_minutes * 60
-        }
+        logger.info("User logged in: %s", email, extra=_SAMPLED)
+        return self._login_response(user, access_token, refresh_token)
+
+    @_instrumented
+    def refresh_token(self, refresh_token: str) -> Dict[str, Any]:
+        # Validate, consume and replace in one repository step: a token can
+        # only be redeemed once, even by concurrent requests
+        new_refresh_token, refresh_expiry = self._new_refresh_token()
+        user = self.user_repo.rotate_refresh_token(refresh_token, new_refresh_token, refresh_expiry)
+        access_token = self.create_access_token(user.id, user.email)
+        
+        logger.info("Token refreshed for user: %s", user.email, extra=_SAMPLED)
+        return self._token_response(access_token, new_refresh_token)
 
+    @_instrumented
     def logout_user(self, refresh_token: str) -> None:
         self.user_repo.remove_refresh_token(refresh_token)
-        logger.info("User logged out")
+        logger.info("User logged out", extra=_SAMPLED)
 
+    @_instrumented
     def request_password_reset(self, email: str) -> bool:
         user = self.user_repo.find_by_email(email)
         if not user or not user.is_active:
             # Don't reveal whether email exists for security
-            logger.warning(f"Password reset requested for non-existent email: {email}")
+            logger.warning("Password reset requested for non-existent email: %s", email)
             return True
         
-        reset_token = self.generate_reset_token()
-        expiry = datetime.now(timezone.utc) + timedelta(hours=1)
+        reset_token, expiry = self._new_reset_token()
         
         self.user_repo.store_reset_token(email, reset_token, expiry)
         self.email_service.send_password_reset_email(email, reset_token)
         
-        logger.info(f"Password reset requested for: {email}")
+        logger.info("Password reset requested for: %s", email)
         return True
 
+    @_instrumented
     def reset_password(self, reset_token: str, new_password: str) -> bool:
         email = self.user_repo.get_reset_token_email(reset_token)
         if not email:
@@ -476,22 +4013,20 @@ class AuthService:
         if not user or not user.is_active:
             raise AuthenticationError("User not found or inactive", 401)
         
-        password_strength = self.validate_password_strength(new_password)
-        if password_strength == PasswordStrength.WEAK:
-            raise ValidationError("Password is too weak")
+        self._validate_new_password(new_password, "Password is too weak")
         
         password_hash = self.hash_password(new_password)
-        user.password_hash = password_hash
-        user.failed_login_attempts = 0
-        user.last_failed_login = None
+        user = self._apply_password_change(user, password_hash)
         
         self.user_repo.update_user(user)
         self.user_repo.remove_reset_token(reset_token)
+        self._revoke_sessions(user.id)
         self.email_service.send_password_changed_email(email)
         
-        logger.info(f"Password reset for: {email}")
+        logger.info("Password reset for: %s", email)
         return True
 
+    @_instrumented
     def change_password(self, user_id: str, current_password: str, new_password: str) -> bool:
         user = self.user_repo.find_by_id(user_id)
         if not user or not user.is_active:
@@ -500,24 +4035,160 @@ class AuthService:
         if not self.verify_password(current_password, user.password_hash):
             raise AuthenticationError("Current password is incorrect", 401)
         
-        password_strength = self.validate_password_strength(new_password)
-        if password_strength == PasswordStrength.WEAK:
-            raise ValidationError("New password is too weak")
+        self._validate_new_password(new_password, "New password is too weak")
         
         password_hash = self.hash_password(new_password)
-        user.password_hash = password_hash
-        user.failed_login_attempts = 0
-        user.last_failed_login = None
+        user = self._apply_password_change(user, password_hash)
         
         self.user_repo.update_user(user)
+        self._revoke_sessions(user.id)
         self.email_service.send_password_changed_email(user.email)
         
-        logger.info(f"Password changed for user: {user.email}")
+        logger.info("Password changed for user: %s", user.email)
         return True
 
+    def import_users(self, rows: Iterable[Dict[str, Any]], batch_size: int = 1000,
+                     workers: Optional[int] = None, send_welcome_emails: bool = False,
+                     progress: Optional[Callable[[ImportReport], None]] = None,
+                     max_errors: int = 10000) -> ImportReport:
+        """Bulk-create users from a stream of rows (see iter_user_rows).
+
+        Rows are validated and hashed in parallel on a dedicated hashing pool,
+        so live logins keep their own capacity, then inserted one batch per
+        repository lock acquisition. Bad rows are recorded in the report and
+        never abort the run. ``progress`` is called with the report after
+        every batch.
+        """
+        report = ImportReport()
+        started = time.perf_counter()
+        pool = HashingExecutor(
+            workers or self.config.hash_workers,
+            batch_size,
+            self.config.hash_executor,
+            self.hasher.rounds
+        )
+        
+        def fail(row_number: int, email: str, message: str) -> None:
+            report.failed += 1
+            if len(report.errors) < max_errors:
+                report.errors.append(ImportRowError(row_number, email, message))
+            else:
+                report.errors_truncated = True
+        
+        def run_batch(batch: List[Tuple[int, str, Any]]) -> None:
+            pending: List[Tuple[int, str, str]] = []
+            for row_number, email, password_hash in batch:
+                if isinstance(password_hash, Future):
+                    try:
+                        password_hash = password_hash.result().decode('utf-8')
+                    except Exception as e:
+                        fail(row_number, email, f"Hashing failed: {e}")
+                        continue
+                pending.append((row_number, email, password_hash))
+            
+            try:
+                users = self.user_repo.create_users_batch([(email, h) for _, email, h in pending])
+            except Exception as e:
+                logger.error("User import batch failed: %s", e)
+                users = []
+                for row_number, email, _ in pending:
+                    fail(row_number, email, f"Insert failed: {e}")
+            for (row_number, email, _), user in zip(pending, users):
+                if user is None:
+                    fail(row_number, email, "Email already registered")
+                    continue
+                report.imported += 1
+                if send_welcome_emails:
+                    self.email_service.send_welcome_email(user.email)
+            
+            report.elapsed_seconds = time.perf_counter() - started
+            if progress is not None:
+                progress(report)
+        
+        try:
+            batch: List[Tuple[int, str, Any]] = []
+            for row_number, row in enumerate(rows, start=1):
+                report.total += 1
+                email = ''
+                try:
+                    if '_error' in row:
+                        raise ValidationError(row['_error'])
+                    email = self._import_field(row, 'email').strip()
+                    if not self.validate_email(email):
+                        raise ValidationError("Invalid email format")
+                    if row.get('password_hash'):
+                        password_hash = self._import_field(row, 'password_hash')
+                        if not password_hash.startswith('$2') or bcrypt_cost(password_hash) is None:
+                            raise ValidationError("password_hash is not a bcrypt hash")
+                    elif row.get('password'):
+                        password = self._import_field(row, 'password')
+                        self._validate_new_password(password, "Password is too weak")
+                        password_hash = pool.submit_hash(password)
+                    else:
+                        raise ValidationError("Row needs a password or password_hash")
+                except ValidationError as e:
+                    fail(row_number, email, e.message)
+                    continue
+                except Exception as e:
+                    # Whatever is wrong with one row must not end the import
+                    fail(row_number, email, f"Unexpected error: {e!r}")
+                    continue
+                
+                batch.append((row_number, email, password_hash))
+                if len(batch) >= batch_size:
+                    run_batch(batch)
+                    batch = []
+            if batch:
+                run_batch(batch)
+        finally:
+            pool.shutdown(wait=False)
+        
+        report.elapsed_seconds = time.perf_counter() - started
+        logger.info(
+            "User import finished: %d imported, %d failed of %d rows (%.0f rows/s)",
+            report.imported, report.failed, report.total, report.rows_per_second
+        )
+        return report
+
+    @staticmethod
+    def _import_field(row: Dict[str, Any], name: str) -> str:
+        value = row.get(name) or ''
+        if not isinstance(value, str):
+            raise ValidationError(f"{name} must be a string")
+        return value
+
+    @_instrumented
     def verify_token(self, token: str) -> TokenPayload:
-        return self.verify_access_token(token)
+        # Read before verifying, so a key removed mid-check still invalidates the entry
+        generation = self.token_codec.key_ring.generation
+        payload = self.token_cache.get(token, generation)
+        if payload is None:
+            payload = self.verify_access_token(token)
+            self.token_cache.put(token, payload, generation)
+            return payload
+        # Cached before a revocation is still revoked
+        return self._check_not_revoked(payload)
+
+    @_instrumented
+    def logout_all_sessions(self, user_id: str) -> int:
+        """Revoke every refresh and access token of a user; returns the refresh tokens removed"""
+        revoked = self._revoke_sessions(user_id)
+        logger.info("Revoked %s sessions for user: %s", revoked, user_id)
+        return revoked
+
+    @_instrumented
+    def deactivate_user(self, user_id: str) -> None:
+        user = self.user_repo.find_by_id(user_id)
+        if not user:
+            raise AuthenticationError("User not found or inactive", 401)
+        
+        user = replace(user, is_active=False)
+        self.user_repo.update_user(user)
+        self._revoke_sessions(user_id)
+        
+        logger.info("User deactivated: %s", user.email)
 
+    @_instrumented
     def get_user_profile(self, user_id: str) -> Dict[str, Any]:
         user = self.user_repo.find_by_id(user_id)
         if not user or not user.is_active:
@@ -527,33 +4198,413 @@ class AuthService:
             'id': user.id,
             'email': user.email,
             'is_verified': user.is_verified,
-            'created_at': user.created_at.isoformat(),
-            'last_login': user.last_login.isoformat() if user.last_login else None
+            'created_at': _isoformat(user.created_at),
+            'last_login': _isoformat(user.last_login) if user.last_login else None
         }
 
-def auth_required(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        auth_header = kwargs.get('authorization') or args[0].get('authorization', '') if args else ''
+    def _component_stats(self) -> Dict[str, Dict[str, Any]]:
+        components = {
+            'token_cache': self.token_cache.stats(),
+            'revocations': self.revocations.stats(),
+            'hasher': self.hasher.stats(),
+            'bcrypt': {
+                'rounds': self.hasher.rounds,
+                'target_ms': self.config.bcrypt_target_ms,
+                'calibrated_ms': self.bcrypt_calibration['measured_ms'] if self.bcrypt_calibration else 0.0,
+                'rehashes': self.rehash_count
+            }
+        }
+        if self.email_rate_limiter is not None:
+            components['email_rate_limiter'] = self.email_rate_limiter.stats()
+        if self.client_rate_limiter is not None:
+            components['client_rate_limiter'] = self.client_rate_limiter.stats()
+        if self.email_service.delivery_queue is not None:
+            components['email_queue'] = self.email_service.delivery_queue.stats()
+        if _log_pipeline is not None:
+            components['log_queue'] = _log_pipeline.stats()
+        last_sweep = getattr(self.user_repo, 'last_sweep', None)
+        if last_sweep is not None:
+            components['token_sweep'] = asdict(last_sweep)
+        return components
+
+    def get_jwks(self) -> Dict[str, Any]:
+        """Public access-token keys as a JWKS document (no keys in HS256 mode)"""
+        if isinstance(self.token_codec, JWSTokenCodec):
+            return self.token_codec.key_ring.jwks()
+        return {'keys': []}
+
+    EXPORT_CSV_COLUMNS = (
+        'type', 'user_id', 'email', 'is_active', 'is_verified', 'created_at', 'last_login',
+        'failed_login_attempts', 'last_failed_login', 'session_id', 'expires_at'
+    )
+
+    def export_snapshot(self, fmt: str = 'jsonl', include_sessions: bool = True,
+                        batch_size: Optional[int] = None) -> Iterator[str]:
+        """Stream a consistent audit export of users and refresh sessions.
+
+        Yields one text chunk per repository batch, as JSON lines or CSV with a
+        header row. Password hashes are never exported; sessions are identified
+        by their token digest.
+        """
+        if fmt not in ('jsonl', 'csv'):
+            raise ValueError(f"Unknown export format: {fmt}")
+        if fmt == 'csv':
+            yield self._export_csv_chunk([self.EXPORT_CSV_COLUMNS])
+
+        exported = 0
+        for batch in self.user_repo.iter_snapshot(batch_size or self.config.export_batch_size):
+            records = [self._export_user_record(user) for user in batch.users]
+            if include_sessions:
+                records.extend(
+                    {'type': 'session', 'user_id': user_id, 'session_id': digest.hex(),
+                     'expires_at': _isoformat(expires_at)}
+                    for user_id, digest, expires_at in batch.sessions
+                )
+            exported += len(records)
+            if fmt == 'jsonl':
+                yield ''.join(json.dumps(record) + '\n' for record in records)
+            else:
+                yield self._export_csv_chunk(
+                    [record.get(column) for column in self.EXPORT_CSV_COLUMNS] for record in records
+                )
+        logger.info("Exported %s records", exported)
+
+    @staticmethod
+    def _export_user_record(user: User) -> Dict[str, Any]:
+        return {
+            'type': 'user',
+            'user_id': user.id,
+            'email': user.email,
+            'is_active': user.is_active,
+            'is_verified': user.is_verified,
+            'created_at': _isoformat(user.created_at),
+            'last_login': _isoformat(user.last_login) if user.last_login else None,
+            'failed_login_attempts': user.failed_login_attempts,
+            'last_failed_login': _isoformat(user.last_failed_login) if user.last_failed_login else None
+        }
+
+    @staticmethod
+    def _export_csv_chunk(rows: Iterable[Iterable[Any]]) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Snapshot of latency histograms, outcome counters and component stats"""
+        snapshot = self.metrics.snapshot()
+        snapshot['components'] = self._component_stats()
+        return snapshot
+
+    def export_prometheus(self) -> str:
+        return self.metrics.to_prometheus(self._component_stats())
+
+class AsyncUserRepository:
+    """Coroutine interface over a UserStore.
+
+    With no executor, calls run inline on the loop; only do that for the
+    in-memory UserRepository, whose operations are short critical sections.
+    """
+    def __init__(self, repo: UserStore, executor=None):
+        self._repo = repo
+        self._executor = executor
+
+    async def _call(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def create_user(self, email: str, password_hash: str) -> User:
+        return await self._call(self._repo.create_user, email, password_hash)
+
+    async def find_by_email(self, email: str) -> Optional[User]:
+        return await self._call(self._repo.find_by_email, email)
+
+    async def find_by_id(self, user_id: str) -> Optional[User]:
+        return await self._call(self._repo.find_by_id, user_id)
+
+    async def update_user(self, user: User) -> None:
+        await self._call(self._repo.update_user, user)
+
+    async def store_reset_token(self, email: str, token: str, expiry: datetime) -> None:
+        await self._call(self._repo.store_reset_token, email, token, expiry)
+
+    async def get_reset_token_email(self, token: str) -> Optional[str]:
+        return await self._call(self._repo.get_reset_token_email, token)
+
+    async def remove_reset_token(self, token: str) -> None:
+        await self._call(self._repo.remove_reset_token, token)
+
+    async def store_refresh_token(self, user_id: str, token: str, expiry: datetime) -> None:
+        await self._call(self._repo.store_refresh_token, user_id, token, expiry)
+
+    async def get_refresh_token_user(self, token: str) -> Optional[str]:
+        return await self._call(self._repo.get_refresh_token_user, token)
+
+    async def remove_refresh_token(self, token: str) -> None:
+        await self._call(self._repo.remove_refresh_token, token)
+
+    async def revoke_user_sessions(self, user_id: str) -> int:
+        return await self._call(self._repo.revoke_user_sessions, user_id)
+
+    async def rotate_refresh_token(self, token: str, new_token: str, new_expiry: datetime) -> User:
+        return await self._call(self._repo.rotate_refresh_token, token, new_token, new_expiry)
+
+    async def record_login_attempt(self, user_id: str, success: bool, max_failed_attempts: int,
+                                   lockout_seconds: int, password_hash: Optional[str] = None) -> User:
+        return await self._call(
+            self._repo.record_login_attempt, user_id, success, max_failed_attempts, lockout_seconds, password_hash
+        )
+
+class AsyncEmailService:
+    """Coroutine interface over EmailService; SMTP I/O runs on an executor"""
+    def __init__(self, email_service: EmailService, executor=None):
+        self._email_service = email_service
+        self._executor = executor
+
+    async def _send(self, fn, *args) -> bool:
+        if self._email_service.delivery_queue is not None:
+            # Queued delivery only enqueues, which never blocks
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def send_welcome_email(self, to_email: str) -> bool:
+        return await self._send(self._email_service.send_welcome_email, to_email)
+
+    async def send_password_reset_email(self, to_email: str, reset_token: str) -> bool:
+        return await self._send(self._email_service.send_password_reset_email, to_email, reset_token)
+
+    async def send_password_changed_email(self, to_email: str) -> bool:
+        return await self._send(self._email_service.send_password_changed_email, to_email)
+
+def _is_in_memory_store(store: Any) -> bool:
+    """True for a plain UserRepository, the one store that never blocks on I/O"""
+    while isinstance(store, InstrumentedUserStore):
+        store = store._store
+    return type(store) is UserRepository
+
+class AsyncAuthService:
+    """asyncio API over the same state and rules as a sync AuthService.
+
+    Validation, lockout handling and response shapes come from the wrapped
+    AuthService, so both APIs behave the same. Only the blocking steps are
+    awaited: bcrypt on the service's hashing pool, repository access and
+    email delivery.
+    """
+    def __init__(self, auth_service: Optional[AuthService] = None,
+                 repo_executor=None, email_executor=None):
+        self.service = auth_service or AuthService()
+        self.config = self.service.config
+        self.metrics = self.service.metrics
+        if repo_executor is None and not _is_in_memory_store(self.service.user_repo):
+            # SQLite queries, journal fsync waits and shared-table file locks
+            # block, so they run on threads rather than the event loop
+            repo_executor = ThreadPoolExecutor(
+                max_workers=self.config.async_repo_workers, thread_name_prefix='auth-repo'
+            )
+        self.user_repo = AsyncUserRepository(self.service.user_repo, repo_executor)
+        self.email_service = AsyncEmailService(self.service.email_service, email_executor)
+
+    async def hash_password(self, password: str) -> str:
+        with self.metrics.timer('stage_seconds', stage='hash'):
+            password_hash = await asyncio.wrap_future(self.service.hasher.submit_hash(password))
+        return password_hash.decode('utf-8')
+
+    async def verify_password(self, password: str, password_hash: str) -> bool:
+        with self.metrics.timer('stage_seconds', stage='verify_password'):
+            return await asyncio.wrap_future(self.service.hasher.submit_verify(password, password_hash))
+
+    @_instrumented
+    async def register_user(self, email: str, password: str) -> Dict[str, Any]:
+        self.service._validate_registration(email, password)
         
-        if not auth_header.startswith('Bearer '):
-            raise AuthorizationError("Authorization header required", 401)
+        password_hash = await self.hash_password(password)
+        user = await self.user_repo.create_user(email, password_hash)
         
-        token = auth_header[7:]
-        auth_service = AuthService()
+        await self.email_service.send_welcome_email(email)
         
-        try:
-            payload = auth_service.verify_token(token)
-            kwargs['user_id'] = payload.user_id
-            kwargs['user_email'] = payload.email
-            return func(*args, **kwargs)
-        except TokenError as e:
-            raise AuthorizationError(e.message, e.code)
+        logger.info("User registered: %s", email)
+        return self.service._registration_response(user)
+
+    @_instrumented
+    async def login_user(self, email: str, password: str, client_id: Optional[str] = None) -> Dict[str, Any]:
+        self.service._check_rate_limit(email, client_id)
+        user = self.service._check_login_allowed(await self.user_repo.find_by_email(email))
+        
+        if not await self.verify_password(password, user.password_hash):
+            raise self.service._failed_login_error(await self._record_login(user, False))
+        
+        new_hash = None
+        if self.service._needs_rehash(user.password_hash):
+            try:
+                new_hash = await self.hash_password(password)
+            except ServiceOverloadedError:
+                pass  # Keep the old hash; the next login will try again
+        user = await self._record_login(user, True, new_hash)
+        if new_hash is not None:
+            self.service._count_rehash()
+        
+        access_token = self.service.create_access_token(user.id, user.email)
+        refresh_token, refresh_expiry = self.service._new_refresh_token()
+        
+        await self.user_repo.store_refresh_token(user.id, refresh_token, refresh_expiry)
+        
+        logger.info("User logged in: %s", email, extra=_SAMPLED)
+        return self.service._login_response(user, access_token, refresh_token)
+
+    @_instrumented
+    async def refresh_token(self, refresh_token: str) -> Dict[str, Any]:
+        new_refresh_token, refresh_expiry = self.service._new_refresh_token()
+        user = await self.user_repo.rotate_refresh_token(refresh_token, new_refresh_token, refresh_expiry)
+        access_token = self.service.create_access_token(user.id, user.email)
+        
+        logger.info("Token refreshed for user: %s", user.email, extra=_SAMPLED)
+        return self.service._token_response(access_token, new_refresh_token)
+
+    @_instrumented
+    async def logout_user(self, refresh_token: str) -> None:
+        await self.user_repo.remove_refresh_token(refresh_token)
+        logger.info("User logged out", extra=_SAMPLED)
+
+    @_instrumented
+    async def request_password_reset(self, email: str) -> bool:
+        user = await self.user_repo.find_by_email(email)
+        if not user or not user.is_active:
+            # Don't reveal whether email exists for security
+            logger.warning("Password reset requested for non-existent email: %s", email)
+            return True
+        
+        reset_token, expiry = self.service._new_reset_token()
+        
+        await self.user_repo.store_reset_token(email, reset_token, expiry)
+        await self.email_service.send_password_reset_email(email, reset_token)
+        
+        logger.info("Password reset requested for: %s", email)
+        return True
+
+    @_instrumented
+    async def reset_password(self, reset_token: str, new_password: str) -> bool:
+        email = await self.user_repo.get_reset_token_email(reset_token)
+        if not email:
+            raise TokenError("Invalid or expired reset token", 401)
+        
+        user = await self.user_repo.find_by_email(email)
+        if not user or not user.is_active:
+            raise AuthenticationError("User not found or inactive", 401)
+        
+        self.service._validate_new_password(new_password, "Password is too weak")
+        
+        password_hash = await self.hash_password(new_password)
+        user = self.service._apply_password_change(user, password_hash)
+        
+        await self.user_repo.update_user(user)
+        await self.user_repo.remove_reset_token(reset_token)
+        await self._revoke_sessions(user.id)
+        await self.email_service.send_password_changed_email(email)
+        
+        logger.info("Password reset for: %s", email)
+        return True
+
+    @_instrumented
+    async def change_password(self, user_id: str, current_password: str, new_password: str) -> bool:
+        user = await self.user_repo.find_by_id(user_id)
+        if not user or not user.is_active:
+            raise AuthenticationError("User not found or inactive", 401)
+        
+        if not await self.verify_password(current_password, user.password_hash):
+            raise AuthenticationError("Current password is incorrect", 401)
+        
+        self.service._validate_new_password(new_password, "New password is too weak")
+        
+        password_hash = await self.hash_password(new_password)
+        user = self.service._apply_password_change(user, password_hash)
+        
+        await self.user_repo.update_user(user)
+        await self._revoke_sessions(user.id)
+        await self.email_service.send_password_changed_email(user.email)
+        
+        logger.info("Password changed for user: %s", user.email)
+        return True
+
+    async def _record_login(self, user: User, success: bool, password_hash: Optional[str] = None) -> User:
+        return await self.user_repo.record_login_attempt(
+            user.id, success, self.config.max_failed_attempts, self.config.lockout_minutes * 60, password_hash
+        )
+
+    async def _revoke_sessions(self, user_id: str) -> int:
+        self.service.revocations.revoke(user_id)
+        return await self.user_repo.revoke_user_sessions(user_id)
+
+    @_instrumented
+    async def logout_all_sessions(self, user_id: str) -> int:
+        revoked = await self._revoke_sessions(user_id)
+        logger.info("Revoked %s sessions for user: %s", revoked, user_id)
+        return revoked
+
+    @_instrumented
+    async def deactivate_user(self, user_id: str) -> None:
+        user = await self.user_repo.find_by_id(user_id)
+        if not user:
+            raise AuthenticationError("User not found or inactive", 401)
+        
+        user = replace(user, is_active=False)
+        await self.user_repo.update_user(user)
+        await self._revoke_sessions(user_id)
+        
+        logger.info("User deactivated: %s", user.email)
+
+    async def verify_token(self, token: str) -> TokenPayload:
+        # Instrumented by the sync service. Pure CPU work (cache lookup or HMAC
+        # check), cheap enough to run on the loop
+        return self.service.verify_token(token)
+
+_default_auth_service: Optional[AuthService] = None
+_default_auth_service_lock = Lock()
+
+def get_auth_service() -> AuthService:
+    """Return the process-wide AuthService, creating it on first use"""
+    global _default_auth_service
+    if _default_auth_service is None:
+        with _default_auth_service_lock:
+            if _default_auth_service is None:
+                _default_auth_service = AuthService()
+    return _default_auth_service
+
+def set_auth_service(auth_service: Optional[AuthService]) -> None:
+    """Install the AuthService used by auth_required (None resets to lazy default)"""
+    global _default_auth_service
+    with _default_auth_service_lock:
+        _default_auth_service = auth_service
+
+def auth_required(func=None, *, auth_service: Optional[AuthService] = None):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            auth_header = kwargs.get('authorization') or args[0].get('authorization', '') if args else ''
+            
+            if not auth_header.startswith('Bearer '):
+                raise AuthorizationError("Authorization header required", 401)
+            
+            token = auth_header[7:]
+            service = auth_service or get_auth_service()
+            
+            try:
+                payload = service.verify_token(token)
+                kwargs['user_id'] = payload.user_id
+                kwargs['user_email'] = payload.email
+                return func(*args, **kwargs)
+            except TokenError as e:
+                raise AuthorizationError(e.message, e.code)
+        
+        return wrapper
     
-    return wrapper
+    if func is not None:
+        return decorator(func)
+    return decorator
 
 # Example usage and test cases
 if __name__ == "__main__":
+    configure_logging()
+    
     # Initialize auth service
     auth_service = AuthService()
     
@@ -0,0 +1,975 @@
+# Benchmark suite for AEP-201.py
+#
+# Runs fully offline: outbound email goes to an in-process SMTP stub and the
+# bcrypt cost is configurable. Results report ops/sec and p50/p99 latency and
+# can be saved as a JSON baseline and compared against one, exiting non-zero
+# when a benchmark regresses past the threshold. The startup benchmark also
+# fails the run when import or AuthService construction exceeds its budget or
+# the import pulls in a dependency that should load lazily.
+#
+#   python bench_aep201.py --rounds 4 --output results.json
+#   python bench_aep201.py --rounds 4 --baseline baseline.json --threshold 0.15
+#   python bench_aep201.py --only login,verify
+#   python bench_aep201.py --only startup --import-budget-ms 80
+
+import argparse
+import gc
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+MODULE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'AEP-201.py')
+PASSWORD = 'BenchPassword123!'
+
+def load_auth_module():
+    """Import AEP-201.py (not importable by name because of the hyphen)"""
+    spec = importlib.util.spec_from_file_location('aep201', MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['aep201'] = module
+    spec.loader.exec_module(module)
+    return module
+
+class _SMTPStubHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        self._reply('220 stub ESMTP')
+        in_data = False
+        for raw in self.rfile:
+            line = raw.rstrip(b'\r\n')
+            if in_data:
+                if line == b'.':
+                    in_data = False
+                    self.server.messages += 1
+                    self._reply('250 OK')
+                continue
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                self._reply('250 stub')
+            elif command == b'MAIL' and self.server.take_failure():
+                self._reply('451 Try again later')
+            elif command == b'RCPT' and any(address in line for address in self.server.rejected):
+                self._reply('550 No such user')
+            elif command == b'DATA':
+                in_data = True
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command == b'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('250 OK')
+
+    def _reply(self, text: str) -> None:
+        self.wfile.write(text.encode('ascii') + b'\r\n')
+
+class SMTPStubServer(socketserver.ThreadingTCPServer):
+    """Minimal in-process SMTP server that accepts and counts every message.
+
+    Tests can make it answer the next ``fail_next`` MAIL commands with a
+    transient 451, and reject recipients in ``rejected`` with a permanent 550.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), _SMTPStubHandler)
+        self.messages = 0
+        self.connections = 0
+        self.fail_next = 0
+        self.rejected: List[bytes] = []
+        self._failures_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def take_failure(self) -> bool:
+        with self._failures_lock:
+            if self.fail_next <= 0:
+                return False
+            self.fail_next -= 1
+            return True
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def __enter__(self) -> 'SMTPStubServer':
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+        self.server_close()
+
+def summarize(name: str, samples_ns: List[int], wall_seconds: float, ops: Optional[int] = None) -> Dict[str, Any]:
+    samples_ns = sorted(samples_ns)
+    count = ops if ops is not None else len(samples_ns)
+    result = {
+        'name': name,
+        'ops': count,
+        'ops_per_sec': count / wall_seconds if wall_seconds else 0.0,
+    }
+    if samples_ns:
+        result['p50_us'] = samples_ns[int(0.50 * (len(samples_ns) - 1))] / 1000
+        result['p99_us'] = samples_ns[int(0.99 * (len(samples_ns) - 1))] / 1000
+    return result
+
+def measure(name: str, fn: Callable[[int], Any], iterations: int, warmup: int = 0) -> Dict[str, Any]:
+    for i in range(warmup):
+        fn(i)
+    gc.collect()
+    samples = []
+    clock = time.perf_counter_ns
+    started = clock()
+    for i in range(warmup, warmup + iterations):
+        op_start = clock()
+        fn(i)
+        samples.append(clock() - op_start)
+    return summarize(name, samples, (clock() - started) / 1e9)
+
+def measure_threads(name: str, worker: Callable[[int, random.Random], Callable[[], Any]],
+                    threads: int, duration: float, seed: int) -> Dict[str, Any]:
+    """Run ``threads`` workers for ``duration`` seconds; each worker gets its own op callable"""
+    samples: List[List[int]] = [[] for _ in range(threads)]
+    stop = threading.Event()
+    ready = threading.Barrier(threads + 1)
+
+    def run(index: int) -> None:
+        op = worker(index, random.Random(seed + index))
+        local = samples[index]
+        clock = time.perf_counter_ns
+        ready.wait()
+        while not stop.is_set():
+            op_start = clock()
+            op()
+            local.append(clock() - op_start)
+
+    pool = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    ready.wait()
+    started = time.perf_counter()
+    time.sleep(duration)
+    stop.set()
+    for thread in pool:
+        thread.join()
+    wall = time.perf_counter() - started
+    result = summarize(name, [s for local in samples for s in local], wall)
+    result['threads'] = threads
+    return result
+
+def _shared_session_worker(path: str, tokens: int, duration: float, seed: int, start, results) -> None:
+    """One worker process: 90% lookups / 10% stores against the shared session table"""
+    auth = load_auth_module()
+    table = auth.SharedSessionTable(path)
+    rng = random.Random(seed)
+    digests = [auth.token_digest(f'shared{i}') for i in range(tokens)]
+    expires_at = int(time.time()) + 3600
+    samples = []
+    clock = time.perf_counter_ns
+    start.wait()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        i = rng.randrange(tokens)
+        digest = digests[i]
+        op_start = clock()
+        if rng.random() < 0.9:
+            table.get(digest)
+        else:
+            table.store(digest, f'user{i}', expires_at)
+        samples.append(clock() - op_start)
+    results.put((samples, table.read_retries))
+    table.close()
+
+# Runs in a fresh interpreter per sample: times the module import, AuthService
+# construction and a first token round trip, and reports what got loaded
+STARTUP_PROBE = r"""
+import importlib.util, json, os, sys, threading, time
+clock = time.perf_counter
+started = clock()
+spec = importlib.util.spec_from_file_location('aep201', sys.argv[1])
+auth = importlib.util.module_from_spec(spec)
+sys.modules['aep201'] = auth
+spec.loader.exec_module(auth)
+imported = clock()
+config = auth.AuthConfig()
+config.jwt_secret = 'bench-secret'
+config.user_store = 'memory'
+config.bcrypt_target_ms = 0
+service = auth.AuthService(config=config)
+constructed = clock()
+service.verify_token(service.create_access_token('user-1', 'user1@bench.example.com'))
+verified = clock()
+auth.AuthService(config=config)
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'construct_ms': (constructed - imported) * 1000,
+    'first_verify_ms': (verified - constructed) * 1000,
+    'background_threads': threading.active_count() - 1,
+    'loaded': [name for name in sys.argv[2:] if name in sys.modules],
+    'log_file_created': os.path.exists('auth_service.log'),
+}))
+"""
+
+# Dependencies a verify-only process must not pay for
+LAZY_MODULES = (
+    'bcrypt', 'smtplib', 'email.mime.multipart', 'asyncio', 'sqlite3', 'concurrent.futures.process', 'cryptography'
+)
+
+class BenchmarkSuite:
+    def __init__(self, auth, args, smtp: SMTPStubServer):
+        self.auth = auth
+        self.args = args
+        self.smtp = smtp
+        self.results: List[Dict[str, Any]] = []
+        self.budget_failures: List[str] = []
+
+    def make_config(self, **overrides):
+        config = self.auth.AuthConfig()
+        config.jwt_secret = 'bench-secret'
+        config.bcrypt_rounds = self.args.rounds
+        config.smtp_host = '127.0.0.1'
+        config.smtp_port = self.smtp.port
+        config.smtp_use_tls = False
+        config.user_store = 'memory'
+        # Benchmarks hammer a few accounts; only the rate_limit benchmark limits logins
+        config.login_rate_email_per_minute = 0
+        config.login_rate_client_per_minute = 0
+        for key, value in overrides.items():
+            setattr(config, key, value)
+        return config
+
+    def make_service(self, **overrides):
+        return self.auth.AuthService(config=self.make_config(**overrides))
+
+    def seed_users(self, service, count: int, prefix: str = 'user') -> List[str]:
+        password_hash = service.hash_password(PASSWORD)
+        emails = [f'{prefix}{i}@bench.example.com' for i in range(count)]
+        for email in emails:
+            service.user_repo.create_user(email, password_hash)
+        return emails
+
+    def record(self, result: Dict[str, Any]) -> None:
+        self.results.append(result)
+        extra = ''
+        if 'p50_us' in result:
+            extra = f"  p50 {result['p50_us']:>10.1f}us  p99 {result['p99_us']:>10.1f}us"
+        for key in ('bytes_per_user', 'bytes_per_session', 'cpu_seconds', 'restart_seconds', 'peak_kib', 'p99_ratio'):
+            if key in result:
+                extra += f"  {key} {result[key]:.3f}"
+        print(f"{result['name']:<40} {result['ops_per_sec']:>12.1f} ops/s{extra}", flush=True)
+
+    def run(self, only: Optional[List[str]]) -> List[Dict[str, Any]]:
+        for name in BENCHMARKS:
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            getattr(self, f'bench_{name}')()
+        return self.results
+
+    # -- validation -------------------------------------------------------
+
+    def bench_startup(self) -> None:
+        # Bytecode goes to a private cache warmed by one discarded run, so the
+        # samples measure a deployed module rather than compiling the source
+        work_dir = tempfile.mkdtemp(prefix='aep201-bench-startup-')
+        env = dict(os.environ, PYTHONPYCACHEPREFIX=os.path.join(work_dir, 'pycache'))
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        runs = []
+        for _ in range(self.args.startup_runs + 1):
+            completed = subprocess.run(
+                [sys.executable, '-c', STARTUP_PROBE, MODULE_PATH, *LAZY_MODULES],
+                cwd=work_dir, env=env, capture_output=True, text=True, check=True
+            )
+            runs.append(json.loads(completed.stdout))
+        runs = runs[1:]
+
+        def median(key: str) -> float:
+            return sorted(run[key] for run in runs)[len(runs) // 2]
+
+        probe = runs[-1]
+        for key, budget in (('import_ms', self.args.import_budget_ms),
+                            ('construct_ms', self.args.construct_budget_ms),
+                            ('first_verify_ms', None)):
+            value = median(key)
+            result = {'name': f"startup_{key[:-3]}", 'ops_per_sec': 1000 / value if value else 0.0,
+                      'p50_us': value * 1000, 'p99_us': max(run[key] for run in runs) * 1000}
+            if budget is not None:
+                result['budget_ms'] = budget
+                if value > budget:
+                    self.budget_failures.append(f"{result['name']}: {value:.1f}ms exceeds budget {budget:.1f}ms")
+            self.record(result)
+        if probe['loaded']:
+            self.budget_failures.append(f"startup: loaded eagerly: {', '.join(probe['loaded'])}")
+        if probe['background_threads'] > 1:
+            self.budget_failures.append(
+                f"startup: {probe['background_threads']} background threads for two services (expected 1)"
+            )
+        if probe['log_file_created']:
+            self.budget_failures.append("startup: importing the module created auth_service.log")
+        self.results[-1].update(
+            background_threads=probe['background_threads'],
+            loaded_modules=probe['loaded'],
+            log_file_created=probe['log_file_created']
+        )
+
+    def bench_validation(self) -> None:
+        service = self.make_service()
+        emails = ['user@example.com', 'first.last+tag@sub.example.org', 'not-an-email', 'a@b']
+        passwords = ['Sh0rt!', 'lowercaseonly', 'Mixed12345', 'V3ry$trongPassw0rd']
+        n = self.args.iterations * 10
+        self.record(measure('validate_email', lambda i: service.validate_email(emails[i % 4]), n, 100))
+
+        def strength(i: int) -> None:
+            try:
+                service.validate_password_strength(passwords[i % 4])
+            except self.auth.ValidationError:
+                pass
+        self.record(measure('validate_password_strength', strength, n, 100))
+
+    # -- account flows ----------------------------------------------------
+
+    def bench_register_user(self) -> None:
+        service = self.make_service()
+        self.record(measure(
+            'register_user',
+            lambda i: service.register_user(f'register{i}@bench.example.com', PASSWORD),
+            self.args.iterations, 5
+        ))
+        service.email_service.delivery_queue.flush(30)
+
+    def bench_login(self) -> None:
+        service = self.make_service(max_failed_attempts=10 ** 9)
+        emails = self.seed_users(service, 64)
+        self.record(measure(
+            'login_success', lambda i: service.login_user(emails[i % 64], PASSWORD), self.args.iterations, 5
+        ))
+
+        def wrong_password(i: int) -> None:
+            try:
+                service.login_user(emails[i % 64], 'WrongPassword123!')
+            except self.auth.AuthenticationError:
+                pass
+        self.record(measure('login_wrong_password', wrong_password, self.args.iterations, 5))
+
+        locked = self.make_service()
+        email = self.seed_users(locked, 1, 'locked')[0]
+        user = locked.user_repo.find_by_email(email)
+        user.failed_login_attempts = locked.config.max_failed_attempts
+        user.last_failed_login = int(time.time())
+        locked.user_repo.update_user(user)
+
+        def locked_account(i: int) -> None:
+            try:
+                locked.login_user(email, PASSWORD)
+            except self.auth.AuthenticationError:
+                pass
+        self.record(measure('login_locked_account', locked_account, self.args.iterations * 10, 50))
+
+    def bench_refresh_token(self) -> None:
+        service = self.make_service()
+        email = self.seed_users(service, 1, 'refresh')[0]
+        state = {'token': service.login_user(email, PASSWORD)['refresh_token']}
+
+        def refresh(i: int) -> None:
+            state['token'] = service.refresh_token(state['token'])['refresh_token']
+        self.record(measure('refresh_token', refresh, self.args.iterations * 10, 50))
+
+    def bench_verify(self) -> None:
+        service = self.make_service()
+        tokens = [service.create_access_token(f'user{i}', f'user{i}@bench.example.com') for i in range(256)]
+        n = self.args.iterations * 20
+        self.record(measure('verify_access_token', lambda i: service.verify_access_token(tokens[i % 256]), n, 256))
+        self.record(measure('verify_token_cached', lambda i: service.verify_token(tokens[i % 256]), n, 256))
+        self.results[-1]['cache'] = service.token_cache.stats()
+
+        uncached = self.make_service(token_cache_size=0)
+        self.record(measure('verify_token_uncached', lambda i: uncached.verify_token(tokens[i % 256]), n, 256))
+
+    def bench_revocation(self) -> None:
+        # Verify hot path with many live watermarks, and revoke cost vs. table size
+        service = self.make_service()
+        tokens = [service.create_access_token(f'user{i}', f'user{i}@bench.example.com') for i in range(256)]
+        for i in range(self.args.users):
+            service.revocations.revoke(f'revoked{i}')
+        n = self.args.iterations * 20
+        self.record(measure('verify_token_cached_revocations', lambda i: service.verify_token(tokens[i % 256]), n, 256))
+        self.results[-1]['revocations'] = service.revocations.stats()
+
+        repo = service.user_repo
+        expiry = datetime.now(timezone.utc) + timedelta(days=7)
+        for i in range(self.args.users):
+            repo.store_refresh_token(f'background{i % 1000}', f'bg-{i}', expiry)
+
+        def revoke(i: int) -> None:
+            for j in range(5):
+                repo.store_refresh_token(f'target{i}', f'target-{i}-{j}', expiry)
+            repo.revoke_user_sessions(f'target{i}')
+        self.record(measure('revoke_user_5_sessions', revoke, self.args.iterations * 5, 10))
+        self.results[-1]['background_sessions'] = self.args.users
+
+    def bench_compound(self) -> None:
+        # Atomicity under contention is covered by test_aep201.py
+        service = self.make_service()
+        email = self.seed_users(service, 1, 'compound')[0]
+
+        # Throughput: one critical section vs. the four separate repository calls
+        repo = service.user_repo
+        user = repo.find_by_email(email)
+        expiry = datetime.now(timezone.utc) + timedelta(days=7)
+        for mode, rotate in (('compound', repo.rotate_refresh_token),
+                             ('separate_calls', lambda *a: self.auth.UserStore.rotate_refresh_token(repo, *a))):
+            def rotate_worker(index: int, rng: random.Random) -> Callable[[], Any]:
+                state = {'token': f'{mode}-{index}-0', 'n': 0}
+                repo.store_refresh_token(user.id, state['token'], expiry)
+
+                def op() -> None:
+                    state['n'] += 1
+                    new_token = f"{mode}-{index}-{state['n']}"
+                    rotate(state['token'], new_token, expiry)
+                    state['token'] = new_token
+                return op
+            self.record(measure_threads(f'rotate_refresh_{mode}', rotate_worker, self.args.threads,
+                                        self.args.duration, self.args.seed))
+
+    def bench_jwt(self) -> None:
+        # Key-ring codec against the generic PyJWT calls it replaced
+        service = self.make_service()
+        n = self.args.iterations * 20
+        self.record(measure(
+            'jwt_encode_codec', lambda i: service.create_access_token(f'user{i}', 'user@bench.example.com'), n, 256
+        ))
+        tokens = [service.create_access_token(f'user{i}', f'user{i}@bench.example.com') for i in range(256)]
+        self.record(measure('jwt_decode_codec', lambda i: service.verify_access_token(tokens[i % 256]), n, 256))
+
+        service.token_codec.key_ring.add_key('bench-rotated', 'bench-rotated-secret', activate=True)
+        kid_tokens = [service.create_access_token(f'user{i}', f'user{i}@bench.example.com') for i in range(256)]
+        self.record(measure('jwt_decode_codec_kid', lambda i: service.verify_access_token(kid_tokens[i % 256]), n, 256))
+
+        try:
+            import jwt
+        except ImportError:
+            print('jwt_*_pyjwt skipped: PyJWT not installed', flush=True)
+            return
+        secret = service.config.jwt_secret
+
+        def pyjwt_encode(i: int) -> str:
+            now = datetime.now(timezone.utc)
+            payload = {'sub': f'user{i}', 'email': 'user@bench.example.com',
+                       'exp': now + timedelta(minutes=60), 'iat': now}
+            return jwt.encode(payload, secret, algorithm='HS256')
+
+        def pyjwt_decode(i: int) -> Any:
+            payload = jwt.decode(tokens[i % 256], secret, algorithms=['HS256'])
+            return (datetime.fromtimestamp(payload['exp'], timezone.utc),
+                    datetime.fromtimestamp(payload['iat'], timezone.utc))
+        self.record(measure('jwt_encode_pyjwt', pyjwt_encode, n, 256))
+        self.record(measure('jwt_decode_pyjwt', pyjwt_decode, n, 256))
+
+    def bench_signing(self) -> None:
+        # Sign/verify cost per access-token algorithm, plus local verification
+        # by a downstream TokenVerifier working from the published JWKS
+        try:
+            from cryptography.hazmat.primitives import serialization
+        except ImportError:
+            print('signing_* skipped: cryptography not installed', flush=True)
+            return
+        key_dir = tempfile.mkdtemp(prefix='aep201-bench-keys-')
+        n = self.args.iterations * 10
+        for algorithm in ('HS256', 'ES256', 'EdDSA'):
+            overrides: Dict[str, Any] = {'jwt_algorithm': algorithm}
+            if algorithm != 'HS256':
+                path = os.path.join(key_dir, f'{algorithm}.pem')
+                with open(path, 'wb') as f:
+                    f.write(self.auth.generate_signing_key(algorithm).private_bytes(
+                        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                        serialization.NoEncryption()
+                    ))
+                overrides['jwt_private_keys'] = f'bench:{path}'
+            service = self.make_service(**overrides)
+            self.record(measure(
+                f'signing_{algorithm}_sign',
+                lambda i: service.create_access_token(f'user{i}', 'user@bench.example.com'), n, 64
+            ))
+            tokens = [service.create_access_token(f'user{i}', f'user{i}@bench.example.com') for i in range(256)]
+            self.results[-1]['token_bytes'] = len(tokens[0])
+            self.record(measure(f'signing_{algorithm}_verify', lambda i: service.verify_access_token(tokens[i % 256]), n, 64))
+            if algorithm == 'HS256':
+                continue
+            verifier = self.auth.TokenVerifier(service.get_jwks, cache_size=0)
+            self.record(measure(f'signing_{algorithm}_verify_local', lambda i: verifier.verify(tokens[i % 256]), n, 64))
+            cached = self.auth.TokenVerifier(service.get_jwks)
+            self.record(measure(
+                f'signing_{algorithm}_verify_local_cached', lambda i: cached.verify(tokens[i % 256]), n * 4, 256
+            ))
+
+    def bench_metrics(self) -> None:
+        # Same hot paths as above with instrumentation switched on, to size its overhead
+        service = self.make_service(metrics_enabled=True, max_failed_attempts=10 ** 9)
+        emails = self.seed_users(service, 64)
+        self.record(measure(
+            'metrics_on_login_success', lambda i: service.login_user(emails[i % 64], PASSWORD),
+            self.args.iterations, 5
+        ))
+        tokens = [service.create_access_token(f'user{i}', f'user{i}@bench.example.com') for i in range(256)]
+        self.record(measure(
+            'metrics_on_verify_token_cached', lambda i: service.verify_token(tokens[i % 256]),
+            self.args.iterations * 20, 256
+        ))
+
+    def bench_logging(self) -> None:
+        # login_user with INFO logging to a real file, written inline vs through the queue
+        service = self.make_service(max_failed_attempts=10 ** 9)
+        emails = self.seed_users(service, 64, 'logging')
+        root = logging.getLogger()
+        saved_handlers, saved_level, saved_disable = root.handlers[:], root.level, logging.root.manager.disable
+        log_dir = tempfile.mkdtemp(prefix='aep201-bench-log-')
+        root.handlers = [logging.FileHandler(os.path.join(log_dir, 'auth_service.log'))]
+        root.setLevel(logging.INFO)
+        logging.disable(logging.NOTSET)
+        try:
+            self.record(measure(
+                'logging_sync_login', lambda i: service.login_user(emails[i % 64], PASSWORD), self.args.iterations, 5
+            ))
+            for rate in (1.0, 0.1):
+                pipeline = self.auth.enable_async_logging(success_sample_rate=rate)
+                try:
+                    self.record(measure(
+                        f'logging_queue_login_sample_{rate:g}',
+                        lambda i: service.login_user(emails[i % 64], PASSWORD), self.args.iterations, 5
+                    ))
+                    self.results[-1]['log_queue'] = pipeline.stats()
+                finally:
+                    self.auth.disable_async_logging()
+        finally:
+            for handler in root.handlers:
+                handler.close()
+            root.handlers = saved_handlers
+            root.setLevel(saved_level)
+            logging.disable(saved_disable)
+
+    def bench_rate_limit(self) -> None:
+        # Credential-stuffing mix: 1 legitimate login per 20 attempts, the rest
+        # come from a handful of attacker clients spraying wrong passwords
+        # across many accounts. CPU time covers the hashing pool threads too.
+        attempts = self.args.iterations * 10
+        for limited in (False, True):
+            overrides = {'max_failed_attempts': 10 ** 9}
+            if limited:
+                overrides.update(login_rate_email_per_minute=10, login_rate_email_burst=5,
+                                 login_rate_client_per_minute=60, login_rate_client_burst=20)
+            service = self.make_service(**overrides)
+            emails = self.seed_users(service, 256, 'stuffing')
+            rng = random.Random(self.args.seed)
+            plan = []
+            for i in range(attempts):
+                if i % 20 == 0:
+                    plan.append((emails[rng.randrange(256)], PASSWORD, f'legit-{i}'))
+                else:
+                    plan.append((emails[rng.randrange(256)], 'Guess123!', f'attacker-{rng.randrange(4)}'))
+            outcomes = {'ok': 0, 'rejected': 0, 'rate_limited': 0}
+            cpu_started = time.process_time()
+            wall_started = time.perf_counter()
+            for email, password, client_id in plan:
+                try:
+                    service.login_user(email, password, client_id=client_id)
+                    outcomes['ok'] += 1
+                except self.auth.RateLimitError:
+                    outcomes['rate_limited'] += 1
+                except self.auth.AuthError:
+                    outcomes['rejected'] += 1
+            wall = time.perf_counter() - wall_started
+            self.record({
+                'name': f"stuffing_{'limited' if limited else 'unlimited'}",
+                'ops': attempts,
+                'ops_per_sec': attempts / wall,
+                'cpu_seconds': time.process_time() - cpu_started,
+                'outcomes': outcomes,
+            })
+
+    # -- repository -------------------------------------------------------
+
+    def bench_repository(self) -> None:
+        service = self.make_service()
+        repo = service.user_repo
+        emails = self.seed_users(service, self.args.users)
+        ids = [repo.find_by_email(email).id for email in emails]
+        expiry = datetime.now(timezone.utc) + timedelta(days=7)
+        tokens = [f'refresh-token-{i:064d}' for i in range(len(ids))]
+        for token, user_id in zip(tokens, ids):
+            repo.store_refresh_token(user_id, token, expiry)
+
+        n = self.args.iterations * 20
+        count = len(emails)
+        self.record(measure('repo_find_by_email', lambda i: repo.find_by_email(emails[i % count]), n, 100))
+        self.record(measure('repo_find_by_id', lambda i: repo.find_by_id(ids[i % count]), n, 100))
+        self.record(measure(
+            'repo_get_refresh_token_user', lambda i: repo.get_refresh_token_user(tokens[i % count]), n, 100
+        ))
+
+        def mixed(index: int, rng: random.Random) -> Callable[[], Any]:
+            def op() -> None:
+                i = rng.randrange(count)
+                roll = rng.random()
+                if roll < 0.45:
+                    repo.find_by_email(emails[i])
+                elif roll < 0.90:
+                    repo.get_refresh_token_user(tokens[i])
+                elif roll < 0.95:
+                    repo.update_user(repo.find_by_id(ids[i]))
+                else:
+                    repo.store_refresh_token(ids[i], tokens[i], expiry)
+            return op
+        self.record(measure_threads(
+            'repo_mixed_90_10', mixed, self.args.threads, self.args.duration, self.args.seed
+        ))
+
+    def bench_backends(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            for backend in ('memory', 'sqlite'):
+                service = self.make_service(
+                    user_store=backend, sqlite_path=os.path.join(tmp, 'bench.db'), max_failed_attempts=10 ** 9
+                )
+                emails = self.seed_users(service, self.args.users, backend)
+                service.user_repo.flush()
+                count = len(emails)
+                rng = random.Random(self.args.seed)
+                picks = [emails[rng.randrange(count)] for _ in range(1024)]
+                self.record(measure(
+                    f'backend_{backend}_find_by_email',
+                    lambda i: service.user_repo.find_by_email(picks[i % 1024]),
+                    self.args.iterations * 20, 100
+                ))
+                self.record(measure(
+                    f'backend_{backend}_login',
+                    lambda i: service.login_user(picks[i % 1024], PASSWORD),
+                    self.args.iterations, 5
+                ))
+                service.user_repo.close()
+
+    # -- restart / persistence --------------------------------------------
+
+    def bench_restart(self) -> None:
+        password_hash = '$2b$12$' + 'x' * 53
+        expiry = datetime.now(timezone.utc) + timedelta(days=7)
+        for users in sorted({max(1000, self.args.users // 10), self.args.users}):
+            directory = tempfile.mkdtemp(prefix='aep201-bench-durable-')
+            repo = self.auth.DurableUserRepository(directory, durable=False, commit_window_seconds=0)
+            for start in range(0, users, 10000):
+                created = repo.create_users_batch(
+                    [(f'r{i}@bench.example.com', password_hash) for i in range(start, min(users, start + 10000))]
+                )
+                for i, user in enumerate(created):
+                    repo.store_refresh_token(user.id, f'restart-{start + i}', expiry)
+            repo.close()
+
+            for mode in ('journal', 'snapshot'):
+                started = time.perf_counter()
+                repo = self.auth.DurableUserRepository(directory, durable=False)
+                wall = time.perf_counter() - started
+                self.record({'name': f'restart_{mode}_{users}_users', 'ops': users,
+                             'ops_per_sec': users / wall, 'restart_seconds': wall})
+                if mode == 'journal':
+                    repo.snapshot()
+                repo.close()
+
+        # Group commit: concurrent durable writes share fsyncs
+        directory = tempfile.mkdtemp(prefix='aep201-bench-durable-')
+        repo = self.auth.DurableUserRepository(directory)
+        user = repo.create_user('groupcommit@bench.example.com', password_hash)
+
+        def store_worker(index: int, rng: random.Random) -> Callable[[], Any]:
+            counter = iter(range(10 ** 9))
+            return lambda: repo.store_refresh_token(user.id, f'gc-{index}-{next(counter)}', expiry)
+        result = measure_threads('journal_fsync_store_refresh', store_worker, self.args.threads,
+                                 self.args.duration, self.args.seed)
+        result['journal'] = repo._journal.stats()
+        self.record(result)
+        repo.close()
+
+    # -- shared sessions --------------------------------------------------
+
+    def bench_shared_sessions(self) -> None:
+        path = os.path.join(tempfile.mkdtemp(prefix='aep201-bench-shm-'), 'sessions')
+        table = self.auth.SharedSessionTable(path, capacity=max(1 << 16, self.args.users * 4))
+        expires_at = int(time.time()) + 3600
+        tokens = self.args.users
+        for i in range(tokens):
+            table.store(self.auth.token_digest(f'shared{i}'), f'user{i}', expires_at)
+
+        ctx = multiprocessing.get_context('spawn')
+        for processes in sorted({1, self.args.threads}):
+            start = ctx.Event()
+            results = ctx.Queue()
+            workers = [
+                ctx.Process(target=_shared_session_worker,
+                            args=(path, tokens, self.args.duration, self.args.seed + i, start, results))
+                for i in range(processes)
+            ]
+            for worker in workers:
+                worker.start()
+            # Workers import the module first; give them a moment before the clock starts
+            time.sleep(1.0)
+            started = time.perf_counter()
+            start.set()
+            collected = [results.get() for _ in workers]
+            wall = time.perf_counter() - started
+            for worker in workers:
+                worker.join()
+            result = summarize(f'shared_sessions_{processes}_procs',
+                               [s for samples, _ in collected for s in samples], wall)
+            result['processes'] = processes
+            result['read_retries'] = sum(retries for _, retries in collected)
+            self.record(result)
+
+        table.close()
+
+    # -- hashing pool -----------------------------------------------------
+
+    def bench_hash_workers(self) -> None:
+        counts = sorted({1, 2, 4, os.cpu_count() or 1})
+        for workers in counts:
+            service = self.make_service(hash_workers=workers, hash_queue_size=workers * 4,
+                                        max_failed_attempts=10 ** 9)
+            emails = self.seed_users(service, 64, f'workers{workers}-')
+
+            def login_worker(index: int, rng: random.Random) -> Callable[[], Any]:
+                return lambda: service.login_user(emails[rng.randrange(64)], PASSWORD)
+            result = measure_threads(
+                f'login_workers_{workers}', login_worker, workers * 2, self.args.duration, self.args.seed
+            )
+            result['hash_workers'] = workers
+            self.record(result)
+            service.hasher.shutdown()
+
+    # -- bulk import ------------------------------------------------------
+
+    def bench_import(self) -> None:
+        count = self.args.iterations * 5
+        service = self.make_service()
+        started = time.perf_counter()
+        for i in range(count):
+            service.register_user(f'serial{i}@bench.example.com', PASSWORD)
+        wall = time.perf_counter() - started
+        self.record({'name': 'import_register_loop', 'ops': count, 'ops_per_sec': count / wall})
+        service.email_service.delivery_queue.flush(30)
+
+        service = self.make_service()
+        rows = ({'email': f'bulk{i}@bench.example.com', 'password': PASSWORD} for i in range(count))
+        report = service.import_users(rows, batch_size=500)
+        self.record({'name': 'import_users_plaintext', 'ops': report.total, 'ops_per_sec': report.rows_per_second})
+
+        password_hash = service.hasher.hash_password(PASSWORD)
+        rows = ({'email': f'hashed{i}@bench.example.com', 'password_hash': password_hash}
+                for i in range(self.args.users))
+        report = service.import_users(rows, batch_size=1000)
+        self.record({'name': 'import_users_prehashed', 'ops': report.total, 'ops_per_sec': report.rows_per_second})
+
+    # -- memory -----------------------------------------------------------
+
+    def bench_memory(self) -> None:
+        for entries in self.args.memory_entries:
+            repo = self.auth.UserRepository()
+            password_hash = '$2b$12$' + 'x' * 53
+            gc.collect()
+            tracemalloc.start()
+            base = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            users = [repo.create_user(f'm{i}@bench.example.com', password_hash) for i in range(entries)]
+            user_bytes = tracemalloc.get_traced_memory()[0] - base
+            expiry = datetime.now(timezone.utc) + timedelta(days=7)
+            token_base = 'r' * 80
+            for i, user in enumerate(users):
+                repo.store_refresh_token(user.id, f'{token_base}{i:06d}', expiry)
+            session_bytes = tracemalloc.get_traced_memory()[0] - base - user_bytes
+            tracemalloc.stop()
+            wall = time.perf_counter() - started
+            self.record({
+                'name': f'memory_{entries}',
+                'ops': entries * 2,
+                'ops_per_sec': entries * 2 / wall,
+                'bytes_per_user': user_bytes / entries,
+                'bytes_per_session': session_bytes / entries,
+            })
+            del users, repo
+            gc.collect()
+
+    # -- export -----------------------------------------------------------
+
+    def bench_export(self) -> None:
+        expiry = datetime.now(timezone.utc) + timedelta(days=7)
+        with tempfile.TemporaryDirectory() as tmp:
+            for backend in ('memory', 'sqlite'):
+                service = self.make_service(
+                    user_store=backend, sqlite_path=os.path.join(tmp, 'export.db'), max_failed_attempts=10 ** 9
+                )
+                emails = self.seed_users(service, self.args.users, f'export-{backend}')
+                for i, email in enumerate(emails):
+                    user = service.user_repo.find_by_email(email)
+                    service.user_repo.store_refresh_token(user.id, f'export-{backend}-{i:08d}', expiry)
+                service.user_repo.flush()
+                count = len(emails)
+
+                def login_worker(index: int, rng: random.Random) -> Callable[[], Any]:
+                    return lambda: service.login_user(emails[rng.randrange(count)], PASSWORD)
+
+                def export_once() -> Dict[str, int]:
+                    seen = {'user': 0, 'session': 0}
+                    for chunk in service.export_snapshot():
+                        for line in chunk.splitlines():
+                            seen[json.loads(line)['type']] += 1
+                    return seen
+
+                gc.collect()
+                tracemalloc.start()
+                started = time.perf_counter()
+                seen = export_once()
+                wall = time.perf_counter() - started
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                records = seen['user'] + seen['session']
+                self.record({
+                    'name': f'export_{backend}',
+                    'ops': records,
+                    'ops_per_sec': records / wall,
+                    'peak_kib': peak / 1024,
+                })
+
+                quiet = measure_threads(
+                    f'export_{backend}_login_quiet', login_worker, self.args.threads,
+                    self.args.duration, self.args.seed
+                )
+                self.record(quiet)
+
+                # Export consistency under this load is covered by test_aep201.py
+                stop = threading.Event()
+                exports: List[Dict[str, int]] = []
+
+                def exporter() -> None:
+                    while not stop.is_set():
+                        exports.append(export_once())
+
+                thread = threading.Thread(target=exporter, daemon=True)
+                thread.start()
+                loaded = measure_threads(
+                    f'export_{backend}_login_during_export', login_worker, self.args.threads,
+                    self.args.duration, self.args.seed
+                )
+                stop.set()
+                thread.join()
+                loaded['exports'] = len(exports)
+                loaded['p99_ratio'] = loaded['p99_us'] / quiet['p99_us'] if quiet.get('p99_us') else 0.0
+                self.record(loaded)
+                service.user_repo.close()
+
+BENCHMARKS = (
+    'startup',
+    'validation',
+    'register_user',
+    'login',
+    'refresh_token',
+    'verify',
+    'revocation',
+    'compound',
+    'jwt',
+    'signing',
+    'metrics',
+    'logging',
+    'rate_limit',
+    'repository',
+    'backends',
+    'restart',
+    'shared_sessions',
+    'hash_workers',
+    'import',
+    'memory',
+    'export',
+)
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Return a description of every benchmark that regressed past ``threshold``"""
+    previous = {r['name']: r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get(result['name'])
+        if not before:
+            continue
+        if before.get('ops_per_sec') and result['ops_per_sec'] < before['ops_per_sec'] * (1 - threshold):
+            regressions.append(
+                f"{result['name']}: {result['ops_per_sec']:.1f} ops/s vs baseline {before['ops_per_sec']:.1f}"
+            )
+        if before.get('p99_us') and result.get('p99_us', 0) > before['p99_us'] * (1 + threshold):
+            regressions.append(
+                f"{result['name']}: p99 {result['p99_us']:.1f}us vs baseline {before['p99_us']:.1f}us"
+            )
+    return regressions
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark the AEP-201 auth service hot paths')
+    parser.add_argument('--rounds', type=int, default=4, help='bcrypt cost factor (default 4)')
+    parser.add_argument('--iterations', type=int, default=200, help='base iterations per benchmark')
+    parser.add_argument('--users', type=int, default=10000, help='users seeded for repository/backend benchmarks')
+    parser.add_argument('--memory-entries', type=lambda v: [int(x) for x in v.split(',')], default=[100000],
+                        help='comma-separated entry counts for the memory benchmark, e.g. 1000000,10000000')
+    parser.add_argument('--threads', type=int, default=8, help='threads for multi-threaded benchmarks')
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds per multi-threaded benchmark')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--only', type=lambda v: v.split(','), help='comma-separated benchmark name prefixes')
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='compare against this results JSON')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed regression fraction (default 0.10)')
+    parser.add_argument('--with-logging', action='store_true', help='keep the service INFO logging enabled')
+    parser.add_argument('--startup-runs', type=int, default=5, help='fresh interpreters sampled by the startup benchmark')
+    parser.add_argument('--import-budget-ms', type=float, default=100.0,
+                        help='fail when the median module import takes longer (default 100)')
+    parser.add_argument('--construct-budget-ms', type=float, default=10.0,
+                        help='fail when the median AuthService construction takes longer (default 10)')
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    auth = load_auth_module()
+    if args.with_logging:
+        auth.configure_logging()
+    else:
+        logging.disable(logging.INFO)
+
+    with SMTPStubServer() as smtp:
+        suite = BenchmarkSuite(auth, args, smtp)
+        results = suite.run(args.only)
+
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    for line in suite.budget_failures:
+        print(f"OVER BUDGET {line}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+    return 1 if suite.budget_failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
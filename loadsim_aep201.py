@@ -0,0 +1,534 @@
+# Load simulator for AEP-201.py
+#
+# Drives an in-process AuthService with a scenario: a sequence of phases, each
+# with a thread count, a duration and a weighted mix of operations. Outbound
+# email is stubbed. Reports per-phase throughput, latency percentiles and
+# outcomes per operation, repository lock contention and a memory/throughput
+# timeline. A run is reproducible from its scenario and --seed.
+#
+#   python loadsim_aep201.py --list
+#   python loadsim_aep201.py --scenario morning_login_storm --seed 7
+#   python loadsim_aep201.py --scenario my_scenario.json --processes 4 --output run.json
+#   python loadsim_aep201.py --dump-scenario credential_stuffing > my_scenario.json
+#
+# Scenario file format (JSON; every key except "phases" is optional):
+#
+#   {"name": "...", "users": 2000, "sessions_per_thread": 4,
+#    "config": {"jwt_expiry_minutes": 1, "login_rate_email_per_minute": 10},
+#    "phases": [{"name": "...", "duration": 10, "threads": 16,
+#                "mix": {"verify": 90, "refresh": 10},
+#                "think_ms": 0, "ramp_seconds": 0,
+#                "burst_interval": 0, "burst_ops": 0}]}
+#
+# "ramp_seconds" staggers thread start-up across the window. With
+# "burst_interval" set, every thread issues "burst_ops" operations at each
+# interval boundary and then idles, so all clients hit the service at once
+# (e.g. access tokens expiring together).
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from bench_aep201 import PASSWORD, load_auth_module
+
+OPERATIONS = (
+    'verify', 'login', 'login_wrong_password', 'login_unknown_user',
+    'refresh', 'logout', 'request_reset', 'register',
+)
+
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    'steady_verify': {
+        'users': 2000,
+        'phases': [
+            {'name': 'steady', 'duration': 20, 'threads': 16,
+             'mix': {'verify': 90, 'refresh': 5, 'login': 4, 'logout': 1}},
+        ],
+    },
+    'morning_login_storm': {
+        'users': 5000,
+        'phases': [
+            {'name': 'overnight', 'duration': 5, 'threads': 4,
+             'mix': {'verify': 95, 'login': 5}, 'think_ms': 5},
+            {'name': 'storm', 'duration': 15, 'threads': 32, 'ramp_seconds': 5,
+             'mix': {'login': 70, 'login_wrong_password': 5, 'verify': 25}},
+            {'name': 'settle', 'duration': 5, 'threads': 16,
+             'mix': {'verify': 90, 'refresh': 10}},
+        ],
+    },
+    'refresh_storm': {
+        'users': 5000,
+        'sessions_per_thread': 8,
+        'phases': [
+            {'name': 'warm', 'duration': 5, 'threads': 32,
+             'mix': {'verify': 90, 'login': 10}},
+            {'name': 'expiry_waves', 'duration': 15, 'threads': 32,
+             'burst_interval': 3, 'burst_ops': 16,
+             'mix': {'refresh': 90, 'verify': 10}},
+        ],
+    },
+    'credential_stuffing': {
+        'users': 2000,
+        'config': {
+            'login_rate_email_per_minute': 10, 'login_rate_email_burst': 5,
+            'login_rate_client_per_minute': 60, 'login_rate_client_burst': 20,
+        },
+        'phases': [
+            {'name': 'baseline', 'duration': 5, 'threads': 8,
+             'mix': {'verify': 85, 'login': 10, 'refresh': 5}},
+            {'name': 'attack', 'duration': 15, 'threads': 32,
+             'mix': {'login_wrong_password': 60, 'login_unknown_user': 25,
+                     'login': 5, 'verify': 10}},
+            {'name': 'recovery', 'duration': 5, 'threads': 8,
+             'mix': {'verify': 85, 'login': 10, 'refresh': 5}},
+        ],
+    },
+    'reset_flood': {
+        'users': 2000,
+        'phases': [
+            {'name': 'baseline', 'duration': 5, 'threads': 8,
+             'mix': {'verify': 90, 'login': 10}},
+            {'name': 'flood', 'duration': 15, 'threads': 32,
+             'mix': {'request_reset': 80, 'login': 10, 'verify': 10}},
+        ],
+    },
+}
+
+def load_scenario(name_or_path: str) -> Dict[str, Any]:
+    if name_or_path in SCENARIOS:
+        scenario = json.loads(json.dumps(SCENARIOS[name_or_path]))
+        scenario.setdefault('name', name_or_path)
+    else:
+        with open(name_or_path) as f:
+            scenario = json.load(f)
+        scenario.setdefault('name', os.path.splitext(os.path.basename(name_or_path))[0])
+    scenario.setdefault('users', 2000)
+    scenario.setdefault('sessions_per_thread', 4)
+    scenario.setdefault('config', {})
+    if not scenario.get('phases'):
+        raise ValueError(f"scenario {scenario['name']!r} has no phases")
+    for index, phase in enumerate(scenario['phases']):
+        phase.setdefault('name', f'phase{index}')
+        for key, default in (('duration', 10), ('threads', 8), ('think_ms', 0),
+                             ('ramp_seconds', 0), ('burst_interval', 0), ('burst_ops', 1)):
+            phase.setdefault(key, default)
+        unknown = set(phase.get('mix') or ()) - set(OPERATIONS)
+        if not phase.get('mix') or unknown:
+            raise ValueError(f"phase {phase['name']!r}: mix must use operations from {', '.join(OPERATIONS)}")
+    return scenario
+
+def percentile(sorted_samples: List[int], q: float) -> float:
+    return sorted_samples[int(q * (len(sorted_samples) - 1))] / 1000
+
+def rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak rather than current RSS, but still shows growth; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def make_email_service(auth):
+    class StubEmailService(auth.EmailService):
+        """Counts messages instead of talking to an SMTP server"""
+        def __init__(self, config):
+            super().__init__(config, async_delivery=False)
+            self.sent = 0
+            self._sent_lock = threading.Lock()
+
+        def deliver_now(self, to_email: str, subject: str, body: str) -> bool:
+            self.build_message(to_email, subject, body)
+            with self._sent_lock:
+                self.sent += 1
+            return True
+
+    return StubEmailService
+
+class Session:
+    __slots__ = ('email', 'access', 'refresh')
+
+    def __init__(self, email: str):
+        self.email = email
+        self.access: Optional[str] = None
+        self.refresh: Optional[str] = None
+
+class Client:
+    """One simulated client thread: a private slice of accounts and their sessions"""
+    def __init__(self, sim: 'Simulation', index: int, rng: random.Random):
+        self.sim = sim
+        self.service = sim.service
+        self.index = index
+        self.rng = rng
+        emails = sim.emails
+        per_thread = sim.scenario['sessions_per_thread']
+        self.sessions = [Session(emails[(index * per_thread + i) % len(emails)]) for i in range(per_thread)]
+        self.client_id = f'client-{sim.process_index}-{index}'
+        self.registered = 0
+
+    def _session(self) -> Session:
+        session = self.rng.choice(self.sessions)
+        if session.refresh is None:
+            self._login(session)
+        return session
+
+    def _login(self, session: Session) -> None:
+        result = self.service.login_user(session.email, PASSWORD, client_id=self.client_id)
+        session.access = result['access_token']
+        session.refresh = result['refresh_token']
+
+    def _random_email(self) -> str:
+        return self.rng.choice(self.sim.emails)
+
+    # Session setup done by _session() runs outside the timed region; each
+    # op_* returns the callable that is actually measured
+    def op_verify(self) -> Callable[[], Any]:
+        session = self._session()
+        return lambda: self.service.verify_token(session.access)
+
+    def op_login(self) -> Callable[[], Any]:
+        session = self.rng.choice(self.sessions)
+
+        def run():
+            self._login(session)
+        return run
+
+    def op_login_wrong_password(self) -> Callable[[], Any]:
+        email = self._random_email()
+        client_id = f'attacker-{self.sim.process_index}-{self.rng.randrange(4)}'
+        return lambda: self.service.login_user(email, 'Wrong' + PASSWORD, client_id=client_id)
+
+    def op_login_unknown_user(self) -> Callable[[], Any]:
+        email = f'nobody{self.rng.randrange(10 ** 9)}@loadsim.example.com'
+        client_id = f'attacker-{self.sim.process_index}-{self.rng.randrange(4)}'
+        return lambda: self.service.login_user(email, PASSWORD, client_id=client_id)
+
+    def op_refresh(self) -> Callable[[], Any]:
+        session = self._session()
+        token = session.refresh
+
+        def run():
+            try:
+                result = self.service.refresh_token(token)
+            except Exception:
+                session.refresh = None
+                raise
+            session.access = result['access_token']
+            session.refresh = result['refresh_token']
+        return run
+
+    def op_logout(self) -> Callable[[], Any]:
+        session = self._session()
+        token = session.refresh
+        session.access = session.refresh = None
+        return lambda: self.service.logout_user(token)
+
+    def op_request_reset(self) -> Callable[[], Any]:
+        email = self._random_email()
+        return lambda: self.service.request_password_reset(email)
+
+    def op_register(self) -> Callable[[], Any]:
+        self.registered += 1
+        email = f'new-{self.sim.seed}-{self.sim.process_index}-{self.index}-{self.registered}@loadsim.example.com'
+        return lambda: self.service.register_user(email, PASSWORD)
+
+class Simulation:
+    def __init__(self, auth, scenario: Dict[str, Any], seed: int, rounds: int,
+                 process_index: int = 0, sample_interval: float = 1.0):
+        self.auth = auth
+        self.scenario = scenario
+        self.seed = seed
+        self.process_index = process_index
+        self.sample_interval = sample_interval
+        config = auth.AuthConfig()
+        config.jwt_secret = 'loadsim-secret'
+        config.bcrypt_rounds = rounds
+        config.user_store = 'memory'
+        config.metrics_enabled = True
+        # Scenarios opt in to rate limiting through their config block
+        config.login_rate_email_per_minute = 0
+        config.login_rate_client_per_minute = 0
+        for key, value in scenario['config'].items():
+            if not hasattr(config, key):
+                raise ValueError(f"unknown AuthConfig setting {key!r}")
+            setattr(config, key, value)
+        self.email_service = make_email_service(auth)(config)
+        self.service = auth.AuthService(config=config, email_service=self.email_service)
+        password_hash = self.service.hash_password(PASSWORD)
+        self.emails = [f'user{i}@loadsim.example.com' for i in range(scenario['users'])]
+        rows = [(email, password_hash) for email in self.emails]
+        self.service.user_repo.create_users_batch(rows)
+
+    def run(self) -> List[Dict[str, Any]]:
+        return [self.run_phase(index, phase) for index, phase in enumerate(self.scenario['phases'])]
+
+    def run_phase(self, phase_index: int, phase: Dict[str, Any]) -> Dict[str, Any]:
+        threads = phase['threads']
+        ops = sorted(phase['mix'])
+        weights = [phase['mix'][op] for op in ops]
+        think = phase['think_ms'] / 1000
+        ramp = phase['ramp_seconds']
+        burst_interval = phase['burst_interval']
+        burst_ops = phase['burst_ops']
+        samples: List[Dict[str, List[int]]] = [{op: [] for op in ops} for _ in range(threads)]
+        outcomes: List[Dict[str, Dict[str, int]]] = [{op: {} for op in ops} for _ in range(threads)]
+        completed = [0] * threads
+        stop = threading.Event()
+        ready = threading.Barrier(threads + 1)
+        self.service.metrics.reset()
+
+        def client_loop(index: int) -> None:
+            rng = random.Random(f"{self.seed}-{self.process_index}-{phase_index}-{index}")
+            client = Client(self, index, rng)
+            local_samples = samples[index]
+            local_outcomes = outcomes[index]
+            clock = time.perf_counter_ns
+            ready.wait()
+            if ramp:
+                stop.wait(ramp * index / threads)
+            next_burst = time.perf_counter()
+            while not stop.is_set():
+                for _ in range(burst_ops if burst_interval else 1):
+                    op = rng.choices(ops, weights)[0]
+                    try:
+                        call = getattr(client, f'op_{op}')()
+                    except self.auth.AuthError:
+                        continue  # Session setup failed (e.g. rate limited); not the op under test
+                    op_start = clock()
+                    try:
+                        call()
+                        outcome = 'ok'
+                    except self.auth.AuthError as e:
+                        outcome = type(e).__name__
+                    local_samples[op].append(clock() - op_start)
+                    local_outcomes[op][outcome] = local_outcomes[op].get(outcome, 0) + 1
+                    completed[index] += 1
+                    if think:
+                        stop.wait(think)
+                if burst_interval:
+                    next_burst += burst_interval
+                    stop.wait(max(0.0, next_burst - time.perf_counter()))
+
+        pool = [threading.Thread(target=client_loop, args=(i,), daemon=True) for i in range(threads)]
+        for thread in pool:
+            thread.start()
+        ready.wait()
+        started = time.perf_counter()
+        timeline = []
+        last_ops = 0
+        deadline = started + phase['duration']
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            stop.wait(min(self.sample_interval, remaining))
+            total = sum(completed)
+            timeline.append({
+                'elapsed_seconds': round(time.perf_counter() - started, 3),
+                'ops': total - last_ops,
+                'rss_bytes': rss_bytes(),
+            })
+            last_ops = total
+        stop.set()
+        for thread in pool:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        merged_samples = {op: [s for local in samples for s in local[op]] for op in ops}
+        merged_outcomes: Dict[str, Dict[str, int]] = {op: {} for op in ops}
+        for local in outcomes:
+            for op, counts in local.items():
+                for outcome, count in counts.items():
+                    merged_outcomes[op][outcome] = merged_outcomes[op].get(outcome, 0) + count
+        lock_wait = self.service.metrics.snapshot()['histograms'].get('stage_seconds', {}).get('stage=lock_wait')
+        return {
+            'name': phase['name'],
+            'threads': threads,
+            'wall_seconds': wall,
+            'samples': merged_samples,
+            'outcomes': merged_outcomes,
+            'lock_wait': [lock_wait] if lock_wait else [],
+            'timeline': [timeline],
+            'emails_sent': self.email_service.sent,
+        }
+
+    def close(self) -> None:
+        self.service.hasher.shutdown()
+
+def run_simulation(scenario: Dict[str, Any], seed: int, rounds: int, process_index: int,
+                   sample_interval: float, with_logging: bool) -> List[Dict[str, Any]]:
+    auth = load_auth_module()
+    if with_logging:
+        auth.configure_logging()
+    else:
+        logging.disable(logging.INFO)
+    sim = Simulation(auth, scenario, seed, rounds, process_index, sample_interval)
+    try:
+        return sim.run()
+    finally:
+        sim.close()
+
+def merge_processes(runs: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    merged = runs[0]
+    for run in runs[1:]:
+        for phase, other in zip(merged, run):
+            phase['threads'] += other['threads']
+            phase['wall_seconds'] = max(phase['wall_seconds'], other['wall_seconds'])
+            phase['emails_sent'] += other['emails_sent']
+            phase['lock_wait'].extend(other['lock_wait'])
+            phase['timeline'].extend(other['timeline'])
+            for op, values in other['samples'].items():
+                phase['samples'][op].extend(values)
+            for op, counts in other['outcomes'].items():
+                for outcome, count in counts.items():
+                    phase['outcomes'][op][outcome] = phase['outcomes'][op].get(outcome, 0) + count
+    return merged
+
+def summarize_phase(phase: Dict[str, Any]) -> Dict[str, Any]:
+    wall = phase['wall_seconds']
+    operations = {}
+    total = 0
+    for op, values in phase['samples'].items():
+        values.sort()
+        total += len(values)
+        entry: Dict[str, Any] = {
+            'ops': len(values),
+            'ops_per_sec': len(values) / wall if wall else 0.0,
+            'outcomes': phase['outcomes'][op],
+        }
+        if values:
+            entry.update(p50_us=percentile(values, 0.50), p95_us=percentile(values, 0.95),
+                         p99_us=percentile(values, 0.99), max_us=values[-1] / 1000)
+        operations[op] = entry
+
+    waits = phase['lock_wait']
+    lock_count = sum(w['count'] for w in waits)
+    lock_total = sum(w['sum_seconds'] for w in waits)
+    # Per-process timelines line up sample-by-sample; sum them into one
+    timeline = []
+    previous = 0.0
+    for samples in zip(*phase['timeline']):
+        elapsed = max(s['elapsed_seconds'] for s in samples)
+        timeline.append({
+            'elapsed_seconds': elapsed,
+            'ops_per_sec': sum(s['ops'] for s in samples) / max(elapsed - previous, 1e-9),
+            'rss_bytes': sum(s['rss_bytes'] for s in samples),
+        })
+        previous = elapsed
+    rss = [point['rss_bytes'] for point in timeline]
+    return {
+        'name': phase['name'],
+        'threads': phase['threads'],
+        'wall_seconds': wall,
+        'ops': total,
+        'ops_per_sec': total / wall if wall else 0.0,
+        'operations': operations,
+        'lock_contention': {
+            'acquisitions': lock_count,
+            'wait_seconds': lock_total,
+            'mean_wait_us': lock_total / lock_count * 1e6 if lock_count else 0.0,
+            'p99_wait_us': max((w['p99_seconds'] for w in waits), default=0.0) * 1e6,
+            'wait_share_of_wall': lock_total / (wall * phase['threads']) if wall else 0.0,
+        },
+        'memory': {
+            'rss_start_bytes': rss[0] if rss else 0,
+            'rss_end_bytes': rss[-1] if rss else 0,
+            'rss_growth_bytes': rss[-1] - rss[0] if rss else 0,
+        },
+        'emails_sent': phase['emails_sent'],
+        'timeline': timeline,
+    }
+
+def print_phase(summary: Dict[str, Any]) -> None:
+    print(f"== {summary['name']}: {summary['threads']} threads, {summary['wall_seconds']:.1f}s, "
+          f"{summary['ops_per_sec']:.1f} ops/s")
+    for op, entry in summary['operations'].items():
+        line = f"  {op:<22} {entry['ops']:>9} ops {entry['ops_per_sec']:>10.1f} ops/s"
+        if 'p50_us' in entry:
+            line += (f"  p50 {entry['p50_us']:>9.1f}us  p95 {entry['p95_us']:>9.1f}us"
+                     f"  p99 {entry['p99_us']:>9.1f}us")
+        outcomes = ', '.join(f'{k}={v}' for k, v in sorted(entry['outcomes'].items()))
+        print(f"{line}  [{outcomes}]")
+    lock = summary['lock_contention']
+    memory = summary['memory']
+    print(f"  lock waits {lock['acquisitions']} (mean {lock['mean_wait_us']:.1f}us, "
+          f"p99 {lock['p99_wait_us']:.1f}us, {lock['wait_share_of_wall'] * 100:.2f}% of thread time)")
+    print(f"  rss {memory['rss_start_bytes'] / 2**20:.1f}MiB -> {memory['rss_end_bytes'] / 2**20:.1f}MiB "
+          f"({memory['rss_growth_bytes'] / 2**20:+.1f}MiB), emails sent {summary['emails_sent']}", flush=True)
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Scenario-driven load simulator for AEP-201 AuthService')
+    parser.add_argument('--scenario', default='steady_verify',
+                        help='built-in scenario name or path to a scenario JSON file')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rounds', type=int, default=4, help='bcrypt cost for seeded accounts')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='run the scenario in N processes, each with its own service')
+    parser.add_argument('--duration-scale', type=float, default=1.0,
+                        help='multiply every phase duration (e.g. 0.1 for a quick smoke run)')
+    parser.add_argument('--sample-interval', type=float, default=1.0,
+                        help='seconds between throughput/RSS timeline samples')
+    parser.add_argument('--output', help='write the full report as JSON')
+    parser.add_argument('--with-logging', action='store_true', help='keep INFO logging enabled')
+    parser.add_argument('--list', action='store_true', help='list built-in scenarios and exit')
+    parser.add_argument('--dump-scenario', metavar='NAME', help='print a built-in scenario as JSON and exit')
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.list:
+        for name, scenario in SCENARIOS.items():
+            phases = ', '.join(p['name'] for p in scenario['phases'])
+            print(f"{name:<22} {phases}")
+        return 0
+    if args.dump_scenario:
+        print(json.dumps(load_scenario(args.dump_scenario), indent=2))
+        return 0
+
+    scenario = load_scenario(args.scenario)
+    for phase in scenario['phases']:
+        phase['duration'] *= args.duration_scale
+        phase['ramp_seconds'] *= args.duration_scale
+        phase['burst_interval'] *= args.duration_scale
+    print(f"scenario {scenario['name']} seed {args.seed}, {args.processes} process(es), "
+          f"{scenario['users']} users", flush=True)
+
+    sim_args = (scenario, args.seed, args.rounds)
+    if args.processes == 1:
+        runs = [run_simulation(*sim_args, 0, args.sample_interval, args.with_logging)]
+    else:
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(args.processes) as pool:
+            runs = pool.starmap(run_simulation, [
+                (*sim_args, index, args.sample_interval, args.with_logging)
+                for index in range(args.processes)
+            ])
+    phases = [summarize_phase(phase) for phase in merge_processes(runs)]
+    for summary in phases:
+        print_phase(summary)
+
+    if args.output:
+        report = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'params': {k: v for k, v in vars(args).items() if k not in ('output', 'list', 'dump_scenario')},
+            'scenario': scenario,
+            'phases': phases,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
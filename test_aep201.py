@@ -0,0 +1,1305 @@
+# Tests for AEP-201.py
+#
+# Run offline with pytest: bcrypt runs at its minimum cost, outbound email is
+# recorded in memory or sent to the in-process SMTP stub from bench_aep201.py.
+#
+#   python -m pytest -q test_aep201.py
+
+import asyncio
+import gc
+import hmac
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, List, Tuple
+
+import pytest
+
+from bench_aep201 import MODULE_PATH, SMTPStubServer, load_auth_module
+
+auth = load_auth_module()
+
+PASSWORD = 'TestPassword123!'
+NEW_PASSWORD = 'NewPassword456!'
+
+def make_config(tmp_path=None, **overrides):
+    config = auth.AuthConfig()
+    config.jwt_secret = 'test-secret'
+    config.bcrypt_rounds = 4
+    config.bcrypt_target_ms = 0
+    config.user_store = 'memory'
+    config.persistence_dir = ''
+    config.session_store = 'local'
+    config.token_sweep_interval_seconds = 0
+    config.login_rate_email_per_minute = 0
+    config.login_rate_client_per_minute = 0
+    config.max_failed_attempts = 3
+    config.email_async_delivery = False
+    if tmp_path is not None:
+        config.sqlite_path = str(tmp_path / 'users.db')
+        config.session_shm_path = str(tmp_path / 'sessions')
+        config.session_shm_slots = 1024
+    for key, value in overrides.items():
+        setattr(config, key, value)
+    return config
+
+class RecordingEmailService(auth.EmailService):
+    """Keeps every outgoing message instead of talking SMTP"""
+    def __init__(self, config):
+        super().__init__(config, async_delivery=False)
+        self.sent: List[Tuple[str, str, str]] = []
+
+    def deliver_now(self, to_email: str, subject: str, body: str) -> bool:
+        self.sent.append((to_email, subject, body))
+        return True
+
+    def last_reset_token(self) -> str:
+        return re.search(r'Reset Token:</strong> (\S+)</p>', self.sent[-1][2]).group(1)
+
+def make_service(config) -> Tuple[Any, RecordingEmailService]:
+    email_service = RecordingEmailService(config)
+    return auth.AuthService(config=config, email_service=email_service), email_service
+
+# -- sync/async parity ----------------------------------------------------
+
+OPAQUE_KEYS = {'id', 'user_id', 'access_token', 'refresh_token', 'sub'}
+
+def _normalize(value: Any) -> Any:
+    """Blank out values that differ by construction (ids, tokens, timestamps)"""
+    if isinstance(value, dict):
+        return {key: '<opaque>' if key in OPAQUE_KEYS else _normalize(item) for key, item in value.items()}
+    if isinstance(value, auth.TokenPayload):
+        return {'email': value.email}
+    return value
+
+def _outcome(call: Callable[..., Any], method: str, *args) -> Tuple[str, Any]:
+    try:
+        return 'ok', _normalize(call(method, *args))
+    except auth.AuthError as e:
+        return type(e).__name__, (e.code, e.message)
+
+def run_scenario(call: Callable[..., Any], email_service: RecordingEmailService) -> List[Tuple[str, Any]]:
+    """Drive one service through every public flow; returns each step's outcome"""
+    email = 'parity@example.com'
+    results = []
+    step = lambda method, *args: results.append((method, _outcome(call, method, *args)))
+
+    step('register_user', email, PASSWORD)
+    step('register_user', email, PASSWORD)
+    step('register_user', 'not-an-email', PASSWORD)
+    step('register_user', 'weak@example.com', 'weak')
+
+    login = call('login_user', email, PASSWORD)
+    user_id = login['user']['id']
+    step('verify_token', login['access_token'])
+    step('verify_token', 'not.a.token')
+
+    refreshed = call('refresh_token', login['refresh_token'])
+    step('refresh_token', login['refresh_token'])
+    step('refresh_token', refreshed['refresh_token'])
+
+    step('login_user', email, 'WrongPassword1!')
+    step('login_user', 'missing@example.com', PASSWORD)
+    step('login_user', email, PASSWORD)
+
+    step('request_password_reset', 'missing@example.com')
+    step('request_password_reset', email)
+    reset_token = email_service.last_reset_token()
+    step('reset_password', 'bogus-token', NEW_PASSWORD)
+    step('reset_password', reset_token, 'weak')
+    step('reset_password', reset_token, NEW_PASSWORD)
+    step('reset_password', reset_token, NEW_PASSWORD)
+    step('verify_token', login['access_token'])
+
+    step('change_password', user_id, PASSWORD, 'Another789!')
+    step('change_password', user_id, NEW_PASSWORD, 'Another789!')
+    step('login_user', email, NEW_PASSWORD)
+
+    session = call('login_user', email, 'Another789!')
+    step('logout_user', session['refresh_token'])
+    step('refresh_token', session['refresh_token'])
+    call('login_user', email, 'Another789!')
+    step('logout_all_sessions', user_id)
+
+    for _ in range(3):
+        step('login_user', email, 'WrongPassword1!')
+    step('login_user', email, 'Another789!')
+
+    step('deactivate_user', user_id)
+    step('deactivate_user', 'missing-user')
+    step('request_password_reset', email)
+    step('change_password', user_id, 'Another789!', NEW_PASSWORD)
+
+    results.append(('emails', [(to, subject) for to, subject, _ in email_service.sent]))
+    return results
+
+def run_sync(config) -> List[Tuple[str, Any]]:
+    service, email_service = make_service(config)
+    try:
+        return run_scenario(lambda method, *args: getattr(service, method)(*args), email_service)
+    finally:
+        service.user_repo.close()
+
+def run_async(config) -> List[Tuple[str, Any]]:
+    service, email_service = make_service(config)
+    async_service = auth.AsyncAuthService(service)
+    loop = asyncio.new_event_loop()
+    try:
+        return run_scenario(
+            lambda method, *args: loop.run_until_complete(getattr(async_service, method)(*args)),
+            email_service
+        )
+    finally:
+        loop.close()
+        service.user_repo.close()
+
+@pytest.mark.parametrize('store', ['memory', 'sqlite', 'shared'])
+def test_sync_and_async_services_behave_the_same(tmp_path, store):
+    overrides = {'user_store': 'sqlite' if store != 'memory' else 'memory'}
+    if store == 'shared':
+        overrides['session_store'] = 'shared'
+    sync_dir = tmp_path / 'sync'
+    async_dir = tmp_path / 'async'
+    sync_dir.mkdir()
+    async_dir.mkdir()
+
+    expected = run_sync(make_config(sync_dir, **overrides))
+    actual = run_async(make_config(async_dir, **overrides))
+
+    assert actual == expected
+    # The scenario must exercise both outcomes, or the comparison proves nothing
+    outcomes = {outcome for _, (outcome, _) in expected[:-1]}
+    assert {'ok', 'ValidationError', 'AuthenticationError', 'TokenError'} <= outcomes
+
+def test_async_parity_under_concurrent_logins():
+    config = make_config()
+    service, _ = make_service(config)
+    async_service = auth.AsyncAuthService(service)
+    emails = [f'user{i}@example.com' for i in range(20)]
+    for email in emails:
+        service.register_user(email, PASSWORD)
+
+    async def login_all():
+        return await asyncio.gather(*(
+            async_service.login_user(email, PASSWORD if i % 2 else 'WrongPassword1!')
+            for i, email in enumerate(emails)
+        ), return_exceptions=True)
+
+    results = asyncio.run(login_all())
+    for i, result in enumerate(results):
+        if i % 2:
+            assert service.verify_token(result['access_token']).email == emails[i]
+        else:
+            assert isinstance(result, auth.AuthenticationError) and result.code == 401
+            assert service.user_repo.find_by_email(emails[i]).failed_login_attempts == 1
+
+@pytest.mark.parametrize('store, inline', [('memory', True), ('sqlite', False)])
+def test_async_service_keeps_blocking_stores_off_the_loop(tmp_path, store, inline):
+    service, _ = make_service(make_config(tmp_path, user_store=store))
+    async_service = auth.AsyncAuthService(service)
+    try:
+        assert (async_service.user_repo._executor is None) == inline
+    finally:
+        service.user_repo.close()
+
+# -- background email delivery ------------------------------------------
+
+@pytest.fixture
+def smtp():
+    with SMTPStubServer() as server:
+        yield server
+
+def make_delivery_queue(smtp, **overrides):
+    config = make_config(
+        smtp_host='127.0.0.1', smtp_port=smtp.port, smtp_use_tls=False, email_async_delivery=True,
+        email_workers=1, email_retry_backoff_seconds=0.01, **overrides
+    )
+    return auth.EmailService(config).delivery_queue
+
+def test_email_queue_delivers_over_one_reused_session(smtp):
+    delivery_queue = make_delivery_queue(smtp)
+    for i in range(5):
+        assert delivery_queue.enqueue(f'user{i}@example.com', 'Subject', 'Body')
+    assert delivery_queue.flush(10)
+
+    stats = delivery_queue.stats()
+    assert smtp.messages == 5
+    assert (stats['sent'], stats['failed'], stats['queue_depth']) == (5, 0, 0)
+    assert stats['connections_opened'] == smtp.connections == 1
+    delivery_queue.close(10)
+
+def test_email_queue_reconnects_after_message_limit(smtp):
+    delivery_queue = make_delivery_queue(smtp, smtp_max_messages_per_connection=2)
+    for i in range(5):
+        delivery_queue.enqueue(f'user{i}@example.com', 'Subject', 'Body')
+    assert delivery_queue.flush(10)
+
+    assert smtp.messages == 5
+    assert delivery_queue.stats()['connections_opened'] == 3
+    delivery_queue.close(10)
+
+def test_email_queue_retries_transient_failures(smtp):
+    delivery_queue = make_delivery_queue(smtp, email_max_retries=3)
+    smtp.fail_next = 2
+    delivery_queue.enqueue('retry@example.com', 'Subject', 'Body')
+    assert delivery_queue.flush(10)
+
+    stats = delivery_queue.stats()
+    assert smtp.messages == 1
+    assert (stats['sent'], stats['retried'], stats['failed']) == (1, 2, 0)
+    assert delivery_queue.dead_letters() == []
+    delivery_queue.close(10)
+
+def test_email_queue_dead_letters_permanent_and_exhausted_failures(smtp):
+    delivery_queue = make_delivery_queue(smtp, email_max_retries=1)
+    smtp.rejected.append(b'gone@example.com')
+    delivery_queue.enqueue('gone@example.com', 'Rejected', 'Body')
+    assert delivery_queue.flush(10)
+    smtp.fail_next = 2
+    delivery_queue.enqueue('busy@example.com', 'Exhausted', 'Body')
+    delivery_queue.enqueue('ok@example.com', 'Delivered', 'Body')
+    assert delivery_queue.flush(10)
+
+    stats = delivery_queue.stats()
+    assert smtp.messages == 1
+    # The 550 is permanent and never retried; the 451s use up the single retry
+    assert (stats['sent'], stats['failed'], stats['retried'], stats['dead_letters']) == (1, 2, 1, 2)
+    rejected, exhausted = delivery_queue.dead_letters()
+    assert (rejected.to_email, rejected.subject) == ('gone@example.com', 'Rejected')
+    assert '550' in rejected.error
+    assert (exhausted.to_email, exhausted.subject) == ('busy@example.com', 'Exhausted')
+    assert '451' in exhausted.error
+    delivery_queue.close(10)
+
+EXIT_WITH_QUEUED_EMAIL = r"""
+import importlib.util, sys
+spec = importlib.util.spec_from_file_location('aep201', sys.argv[1])
+auth = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(auth)
+config = auth.AuthConfig()
+config.smtp_host, config.smtp_port, config.smtp_use_tls = '127.0.0.1', int(sys.argv[2]), False
+config.email_async_delivery = True
+config.email_workers = 1
+email_service = auth.EmailService(config)
+for i in range(20):
+    email_service.send_password_reset_email(f'user{i}@example.com', 'token')
+"""
+
+def test_queued_emails_are_delivered_at_interpreter_exit(smtp):
+    subprocess.run(
+        [sys.executable, '-c', EXIT_WITH_QUEUED_EMAIL, MODULE_PATH, str(smtp.port)],
+        check=True, timeout=60
+    )
+    assert smtp.messages == 20
+
+# -- token expiry sweep ---------------------------------------------------
+
+def test_sweep_evicts_in_bounded_batches_and_compacts_stale_heap_entries():
+    repo = auth.UserRepository(sweep_batch_size=10)
+    now = auth.datetime.now(auth.timezone.utc)
+    for i in range(45):
+        repo.store_refresh_token('user-1', f'expired{i}', now - auth.timedelta(seconds=1))
+    for i in range(100):
+        repo.store_refresh_token('user-2', f'live{i}', now + auth.timedelta(days=1))
+    # Removed live tokens leave stale entries that would sit in the heap for a day
+    for i in range(90):
+        repo.remove_refresh_token(f'live{i}')
+
+    stats = repo.cleanup_expired_tokens()
+
+    assert stats.evicted_refresh_tokens == 45
+    assert stats.batches == 1 + 5  # the empty reset pass, then refresh batches of at most 10
+    assert stats.compacted_entries == 90
+    assert len(repo._refresh_tokens) == len(repo._user_sessions['user-2']) == 10
+    assert sorted(key for _, key in repo._refresh_expiry) == sorted(repo._refresh_tokens)
+    assert repo.get_refresh_token_user('live95') == 'user-2'
+
+def test_expiry_heap_stays_bounded_by_live_sessions_under_rotation():
+    repo = auth.UserRepository(sweep_batch_size=10)
+    user = repo.create_user('rotating@example.com', 'hash')
+    expiry = auth.datetime.now(auth.timezone.utc) + auth.timedelta(days=7)
+    tokens = [f'session{i}' for i in range(20)]
+    for token in tokens:
+        repo.store_refresh_token(user.id, token, expiry)
+    # A week of hourly refreshes per session, with the periodic sweep running
+    for hour in range(168):
+        for i, token in enumerate(tokens):
+            tokens[i] = f'{token}.{hour}'
+            repo.rotate_refresh_token(token, tokens[i], expiry)
+        repo.cleanup_expired_tokens()
+        assert len(repo._refresh_expiry) <= 2 * len(tokens) + repo.sweep_batch_size
+
+    assert all(repo.get_refresh_token_user(token) == user.id for token in tokens)
+
+def test_expiry_heap_compaction_keeps_pushes_made_while_it_rebuilds():
+    repo = auth.UserRepository(sweep_batch_size=10)
+    expiry = auth.datetime.now(auth.timezone.utc) + auth.timedelta(seconds=60)
+    for i in range(50):
+        repo.store_refresh_token('user-1', f'old{i}', expiry)
+        repo.remove_refresh_token(f'old{i}')
+    tokens = repo._refresh_tokens
+
+    class PushDuringCopy(dict):
+        def items(self):
+            # Runs after the push log is opened, before the rebuilt heap is swapped in
+            snapshot = list(tokens.items())
+            repo.store_refresh_token('user-2', 'pushed-mid-compaction', expiry)
+            return snapshot
+
+    assert repo._compact_expiry(PushDuringCopy(), '_refresh_expiry', '_refresh_pushes', repo._refresh_lock) == 50
+    assert [key for _, key in repo._refresh_expiry] == [auth.token_digest('pushed-mid-compaction')]
+    assert repo._refresh_pushes is None
+
+def _sweep_in_forked_child(results) -> None:
+    service, _ = make_service(make_config(token_sweep_interval_seconds=0.05))
+    deadline = time.monotonic() + 10
+    while service.user_repo.last_sweep is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    results.put(service.user_repo.last_sweep is not None)
+
+def test_sweep_scheduler_restarts_its_thread_in_a_forked_child():
+    parent, _ = make_service(make_config(token_sweep_interval_seconds=60))
+    assert auth._sweep_scheduler._thread.is_alive()
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    child = context.Process(target=_sweep_in_forked_child, args=(results,))
+    child.start()
+    assert results.get(timeout=30)
+    child.join()
+    del parent
+
+# -- logging setup --------------------------------------------------------
+
+CONFIGURE_LOGGING = r"""
+import importlib.util, logging, sys
+spec = importlib.util.spec_from_file_location('aep201', sys.argv[1])
+auth = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(auth)
+if sys.argv[3] == 'configured':
+    logging.basicConfig(handlers=[logging.NullHandler()])
+auth.configure_logging(log_file=sys.argv[2], stream=False)
+"""
+
+@pytest.mark.parametrize('configured', [False, True])
+def test_configure_logging_only_opens_the_log_file_it_installs(tmp_path, configured):
+    log_file = tmp_path / 'auth.log'
+    subprocess.run(
+        [sys.executable, '-c', CONFIGURE_LOGGING, MODULE_PATH, str(log_file),
+         'configured' if configured else 'fresh'],
+        check=True, timeout=60
+    )
+    assert log_file.exists() is not configured
+
+# -- durable in-memory store ----------------------------------------------
+
+def open_durable(directory) -> Any:
+    return auth.DurableUserRepository(str(directory), commit_window_seconds=0)
+
+def test_durable_store_replays_its_journal_after_a_restart(tmp_path):
+    expiry = auth.datetime.now(auth.timezone.utc) + auth.timedelta(days=1)
+    repo = open_durable(tmp_path)
+    alice = repo.create_user('alice@example.com', 'hash-a')
+    bob = repo.create_user('bob@example.com', 'hash-b')
+    for _ in range(2):
+        repo.record_login_attempt(alice.id, False, 5, 900)
+    repo.record_login_attempt(bob.id, True, 5, 900, password_hash='rehashed-b')
+    repo.store_refresh_token(alice.id, 'alice-1', expiry)
+    repo.store_refresh_token(alice.id, 'alice-2', expiry)
+    repo.rotate_refresh_token('alice-2', 'alice-3', expiry)
+    repo.store_reset_token('bob@example.com', 'reset-bob', expiry)
+    repo.close()
+
+    repo = open_durable(tmp_path)
+    assert repo.recovery['snapshot_records'] == 0
+    assert repo.recovery['journal_records'] > 0
+    assert repo.find_by_email('alice@example.com').failed_login_attempts == 2
+    restored_bob = repo.find_by_id(bob.id)
+    assert (restored_bob.password_hash, restored_bob.failed_login_attempts) == ('rehashed-b', 0)
+    assert restored_bob.last_login is not None
+    assert repo.get_refresh_token_user('alice-1') == alice.id
+    assert repo.get_refresh_token_user('alice-2') is None
+    assert repo.get_refresh_token_user('alice-3') == alice.id
+    assert repo.get_reset_token_email('reset-bob') == 'bob@example.com'
+    assert repo.revoke_user_sessions(alice.id) == 2
+    repo.close()
+
+def test_durable_store_truncates_a_torn_last_record(tmp_path):
+    repo = open_durable(tmp_path)
+    repo.create_user('kept@example.com', 'hash')
+    repo.flush()
+    path = repo._journal.path
+    good_end = os.path.getsize(path)
+    repo.create_user('torn@example.com', 'hash')
+    repo.close()
+    # The crash cut the last record in half
+    os.truncate(path, (good_end + os.path.getsize(path)) // 2)
+
+    repo = open_durable(tmp_path)
+    assert repo.find_by_email('kept@example.com') is not None
+    assert repo.find_by_email('torn@example.com') is None
+    assert os.path.getsize(path) == good_end
+    repo.create_user('after@example.com', 'hash')
+    repo.close()
+
+    repo = open_durable(tmp_path)
+    assert [user.email for user in repo._users.values()] == ['kept@example.com', 'after@example.com']
+    repo.close()
+
+def test_durable_store_recovers_from_a_snapshot_plus_the_journal_tail(tmp_path):
+    expiry = auth.datetime.now(auth.timezone.utc) + auth.timedelta(days=1)
+    repo = open_durable(tmp_path)
+    users = [repo.create_user(f'snap{i}@example.com', 'hash') for i in range(10)]
+    for i, user in enumerate(users):
+        repo.store_refresh_token(user.id, f'snap-session{i}', expiry)
+    snapshot = repo.snapshot()
+    # The tail: one update, one removal and one new user after the snapshot
+    repo.record_login_attempt(users[0].id, False, 5, 900)
+    repo.remove_refresh_token('snap-session1')
+    late = repo.create_user('late@example.com', 'hash')
+    repo.close()
+
+    assert sorted(os.listdir(tmp_path)) == ['journal.%08d.log' % snapshot['generation'], 'snapshot.bin']
+    repo = open_durable(tmp_path)
+    assert repo.recovery['snapshot_records'] == 20
+    assert repo.recovery['journal_records'] == 3
+    assert len(repo._users) == 11
+    assert repo.find_by_id(users[0].id).failed_login_attempts == 1
+    assert repo.get_refresh_token_user('snap-session0') == users[0].id
+    assert repo.get_refresh_token_user('snap-session1') is None
+    assert repo.find_by_email('late@example.com').id == late.id
+    repo.close()
+
+# -- SQLite store ---------------------------------------------------------
+
+def test_sqlite_closes_each_threads_connection_when_the_thread_ends(tmp_path):
+    repo = auth.SQLiteUserRepository(str(tmp_path / 'users.db'))
+    user = repo.create_user('threads@example.com', 'hash')
+
+    def lookup():
+        assert repo.find_by_id(user.id).email == 'threads@example.com'
+
+    for _ in range(20):
+        thread = threading.Thread(target=lookup)
+        thread.start()
+        thread.join()
+    del thread
+    gc.collect()
+
+    assert len(repo._connections) == 1  # this thread's
+    repo.close()
+
+# -- atomic compound operations -------------------------------------------
+
+STRESS_THREADS = 8
+STRESS_ROUNDS = 10
+STRESS_ATTEMPTS = 25
+
+def _run_concurrently(target: Callable[[], Any], count: int) -> None:
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+@pytest.mark.parametrize('store', ['memory', 'sqlite', 'shared'])
+def test_concurrent_refreshes_and_failed_logins_are_atomic(tmp_path, store):
+    overrides = {'user_store': 'memory' if store == 'memory' else 'sqlite', 'max_failed_attempts': 10 ** 9}
+    if store == 'shared':
+        overrides['session_store'] = 'shared'
+    service, _ = make_service(make_config(tmp_path, **overrides))
+    service.register_user('stress@example.com', PASSWORD)
+
+    for _ in range(STRESS_ROUNDS):
+        token = service.login_user('stress@example.com', PASSWORD)['refresh_token']
+        barrier = threading.Barrier(STRESS_THREADS)
+        wins = []
+
+        def redeem() -> None:
+            barrier.wait()
+            try:
+                wins.append(service.refresh_token(token))
+            except auth.TokenError:
+                pass
+        _run_concurrently(redeem, STRESS_THREADS)
+        assert len(wins) == 1
+
+    def fail_logins() -> None:
+        for _ in range(STRESS_ATTEMPTS):
+            with pytest.raises(auth.AuthenticationError):
+                service.login_user('stress@example.com', 'WrongPassword1!')
+    _run_concurrently(fail_logins, STRESS_THREADS)
+
+    user = service.user_repo.find_by_email('stress@example.com')
+    assert user.failed_login_attempts == STRESS_THREADS * STRESS_ATTEMPTS
+    service.user_repo.close()
+
+def _sqlite_stress_worker(path: str, user_id: str, index: int, barrier, results) -> None:
+    repo = auth.SQLiteUserRepository(path)
+    expiry = auth.datetime.now(auth.timezone.utc) + auth.timedelta(days=1)
+    wins = []
+    for round_ in range(STRESS_ROUNDS):
+        barrier.wait()
+        try:
+            repo.rotate_refresh_token(f'round{round_}', f'round{round_}-worker{index}', expiry)
+            wins.append(round_)
+        except auth.TokenError:
+            pass
+    barrier.wait()
+    for _ in range(STRESS_ATTEMPTS):
+        repo.record_login_attempt(user_id, False, 10 ** 9, 60)
+    repo.close()
+    results.put(wins)
+
+def test_sqlite_compound_operations_are_atomic_across_processes(tmp_path):
+    path = str(tmp_path / 'users.db')
+    repo = auth.SQLiteUserRepository(path)
+    user = repo.create_user('stress@example.com', 'hash')
+    expiry = auth.datetime.now(auth.timezone.utc) + auth.timedelta(days=1)
+    for round_ in range(STRESS_ROUNDS):
+        repo.store_refresh_token(user.id, f'round{round_}', expiry)
+    repo.flush()
+
+    context = multiprocessing.get_context('fork')
+    processes = 4
+    barrier = context.Barrier(processes)
+    results = context.Queue()
+    workers = [
+        context.Process(target=_sqlite_stress_worker, args=(path, user.id, i, barrier, results))
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    wins = [round_ for _ in workers for round_ in results.get(timeout=60)]
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    # Each token was redeemed exactly once, and its replacement is the only one stored
+    assert sorted(wins) == list(range(STRESS_ROUNDS))
+    for round_ in range(STRESS_ROUNDS):
+        assert repo.get_refresh_token_user(f'round{round_}') is None
+        winners = [i for i in range(processes) if repo.get_refresh_token_user(f'round{round_}-worker{i}')]
+        assert len(winners) == 1
+    assert repo.find_by_id(user.id).failed_login_attempts == processes * STRESS_ATTEMPTS
+    repo.close()
+
+# -- bulk import ----------------------------------------------------------
+
+def test_import_reports_bad_rows_without_aborting():
+    service, _ = make_service(make_config())
+    existing = service.hash_password(PASSWORD)
+    rows = [
+        {'email': 'good@example.com', 'password': PASSWORD},
+        {'email': 'int-password@example.com', 'password': 12345678},
+        {'email': 'int-hash@example.com', 'password_hash': 123},
+        {'email': 42, 'password': PASSWORD},
+        {'email': 'not-an-email', 'password': PASSWORD},
+        {'email': 'weak@example.com', 'password': 'weak'},
+        {'email': 'nopassword@example.com'},
+        {'_error': 'Malformed JSON: boom'},
+        ['not', 'a', 'mapping'],
+        {'email': 'good@example.com', 'password': PASSWORD},
+        {'email': 'hashed@example.com', 'password_hash': existing},
+    ]
+
+    report = service.import_users(rows, batch_size=4)
+
+    assert (report.total, report.imported, report.failed) == (11, 2, 9)
+    assert [(error.row, error.message) for error in report.errors] == [
+        (2, 'password must be a string'),
+        (3, 'password_hash must be a string'),
+        (4, 'email must be a string'),
+        (5, 'Invalid email format'),
+        (6, 'Password must be at least 8 characters long'),
+        (7, 'Row needs a password or password_hash'),
+        (8, 'Malformed JSON: boom'),
+        (9, "Unexpected error: AttributeError(\"'list' object has no attribute 'get'\")"),
+        (10, 'Email already registered'),
+    ]
+    assert service.login_user('good@example.com', PASSWORD)['user']['email'] == 'good@example.com'
+    assert service.login_user('hashed@example.com', PASSWORD)['user']['email'] == 'hashed@example.com'
+
+# -- snapshot export ------------------------------------------------------
+
+EXPORT_USERS = 40
+EXPORT_BATCH = 5
+
+@pytest.mark.parametrize('store', ['memory', 'sqlite'])
+def test_export_under_login_load_matches_the_snapshot(tmp_path, store):
+    service, _ = make_service(make_config(tmp_path, user_store=store))
+    emails = [f'export{i}@example.com' for i in range(EXPORT_USERS)]
+    for email in emails:
+        service.register_user(email, PASSWORD)
+        service.login_user(email, PASSWORD)
+    expected = ''.join(service.export_snapshot(batch_size=EXPORT_BATCH))
+
+    stop = threading.Event()
+    logins = []
+
+    def log_in() -> None:
+        while not stop.is_set():
+            for email in emails:
+                service.login_user(email, PASSWORD)
+                logins.append(email)
+
+    chunks = service.export_snapshot(batch_size=EXPORT_BATCH)
+    exported = [next(chunks)]
+    workers = [threading.Thread(target=log_in) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    try:
+        passed = set()
+        for chunk in chunks:
+            passed.update(re.findall(r'"user_id": "([^"]+)"', exported[-1]))
+            if store == 'memory':
+                # Writers copy nothing for users the export is done with
+                cursor = service.user_repo._snapshots[0]
+                assert passed.isdisjoint(list(cursor.users))
+                assert passed.isdisjoint(list(cursor.sessions))
+            exported.append(chunk)
+            time.sleep(0.01)
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+    assert len(logins) > EXPORT_USERS
+    assert ''.join(exported) == expected
+    if store == 'memory':
+        assert service.user_repo._snapshots == []
+    service.user_repo.close()
+
+# -- shared session table -------------------------------------------------
+
+CRASH_TOKENS = [auth.token_digest(f'crash{i}') for i in range(8)]
+
+def _crashing_session_writer(path: str, ready) -> None:
+    # Every write changes both the user id (and its length) and the expiry it
+    # encodes, so a torn slot shows up as a mismatch between the two
+    table = auth.SharedSessionTable(path, capacity=64, stripe_slots=64)
+    ready.set()
+    n = 10 ** 9
+    while True:
+        n += 7
+        table.store(CRASH_TOKENS[n % len(CRASH_TOKENS)], f'user-{n}' + 'x' * (n % 13), n)
+
+def _check_entry(entry) -> None:
+    if entry is not None:
+        user_id, expires_at = entry
+        assert user_id.rstrip('x') == f'user-{expires_at}' and len(user_id) == len(f'user-{expires_at}') + expires_at % 13
+
+def test_shared_sessions_never_expose_torn_entries_after_writer_crashes(tmp_path):
+    path = str(tmp_path / 'sessions')
+    # One stripe, so every write and every repair hits the same seqlock
+    table = auth.SharedSessionTable(path, capacity=64, stripe_slots=64)
+    context = multiprocessing.get_context('fork')
+    reader = auth.SharedSessionTable(path)
+    stop = threading.Event()
+    torn = []
+
+    def read_continuously() -> None:
+        while not stop.is_set():
+            for digest in CRASH_TOKENS:
+                try:
+                    _check_entry(reader.lookup(digest))
+                except AssertionError as e:
+                    torn.append(e)
+    reader_thread = threading.Thread(target=read_continuously)
+    reader_thread.start()
+    # Whichever side next takes the stripe lock repairs an interrupted update
+    repairs = lambda: table.repairs + reader.repairs
+
+    rng = auth.secrets.SystemRandom()
+    kills = 0
+    try:
+        # Keep killing writers at random points until some died mid-update
+        while repairs() < 3 and kills < 500:
+            ready = context.Event()
+            writer = context.Process(target=_crashing_session_writer, args=(path, ready))
+            writer.start()
+            ready.wait(10)
+            time.sleep(rng.uniform(0.001, 0.01))
+            writer.kill()
+            writer.join()
+            kills += 1
+            table.store(auth.token_digest('survivor'), 'user-survivor', int(time.time()) + 60)
+    finally:
+        stop.set()
+        reader_thread.join()
+        reader.close()
+
+    assert repairs() >= 3, f'no writer died mid-update in {kills} kills'
+    assert torn == []
+    for digest in CRASH_TOKENS:
+        _check_entry(table.lookup(digest))
+    assert table.get(auth.token_digest('survivor')) == 'user-survivor'
+    table.close()
+
+def test_shared_sessions_revoke_one_users_sessions_across_processes(tmp_path):
+    path = str(tmp_path / 'sessions')
+    table = auth.SharedSessionTable(path, capacity=4096)
+    expires_at = int(time.time()) + 3600
+    for i in range(200):
+        table.store(auth.token_digest(f'other{i}'), f'user{i % 20}', expires_at)
+
+    # Another worker issues some of the target's sessions
+    context = multiprocessing.get_context('fork')
+    def issue(start: int) -> None:
+        worker_table = auth.SharedSessionTable(path)
+        for i in range(start, start + 5):
+            worker_table.store(auth.token_digest(f'target{i}'), 'target', expires_at)
+        worker_table.close()
+    worker = context.Process(target=issue, args=(0,))
+    worker.start()
+    worker.join()
+    issue(5)
+    table.remove(auth.token_digest('target9'))
+
+    assert table.remove_owner('target') == 9
+    assert all(table.get(auth.token_digest(f'target{i}')) is None for i in range(10))
+    assert all(table.get(auth.token_digest(f'other{i}')) == f'user{i % 20}' for i in range(200))
+    assert table.remove_owner('target') == 0
+    assert table.owners._index_owned('target') == []
+    table.close()
+
+def test_shared_sessions_revoke_a_user_whose_sessions_overflow_a_stripe(tmp_path):
+    table = auth.SharedSessionTable(str(tmp_path / 'sessions'), capacity=1024, stripe_slots=64)
+    expires_at = int(time.time()) + 60
+    for i in range(300):
+        table.store(auth.token_digest(f'busy{i}'), 'busy', expires_at)
+    for i in range(100):
+        table.store(auth.token_digest(f'other{i}'), f'user{i}', expires_at)
+
+    assert len(table.owners._index_owned('busy')) == 300
+    assert table.remove_owner('busy') == 300
+    assert all(table.get(auth.token_digest(f'busy{i}')) is None for i in range(300))
+    assert all(table.get(auth.token_digest(f'other{i}')) == f'user{i}' for i in range(100))
+    assert table.owners._index_owned('busy') == []
+    table.close()
+
+def test_shared_sessions_index_entries_written_before_the_owner_index(tmp_path):
+    path = str(tmp_path / 'sessions')
+    legacy = auth.SharedSessionTable(path, capacity=256, owner_index=False)
+    legacy.store(auth.token_digest('old'), 'user-1', int(time.time()) + 60)
+    legacy.close()
+
+    table = auth.SharedSessionTable(path)
+    assert table.remove_owner('user-1') == 1
+    assert table.get(auth.token_digest('old')) is None
+    table.close()
+
+# -- access tokens --------------------------------------------------------
+
+# Issued by PyJWT 2.8.0: jwt.encode(claims, secret, algorithm='HS256', headers=...)
+PYJWT_SECRET = 'pyjwt-test-secret'
+PYJWT_ROTATED_SECRET = 'pyjwt-rotated-secret'
+PYJWT_CLAIMS = ('user-42', 'alice@example.com', 4102444800, 1700000000)
+PYJWT_TOKEN = (
+    'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.'
+    'eyJzdWIiOiJ1c2VyLTQyIiwiZW1haWwiOiJhbGljZUBleGFtcGxlLmNvbSIsImV4cCI6NDEwMjQ0NDgwMCwiaWF0IjoxNzAwMDAwMDAwfQ.'
+    'r_Hdts_Pt3yUT8QsN5k91griv8sHBRZaoG_7G-su38g'
+)
+PYJWT_KID_TOKEN = (
+    'eyJhbGciOiJIUzI1NiIsImtpZCI6IjIwMjQtMDEiLCJ0eXAiOiJKV1QifQ.'
+    'eyJzdWIiOiJ1c2VyLTQyIiwiZW1haWwiOiJhbGljZUBleGFtcGxlLmNvbSIsImV4cCI6NDEwMjQ0NDgwMCwiaWF0IjoxNzAwMDAwMDAwfQ.'
+    '66AmNuotN8Kv6NWoRN_cuS3H-5ccwgmlVFHImrUqSIE'
+)
+PYJWT_EXPIRED_TOKEN = (
+    'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.'
+    'eyJzdWIiOiJ1c2VyLTQyIiwiZW1haWwiOiJhbGljZUBleGFtcGxlLmNvbSIsImV4cCI6MTYwMDAwMDAwMCwiaWF0IjoxNTAwMDAwMDAwfQ.'
+    'PFFjSMJwA8Tu_V5H-1W0EPQQMQGuZBpLHEA6ZqU-pQM'
+)
+PYJWT_INT_SUB_TOKEN = (
+    'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.'
+    'eyJzdWIiOjQyLCJlbWFpbCI6ImFsaWNlQGV4YW1wbGUuY29tIiwiZXhwIjo0MTAyNDQ0ODAwLCJpYXQiOjE3MDAwMDAwMDB9.'
+    'XI1OZ7PUuY-Se0fZY2IC2RfGimEkKBsu2Ppd9oTqBQs'
+)
+PYJWT_LIST_EMAIL_TOKEN = (
+    'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.'
+    'eyJzdWIiOiJ1c2VyLTQyIiwiZW1haWwiOlsiYWxpY2VAZXhhbXBsZS5jb20iXSwiZXhwIjo0MTAyNDQ0ODAwLCJpYXQiOjE3MDAwMDAwMDB9.'
+    'zLuvd6a6vcT8Mv8DWfcut49jky7Lm7QxwM0vwyeG4xo'
+)
+
+def make_hs256_codec(active_kid=None):
+    key_ring = auth.TokenKeyRing({None: PYJWT_SECRET, '2024-01': PYJWT_ROTATED_SECRET}, active_kid)
+    return auth.HS256TokenCodec(key_ring)
+
+@pytest.mark.parametrize('active_kid, token', [(None, PYJWT_TOKEN), ('2024-01', PYJWT_KID_TOKEN)])
+def test_hs256_tokens_match_pyjwt_byte_for_byte(active_kid, token):
+    codec = make_hs256_codec(active_kid)
+    assert codec.encode(*PYJWT_CLAIMS) == token
+    payload = make_hs256_codec().decode(token)
+    assert (payload.user_id, payload.email, payload.expires_at, payload.issued_at) == PYJWT_CLAIMS
+
+def test_hs256_rejects_expired_tampered_and_mistyped_tokens():
+    codec = make_hs256_codec()
+    with pytest.raises(auth.TokenError, match='expired'):
+        codec.decode(PYJWT_EXPIRED_TOKEN)
+    header, payload, signature = PYJWT_TOKEN.split('.')
+    with pytest.raises(auth.TokenError, match='Invalid token'):
+        codec.decode(f'{header}.{payload}.{signature[:-2]}AA')
+    with pytest.raises(auth.TokenError, match='Invalid token'):
+        auth.HS256TokenCodec(auth.TokenKeyRing({None: 'other-secret'})).decode(PYJWT_TOKEN)
+    for token in (PYJWT_INT_SUB_TOKEN, PYJWT_LIST_EMAIL_TOKEN):
+        with pytest.raises(auth.TokenError, match='Invalid token'):
+            codec.decode(token)
+
+def test_verified_token_cache_hits_expires_and_stays_bounded():
+    cache = auth.VerifiedTokenCache(max_size=3)
+    now = int(time.time())
+    payload = lambda expires_at: auth.TokenPayload('user-1', 'cache@example.com', expires_at, now)
+
+    assert cache.get('token-a') is None
+    cache.put('token-a', payload(now + 60))
+    assert cache.get('token-a') == payload(now + 60)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # An entry past its exp is a miss and is dropped on lookup
+    cache.put('token-expired', payload(now - 1))
+    assert cache.get('token-expired') is None
+    assert cache.stats()['size'] == 1
+
+    # Least recently used entries go first once max_size is reached
+    for name in ('token-b', 'token-c'):
+        cache.put(name, payload(now + 60))
+    cache.get('token-a')
+    cache.put('token-d', payload(now + 60))
+    assert cache.stats()['size'] == 3
+    assert cache.get('token-b') is None
+    assert all(cache.get(name) is not None for name in ('token-a', 'token-c', 'token-d'))
+
+    # Entries verified under an older key ring generation no longer count
+    assert cache.get('token-a', generation=1) is None
+    assert cache.get('token-a') is None
+    assert auth.VerifiedTokenCache(max_size=0).get('token-a') is None
+
+def test_verified_token_cache_stops_accepting_tokens_of_a_removed_key():
+    service, _ = make_service(make_config())
+    service.register_user('cached@example.com', PASSWORD)
+    token = service.login_user('cached@example.com', PASSWORD)['access_token']
+    assert service.verify_token(token).email == 'cached@example.com'
+    assert service.verify_token(token).email == 'cached@example.com'
+    assert service.token_cache.hits == 1
+
+    key_ring = service.token_codec.key_ring
+    key_ring.add_key('k2', 'second-secret', activate=True)
+    # Adding a key leaves tokens of the old one cached
+    assert service.verify_token(token).email == 'cached@example.com'
+    assert service.token_cache.hits == 2
+    key_ring.remove_key(None)
+
+    with pytest.raises(auth.TokenError):
+        service.verify_access_token(token)
+    with pytest.raises(auth.TokenError):
+        service.verify_token(token)
+    fresh = service.login_user('cached@example.com', PASSWORD)['access_token']
+    assert service.verify_token(fresh).email == 'cached@example.com'
+
+def test_shared_session_tables_on_one_path_share_their_locks(tmp_path):
+    path = str(tmp_path / 'sessions')
+    first = auth.SharedSessionTable(path, capacity=256)
+    second = auth.SharedSessionTable(path, capacity=256)
+    assert first._fd == second._fd
+
+    held = threading.Event()
+    release = threading.Event()
+    acquired = []
+
+    def hold() -> None:
+        with first._stripe_locked(0):
+            held.set()
+            release.wait(10)
+
+    def contend() -> None:
+        with second._stripe_locked(0):
+            acquired.append(release.is_set())
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait(10)
+    contender = threading.Thread(target=contend)
+    contender.start()
+    time.sleep(0.2)
+    assert acquired == []
+    release.set()
+    holder.join()
+    contender.join()
+    assert acquired == [True]
+
+    # Closing one table leaves the other's descriptor, and so its locks, alone
+    first.close()
+    second.store(auth.token_digest('after-close'), 'user-1', int(time.time()) + 60)
+    assert second.get(auth.token_digest('after-close')) == 'user-1'
+    second.close()
+    assert auth.SharedSessionTable._open_files == {}
+
+# -- asymmetric access tokens ---------------------------------------------
+
+def _forge(token: str, header: dict, signature: bytes) -> str:
+    payload = token.split('.')[1]
+    encoded = auth._b64url_encode(json.dumps(header).encode('utf-8'))
+    return f'{encoded}.{payload}.{auth._b64url_encode(signature)}'
+
+def make_jws_codec(*algorithms):
+    keys = {f'{algorithm}-key': auth.generate_signing_key(algorithm) for algorithm in algorithms}
+    return auth.JWSTokenCodec(auth.AsymmetricKeyRing(keys, active_kid=next(iter(keys))))
+
+@pytest.mark.parametrize('algorithm', ['ES256', 'EdDSA'])
+def test_asymmetric_tokens_round_trip_through_service_and_verifier(algorithm):
+    service, _ = make_service(make_config(jwt_algorithm=algorithm))
+    service.register_user('signed@example.com', PASSWORD)
+    token = service.login_user('signed@example.com', PASSWORD)['access_token']
+
+    header = json.loads(auth._b64url_decode(token.split('.')[0]))
+    assert header['alg'] == algorithm
+    assert service.verify_access_token(token).email == 'signed@example.com'
+    assert auth.TokenVerifier(service.get_jwks).verify(token).email == 'signed@example.com'
+    header_segment, payload, signature = token.split('.')
+    with pytest.raises(auth.TokenError):
+        service.verify_access_token(f'{header_segment}.{payload}.{signature[:-4]}AAAA')
+
+def test_jwks_export_and_import_round_trip():
+    codec = make_jws_codec('ES256', 'EdDSA')
+    codec.key_ring.activate('EdDSA-key')
+    eddsa_token = codec.encode('user-1', 'jwks@example.com', int(time.time()) + 60, int(time.time()))
+    jwks = json.loads(json.dumps(codec.key_ring.jwks()))
+
+    imported = auth.AsymmetricKeyRing.from_jwks(jwks)
+
+    assert sorted(imported.kids()) == ['ES256-key', 'EdDSA-key']
+    assert imported.jwks() == jwks
+    assert {jwk['alg'] for jwk in jwks['keys']} == {'ES256', 'EdDSA'}
+    assert all('d' not in jwk for jwk in jwks['keys'])
+    assert auth.JWSTokenCodec(imported).decode(eddsa_token).email == 'jwks@example.com'
+    with pytest.raises(ValueError):
+        imported.signing_state()
+
+def test_jws_rejects_headers_whose_alg_does_not_match_the_key():
+    codec = make_jws_codec('ES256', 'EdDSA')
+    token = codec.encode('user-1', 'alg@example.com', int(time.time()) + 60, int(time.time()))
+    signature = auth._b64url_decode(token.split('.')[2])
+    public_key = codec.key_ring._public['ES256-key']
+    public_pem = public_key.public_bytes(
+        auth.serialization.Encoding.PEM, auth.serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    def hs256_with(secret: bytes) -> str:
+        unsigned = _forge(token, {'alg': 'HS256', 'kid': 'ES256-key', 'typ': 'JWT'}, b'')[:-1]
+        return unsigned + '.' + auth._b64url_encode(hmac.new(secret, unsigned.encode('ascii'), 'sha256').digest())
+
+    forged = [
+        _forge(token, {'alg': 'EdDSA', 'kid': 'ES256-key', 'typ': 'JWT'}, signature),
+        _forge(token, {'alg': 'none', 'kid': 'ES256-key', 'typ': 'JWT'}, b''),
+        _forge(token, {'alg': 'none', 'typ': 'JWT'}, b''),
+        hs256_with(public_pem),
+        hs256_with(json.dumps(auth.public_jwk(public_key, 'ES256-key')).encode('utf-8')),
+    ]
+    verifier = auth.TokenVerifier(codec.key_ring.jwks)
+    for candidate in forged:
+        with pytest.raises(auth.TokenError, match='Invalid token'):
+            codec.decode(candidate)
+        with pytest.raises(auth.TokenError, match='Invalid token'):
+            verifier.verify(candidate)
+    # The HS256 codec takes neither alg none nor asymmetric headers either
+    with pytest.raises(auth.TokenError, match='Invalid token'):
+        make_hs256_codec().decode(_forge(PYJWT_TOKEN, {'alg': 'none', 'typ': 'JWT'}, b''))
+    assert codec.decode(token).email == 'alg@example.com'
+
+class JWKSSource:
+    """Counts fetches of an issuer's JWKS; raises while ``failing``"""
+    def __init__(self, key_ring):
+        self.key_ring = key_ring
+        self.fetches = 0
+        self.failing = False
+
+    def __call__(self):
+        self.fetches += 1
+        if self.failing:
+            raise OSError('JWKS endpoint unreachable')
+        return json.loads(json.dumps(self.key_ring.jwks()))
+
+def test_verifier_refreshes_for_an_unknown_kid_at_most_once_per_interval():
+    codec = make_jws_codec('ES256')
+    source = JWKSSource(codec.key_ring)
+    verifier = auth.TokenVerifier(source, min_refresh_interval_seconds=0.2)
+    now = int(time.time())
+    old_token = codec.encode('user-1', 'old@example.com', now + 60, now)
+    assert verifier.verify(old_token).email == 'old@example.com'
+    assert source.fetches == 1
+
+    codec.key_ring.add_key('rotated', auth.generate_signing_key('EdDSA'), activate=True)
+    new_token = codec.encode('user-1', 'new@example.com', now + 60, now)
+    # Too soon after the initial load: no refetch, the unknown kid is rejected
+    with pytest.raises(auth.TokenError):
+        verifier.verify(new_token)
+    assert source.fetches == 1
+    time.sleep(0.25)
+    assert verifier.verify(new_token).email == 'new@example.com'
+    assert (source.fetches, verifier.refreshes) == (2, 2)
+
+    # A failing endpoint is retried no more than once per interval, and the
+    # keys already loaded keep working meanwhile
+    source.failing = True
+    codec.key_ring.add_key('rotated-again', auth.generate_signing_key('ES256'), activate=True)
+    unknown = codec.encode('user-1', 'unknown@example.com', now + 60, now)
+    time.sleep(0.25)
+    for _ in range(5):
+        with pytest.raises(auth.TokenError):
+            verifier.verify(unknown)
+    assert (source.fetches, verifier.refresh_failures) == (3, 1)
+    assert verifier.verify(old_token).email == 'old@example.com'
+    assert verifier.stats()['keys'] == 2
+
+# -- login rate limiting --------------------------------------------------
+
+class CountingHasher(auth.HashingExecutor):
+    def __init__(self):
+        super().__init__(max_workers=1, max_queue=4, rounds=4)
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        return super().submit(fn, *args)
+
+@pytest.mark.parametrize('limit', ['email', 'client'])
+def test_throttled_logins_are_rejected_before_any_hashing(limit):
+    config = make_config(**{f'login_rate_{limit}_per_minute': 1, f'login_rate_{limit}_burst': 2})
+    hasher = CountingHasher()
+    service = auth.AuthService(config=config, email_service=RecordingEmailService(config), hasher=hasher)
+    service.register_user('throttled@example.com', PASSWORD)
+    with pytest.raises(auth.AuthenticationError):
+        service.login_user('throttled@example.com', 'WrongPassword1!', client_id='client-1')
+    service.login_user('throttled@example.com', PASSWORD, client_id='client-1')
+    submitted = hasher.submitted
+
+    with pytest.raises(auth.RateLimitError) as excinfo:
+        service.login_user('throttled@example.com', PASSWORD, client_id='client-1')
+
+    assert excinfo.value.code == 429
+    assert hasher.submitted == submitted
+    hasher.shutdown()
+
+def test_rate_limiter_evicts_least_recently_used_buckets():
+    limiter = auth.RateLimiter(per_minute=1, burst=1, max_keys=3)
+    assert limiter.allow('a') and not limiter.allow('a')
+    assert limiter.allow('b') and limiter.allow('c')
+    assert not limiter.allow('a')  # touching 'a' makes 'b' the oldest
+    for i in range(100):
+        limiter.allow(f'client{i}')
+        assert limiter.stats()['keys'] <= 3
+
+    # An evicted key starts over with a full bucket
+    assert limiter.allow('a')
+    assert limiter.stats() == {'keys': 3, 'max_keys': 3, 'allowed': 104, 'rejected': 2}
+
+# -- bcrypt cost ----------------------------------------------------------
+
+def test_login_rehashes_a_below_target_hash_exactly_once():
+    service, _ = make_service(make_config())
+    service.register_user('rehash@example.com', PASSWORD)
+    assert auth.bcrypt_cost(service.user_repo.find_by_email('rehash@example.com').password_hash) == 4
+
+    config = make_config(bcrypt_rounds=5)
+    upgraded = auth.AuthService(config=config, user_repo=service.user_repo, email_service=RecordingEmailService(config))
+    for _ in range(3):
+        upgraded.login_user('rehash@example.com', PASSWORD)
+
+    assert upgraded.rehash_count == 1
+    assert auth.bcrypt_cost(upgraded.user_repo.find_by_email('rehash@example.com').password_hash) == 5
+    # The old cost still verifies what the new one wrote
+    service.login_user('rehash@example.com', PASSWORD)
+
+@pytest.mark.parametrize('target_ms, expected', [(1e-6, 4), (1e9, 6)])
+def test_bcrypt_calibration_stays_within_the_configured_bounds(target_ms, expected):
+    calibration = auth.calibrate_bcrypt_rounds(target_ms, min_rounds=4, max_rounds=6)
+    assert calibration['rounds'] == expected
+    assert set(calibration['timings_ms']) <= {4, 5, 6}
+
+    config = make_config(bcrypt_target_ms=target_ms, bcrypt_min_rounds=4, bcrypt_max_rounds=6)
+    service, _ = make_service(config)
+    assert service.hasher.rounds == config.bcrypt_rounds == expected
+    service.register_user('calibrated@example.com', PASSWORD)
+    assert auth.bcrypt_cost(service.user_repo.find_by_email('calibrated@example.com').password_hash) == expected
+
+# -- hashing executor -----------------------------------------------------
+
+def test_hashing_executor_rejects_work_beyond_its_queue_instead_of_blocking():
+    hasher = auth.HashingExecutor(max_workers=1, max_queue=1, rounds=4)
+    release = threading.Event()
+    running = hasher.submit(release.wait, 10)
+    queued = hasher.submit_hash(PASSWORD)
+
+    started = time.perf_counter()
+    with pytest.raises(auth.ServiceOverloadedError) as excinfo:
+        hasher.hash_password(PASSWORD)
+    assert time.perf_counter() - started < 1
+    assert excinfo.value.code == 503
+    assert hasher.stats()['rejected'] == 1
+
+    release.set()
+    assert running.result(10) is True
+    assert auth.bcrypt_cost(queued.result(10).decode('utf-8')) == 4
+    # Capacity comes back once the backlog drains; slots free in done callbacks
+    deadline = time.monotonic() + 10
+    while hasher.stats()['pending'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert hasher.verify_password(PASSWORD, hasher.submit_hash(PASSWORD).result(10).decode('utf-8'))
+    hasher.shutdown()
+
+# -- concurrent registration ----------------------------------------------
+
+@pytest.mark.parametrize('store', ['memory', 'sqlite', 'durable'])
+def test_concurrent_duplicate_registrations_create_one_user(tmp_path, store):
+    if store == 'durable':
+        repo = open_durable(tmp_path / 'journal')
+    else:
+        repo = auth.create_user_store(make_config(tmp_path, user_store=store))
+    for round_ in range(20):
+        email = f'race{round_}@example.com'
+        barrier = threading.Barrier(STRESS_THREADS)
+        created, conflicts = [], []
+
+        def register() -> None:
+            barrier.wait()
+            try:
+                created.append(repo.create_user(email, 'hash'))
+            except auth.ConflictError as e:
+                conflicts.append(e.code)
+        _run_concurrently(register, STRESS_THREADS)
+
+        assert len(created) == 1
+        assert conflicts == [409] * (STRESS_THREADS - 1)
+        assert repo.find_by_email(email).id == created[0].id
+    repo.close()
+
+def test_duplicate_registration_through_the_service_is_a_409_conflict():
+    service, _ = make_service(make_config())
+    service.register_user('twice@example.com', PASSWORD)
+    with pytest.raises(auth.ConflictError) as excinfo:
+        service.register_user('TWICE@example.com', PASSWORD)
+    assert (excinfo.value.code, excinfo.value.message) == (409, 'Email already registered')
+    # Still a ValidationError for callers that only know that type
+    assert isinstance(excinfo.value, auth.ValidationError)
+
+# -- metrics --------------------------------------------------------------
+
+PROMETHEUS_SAMPLE = re.compile(r'^([a-z_]+)(?:\{(.*)\})? (\S+)$')
+
+def test_metrics_count_login_stages_and_outcomes_and_export_prometheus():
+    service, _ = make_service(make_config(metrics_enabled=True))
+    service.register_user('metrics@example.com', PASSWORD)
+    service.metrics.reset()
+    service.login_user('metrics@example.com', PASSWORD)
+    with pytest.raises(auth.AuthenticationError):
+        service.login_user('metrics@example.com', 'WrongPassword1!')
+
+    metrics = service.get_metrics()
+    stages = metrics['histograms']['stage_seconds']
+    assert stages['stage=verify_password']['count'] == 2
+    assert stages['stage=jwt_encode']['count'] == 1
+    assert stages['op=record_login_attempt,stage=repository']['count'] == 2
+    assert stages['op=store_refresh_token,stage=repository']['count'] == 1
+    assert metrics['histograms']['method_seconds']['method=login_user']['count'] == 2
+    assert metrics['counters']['outcomes_total'] == {
+        'method=login_user,outcome=success': 1,
+        'method=login_user,outcome=invalid_credentials': 1,
+    }
+    assert 'hasher' in metrics['components']
+
+    typed = {}
+    series = {}
+    for line in service.export_prometheus().splitlines():
+        if line.startswith('# TYPE '):
+            _, _, metric, kind = line.split(' ')
+            typed[metric] = kind
+            continue
+        name, labels, value = PROMETHEUS_SAMPLE.match(line).groups()
+        base = re.sub(r'_(bucket|sum|count)$', '', name) if name.endswith(('_bucket', '_sum', '_count')) else name
+        assert base in typed, f'{name} sampled before its # TYPE line'
+        if typed[base] != 'histogram':
+            continue
+        le = re.search(r'le="([^"]+)"', labels or '')
+        key = (base, re.sub(r',?le="[^"]+"', '', labels or ''))
+        entry = series.setdefault(key, {'buckets': []})
+        if le:
+            entry['buckets'].append((le.group(1), float(value)))
+        else:
+            entry[name[len(base) + 1:]] = float(value)
+
+    assert typed['aep_auth_stage_seconds'] == typed['aep_auth_method_seconds'] == 'histogram'
+    assert typed['aep_auth_outcomes_total'] == 'counter'
+    assert ('aep_auth_method_seconds', 'method="login_user"') in series
+    for (base, labels), entry in series.items():
+        counts = [count for _, count in entry['buckets']]
+        assert counts == sorted(counts), f'{base}{{{labels}}} buckets decrease'
+        assert entry['buckets'][-1] == ('+Inf', entry['count'])
+        assert entry['sum'] >= 0
+    assert series[('aep_auth_stage_seconds', 'stage="verify_password"')]['count'] == 2
+
+# -- async logging --------------------------------------------------------
+
+class CapturingHandler(auth.logging.Handler):
+    """Collects messages on the listener thread; can hold it inside emit()"""
+    def __init__(self, hold: bool = False):
+        super().__init__()
+        self.messages: List[str] = []
+        self.entered = threading.Event()
+        self.unblock = threading.Event()
+        if not hold:
+            self.unblock.set()
+
+    def emit(self, record) -> None:
+        self.entered.set()
+        self.unblock.wait(10)
+        self.messages.append(record.getMessage())
+
+@pytest.fixture
+def pipeline_logger():
+    log = auth.logging.getLogger('aep201.test.pipeline')
+    log.setLevel(auth.logging.INFO)
+    yield log
+    auth.logging.getLogger().handlers[:] = [
+        handler for handler in auth.logging.getLogger().handlers
+        if not isinstance(handler, auth._BoundedQueueHandler)
+    ]
+
+def test_log_pipeline_drops_and_counts_records_when_full(pipeline_logger):
+    capture = CapturingHandler(hold=True)
+    pipeline = auth.AsyncLogPipeline(max_queue=2, handlers=[capture])
+    pipeline.start()
+    roles = ['admin']
+    pipeline_logger.info("first")
+    assert capture.entered.wait(10)
+    # The listener is stuck in emit(): two records fit in the queue, three don't
+    pipeline_logger.info("roles: %s", roles)
+    roles.append('root')
+    for i in range(4):
+        pipeline_logger.info("record %d", i)
+    capture.unblock.set()
+    pipeline.stop()
+
+    assert capture.messages == ['first', "roles: ['admin']", 'record 0']
+    stats = pipeline.stats()
+    assert (stats['enqueued'], stats['dropped'], stats['depth']) == (3, 3, 0)
+
+def test_log_pipeline_samples_success_events_at_the_configured_rate(pipeline_logger):
+    capture = CapturingHandler()
+    pipeline = auth.AsyncLogPipeline(max_queue=1000, success_sample_rate=0.25, handlers=[capture])
+    pipeline.start()
+    for i in range(100):
+        pipeline_logger.info("login %d", i, extra=auth._SAMPLED)
+    for i in range(10):
+        pipeline_logger.warning("failure %d", i)
+    pipeline.stop()
+
+    assert sum(message.startswith('login') for message in capture.messages) == 25
+    assert sum(message.startswith('failure') for message in capture.messages) == 10
+    assert pipeline.stats()['sampled_out'] == 75
+    # Stopping twice, or before starting, is harmless
+    pipeline.stop()
+    auth.AsyncLogPipeline(handlers=[]).stop()